@@ -0,0 +1,200 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Minimal non-blocking HTTP/1.1 client for the asyncio engine.
+
+Only what the API tasks need is implemented: keep-alive connection pools
+per host, Content-Length and chunked response bodies, and TLS.
+"""
+
+import asyncio
+import collections
+import json
+import ssl
+from urllib import parse
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from requests import structures
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_pools = {}
+_stats = {'requests': 0, 'connections': 0}
+
+
+class Response(object):
+    """The parts of requests.Response used by the tasks."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class _ConnectionPool(object):
+
+    def __init__(self, scheme, host, port, size):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self._idle = collections.deque()
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        ssl_context = None
+        if self.scheme == 'https':
+            ssl_context = ssl.create_default_context()
+        _stats['connections'] += 1
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context),
+            CONF.http_pool.connect_timeout)
+
+    async def request(self, method, target, headers, body):
+        async with self._slots:
+            reused = bool(self._idle)
+            if reused:
+                reader, writer = self._idle.popleft()
+            else:
+                reader, writer = await self._connect()
+            try:
+                response, keep = await asyncio.wait_for(
+                    self._exchange(reader, writer, method, target, headers,
+                                   body),
+                    CONF.http_pool.read_timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                # The server closed an idle connection, retry once on a
+                # new one.
+                reader, writer = await self._connect()
+                response, keep = await asyncio.wait_for(
+                    self._exchange(reader, writer, method, target, headers,
+                                   body),
+                    CONF.http_pool.read_timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if keep and CONF.http_pool.keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            _stats['requests'] += 1
+            return response
+
+    async def _exchange(self, reader, writer, method, target, headers, body):
+        lines = ['{0} {1} HTTP/1.1'.format(method, target),
+                 'Host: {0}:{1}'.format(self.host, self.port),
+                 'Content-Length: {}'.format(len(body))]
+        for name, value in headers.items():
+            if value is not None:
+                lines.append('{0}: {1}'.format(name, value))
+        if not CONF.http_pool.keep_alive:
+            lines.append('Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') +
+                     body)
+        await writer.drain()
+
+        head = await reader.readuntil(b'\r\n\r\n')
+        head_lines = head.decode('latin-1').split('\r\n')
+        version, status = head_lines[0].split(' ', 2)[:2]
+        response_headers = structures.CaseInsensitiveDict()
+        for line in head_lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                response_headers[name.strip()] = value.strip()
+        keep = (version == 'HTTP/1.1' and
+                response_headers.get('Connection', '').lower() != 'close')
+        if response_headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0],
+                           16)
+                if not size:
+                    # Skip trailers
+                    while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'Content-Length' in response_headers:
+            content = await reader.readexactly(
+                int(response_headers['Content-Length']))
+        elif method == 'HEAD' or status in ('204', '304'):
+            content = b''
+        else:
+            content = await reader.read()
+            keep = False
+        return Response(int(status), response_headers, content), keep
+
+
+def _pool_size():
+    if CONF.http_pool.pool_size:
+        return CONF.http_pool.pool_size
+    return CONF.task_flow.max_workers
+
+
+async def request(method, url, data=None, params=None, headers=None):
+    """Sends a request, reusing a pooled connection when one is idle.
+
+    :returns: Response
+    """
+    parts = parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    key = (parts.scheme, parts.hostname, port)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = _ConnectionPool(parts.scheme, parts.hostname,
+                                             port, _pool_size())
+    target = parts.path or '/'
+    query = parts.query
+    if params:
+        extra = parse.urlencode(params, doseq=True)
+        query = '{0}&{1}'.format(query, extra) if query else extra
+    if query:
+        target = '{0}?{1}'.format(target, query)
+    if data is None:
+        body = b''
+    elif isinstance(data, bytes):
+        body = data
+    else:
+        body = data.encode('utf-8')
+    return await pool.request(method, target, headers or {}, body)
+
+
+def connection_stats():
+    """Returns connection usage counters like http_pool.connection_stats."""
+    return {'requests': _stats['requests'],
+            'connections': _stats['connections'],
+            'reused': max(_stats['requests'] - _stats['connections'], 0)}
+
+
+def log_connection_stats():
+    LOG.info('Async HTTP pool: {requests} requests over {connections} '
+             'connections, {reused} requests reused a kept-alive '
+             'connection.'.format(**connection_stats()))
+
+
+def close():
+    """Closes idle connections. Pools are bound to the loop that made them."""
+    for pool in _pools.values():
+        while pool._idle:
+            pool._idle.popleft()[1].close()
+    _pools.clear()
@@ -0,0 +1,142 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Runs TaskFlow flows on a single asyncio event loop.
+
+The flows built by TestFlows are walked directly: linear flows run their
+children in order, unordered flows run them concurrently.  Tasks that
+define an ``aexecute`` coroutine are awaited, any other task runs its
+``execute`` in the loop's default thread pool.  Symbols follow the
+TaskFlow scoping rules the test flows rely on: a task sees what was
+provided earlier in its enclosing flows, and sibling subflows do not see
+each other's results.
+"""
+
+import asyncio
+import collections
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from taskflow import flow as tf_flow
+from taskflow.patterns import linear_flow
+from taskflow.patterns import unordered_flow
+
+import aio_http
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def iter_atoms(flow):
+    """Yields every atom in a flow, depth first."""
+    for item in flow:
+        if isinstance(item, tf_flow.Flow):
+            for atom in iter_atoms(item):
+                yield atom
+        else:
+            yield item
+
+
+def _arguments(atom, scope):
+    kwargs = {}
+    for arg, symbol in atom.rebind.items():
+        if atom.inject and symbol in atom.inject:
+            kwargs[arg] = atom.inject[symbol]
+        elif symbol in scope:
+            kwargs[arg] = scope[symbol]
+        elif arg in atom.optional:
+            continue
+        else:
+            raise Exception('{0} requires {1} which was not provided '
+                            'before it ran.'.format(atom.name, symbol))
+    return kwargs
+
+
+def _save(atom, result):
+    provided = {}
+    for name, index in atom.save_as.items():
+        if index is None:
+            provided[name] = result
+        else:
+            provided[name] = result[index]
+    return provided
+
+
+async def _run_atom(atom, scope):
+    kwargs = _arguments(atom, scope)
+    LOG.debug('Task %s running', atom.name)
+    aexecute = getattr(atom, 'aexecute', None)
+    if aexecute is not None:
+        result = await aexecute(**kwargs)
+    else:
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(
+            None, lambda: atom.execute(**kwargs))
+    LOG.debug('Task %s done', atom.name)
+    return _save(atom, result)
+
+
+async def _run(item, scope):
+    """Runs a flow or atom.
+
+    :returns: The symbols it provided, visible to whatever runs after it.
+    """
+    if not isinstance(item, tf_flow.Flow):
+        return await _run_atom(item, scope)
+    provided = {}
+    child_scope = scope.new_child(provided)
+    if isinstance(item, linear_flow.Flow):
+        for child in item:
+            provided.update(await _run(child, child_scope))
+    elif isinstance(item, unordered_flow.Flow):
+        # Siblings must not see each other's results, so they are only
+        # published once all of them are done.
+        children = [asyncio.ensure_future(_run(child, child_scope))
+                    for child in item]
+        try:
+            results = await asyncio.gather(*children)
+        except BaseException:
+            for child in children:
+                child.cancel()
+            raise
+        for result in results:
+            provided.update(result)
+    else:
+        raise Exception('The asyncio engine does not support {0} '
+                        'flows.'.format(type(item).__name__))
+    return provided
+
+
+async def run_flow(flow, store=None):
+    """Runs a flow on the current event loop.
+
+    :param flow: The TaskFlow flow to run.
+    :param store: Initial symbols, like the engine store argument.
+    :returns: The symbols provided by the flow.
+    """
+    scope = collections.ChainMap(dict(store or {}))
+    try:
+        return await _run(flow, scope)
+    finally:
+        aio_http.log_connection_stats()
+        aio_http.close()
+
+
+def run(flow, store=None):
+    """Runs a flow to completion on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run_flow(flow, store))
+    finally:
+        loop.close()
@@ -0,0 +1,395 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measures the overhead of the client itself.
+
+A test flow is run with the real tasks against mock_octavia.py started
+with no delays, so nearly all of the time goes to the client and the
+stand-in.  Every engine and worker count runs in a fresh child process
+with a fresh mock, and reports:
+
+* requests per second, and per CPU second of the client process,
+* client CPU time per request, and the CPU per atom to load, compile
+  and prepare the engine,
+* engine CPU, the CPU of the thread running the engine outside the task
+  bodies (TaskFlow engines only, asyncio runs the task bodies on the
+  same thread),
+* with --allocations, in a separate traced run, the peak and retained
+  memory per request from tracemalloc.
+
+The CPU time of the mock is reported too, a saturated stand-in limits the
+numbers.  Save the results with --output and compare later runs against
+them with --baseline, the run exits with 1 when the CPU per request or the
+throughput of a case got worse than --tolerance.  Example::
+
+    python bench_client.py --engines serial,parallel,asyncio \\
+        --workers 1,10,50 --members 200 --output client.json
+"""
+
+import functools
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from oslo_config import cfg
+from oslo_config import types
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+bench_opts = [
+    cfg.ListOpt('engines', default=['serial', 'parallel', 'asyncio'],
+                help='Engines to run the flow with.'),
+    cfg.ListOpt('workers', item_type=types.Integer(min=1),
+                default=[1, 10, 50],
+                help='[task_flow] max_workers to run the parallel engine '
+                     'with. The other engines run once.'),
+    cfg.StrOpt('flow', default='multiple_members_flow',
+               help='Test flow to run.'),
+    cfg.IntOpt('load-balancers', default=1, min=1,
+               help='Load balancers in the tree.'),
+    cfg.IntOpt('members', default=100, min=1,
+               help='Members per pool.'),
+    cfg.IntOpt('repeat', default=3, min=1,
+               help='Runs of each case, the median by CPU per request is '
+                    'reported.'),
+    cfg.BoolOpt('allocations', default=True,
+                help='Run each case once more with tracemalloc for the '
+                     'memory per request.'),
+    cfg.IntOpt('timeout', default=600, min=1,
+               help='Seconds to give a single run.'),
+    cfg.StrOpt('output',
+               help='File to write the results to as JSON.'),
+    cfg.StrOpt('baseline',
+               help='Results of an earlier run to compare against.'),
+    cfg.FloatOpt('tolerance', default=0.15, min=0,
+                 help='Relative slowdown against the baseline that counts '
+                      'as a regression.'),
+]
+
+CONFIG = """[keystone_authtoken]
+username = bench
+password = bench
+project_name = bench
+project_domain_name = Default
+user_domain_name = Default
+auth_url = {url}/identity
+
+[task_flow]
+engine = {engine}
+max_workers = {workers}
+
+[test_params]
+api_endpoint = {url}/load-balancer
+test_flow = {flow}
+vip_subnet_id = bench-vip-subnet
+member_subnet_id = bench-member-subnet
+load_balancers = {load_balancers}
+members = {members}
+
+[status_poller]
+# The mock is ACTIVE straight away, long sleeps between polls only add
+# wall time.
+poll_interval = 0.01
+max_poll_interval = 0.01
+"""
+
+
+def _cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def _instrument(flow):
+    """Wraps the execute of every task to sum its CPU time.
+
+    Only task bodies run on the calling thread, the one running the
+    engine, are counted.
+
+    :returns: list holding the summed seconds, updated as tasks run.
+    """
+    import async_engine
+
+    total = [0.0]
+    engine_thread = threading.get_ident()
+
+    def wrap(execute):
+        @functools.wraps(execute)
+        def timed(*args, **kwargs):
+            if threading.get_ident() != engine_thread:
+                return execute(*args, **kwargs)
+            start = time.thread_time()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                total[0] += time.thread_time() - start
+        return timed
+
+    for atom in async_engine.iter_atoms(flow):
+        atom.execute = wrap(atom.execute)
+    return total
+
+
+def measure(params):
+    """Runs the flow once in this process and returns its costs."""
+    import async_engine
+    import metrics
+    import runner
+    import stressoctaviaapi  # noqa: F401 registers the test options
+
+    logging.register_options(CONF)
+    CONF(args=['--config-file', params['config_file']],
+         project='stressoctaviaapi')
+    logging.setup(CONF, 'bench_client')
+
+    flow = runner.build_flow()
+    atoms = sum(1 for _ in async_engine.iter_atoms(flow))
+    result = {'atoms': atoms}
+    eng = task_cpu = None
+    if params['engine'] != 'asyncio':
+        task_cpu = _instrument(flow)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        eng = runner.load_engine(flow)
+        result['setup_cpu_per_atom_us'] = (
+            _cpu_seconds(resource.getrusage(resource.RUSAGE_SELF)) -
+            _cpu_seconds(usage)) * 1000000 / atoms
+    if params['tracemalloc']:
+        tracemalloc.start()
+        traced_start = tracemalloc.get_traced_memory()[0]
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    engine_start = time.thread_time()
+    start = time.perf_counter()
+    runner.run_flow(flow, eng=eng)
+    wall = time.perf_counter() - start
+    engine_cpu = time.thread_time() - engine_start
+    cpu = _cpu_seconds(resource.getrusage(resource.RUSAGE_SELF)) - (
+        _cpu_seconds(usage))
+
+    requests = metrics.get_registry().report()['total_requests']
+    result.update({'requests': requests, 'wall_seconds': wall,
+                   'cpu_seconds': cpu,
+                   'errors': sum(metrics.get_registry().errors.values())})
+    if params['tracemalloc']:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak_kb_per_request'] = (
+            (peak - traced_start) / 1024.0 / max(requests, 1))
+        result['retained_kb_per_request'] = (
+            (current - traced_start) / 1024.0 / max(requests, 1))
+        return result
+    result['requests_per_second'] = requests / wall if wall else 0
+    result['requests_per_cpu_second'] = requests / cpu if cpu else 0
+    result['cpu_per_request_us'] = cpu * 1000000 / max(requests, 1)
+    if task_cpu is not None:
+        engine_cpu = max(engine_cpu - task_cpu[0], 0)
+        result['engine_cpu_share'] = engine_cpu / cpu if cpu else 0
+        result['engine_cpu_per_atom_us'] = engine_cpu * 1000000 / atoms
+    return result
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _start_mock():
+    port = _free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'mock_octavia.py'),
+         '--port', str(port), '--active-delay', '0', '--create-delay', '0'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            break
+        except OSError:
+            if mock.poll() is not None or time.time() > deadline:
+                mock.kill()
+                raise Exception('mock_octavia.py did not start.')
+            time.sleep(0.05)
+    return mock, 'http://127.0.0.1:{}'.format(port)
+
+
+def _stop_mock(mock):
+    """Stops the mock and returns the CPU seconds it used."""
+    mock.terminate()
+    _, _, usage = os.wait4(mock.pid, 0)
+    mock.returncode = 0
+    return _cpu_seconds(usage)
+
+
+def _run_child(case, traced):
+    mock, url = _start_mock()
+    with tempfile.NamedTemporaryFile('w', suffix='.conf',
+                                     delete=False) as f:
+        f.write(CONFIG.format(url=url, flow=CONF.flow,
+                              load_balancers=CONF.load_balancers,
+                              members=CONF.members, **case))
+    try:
+        out = subprocess.run(
+            [sys.executable, __file__, '--child',
+             json.dumps({'config_file': f.name, 'engine': case['engine'],
+                         'tracemalloc': traced})],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+            timeout=CONF.timeout)
+        # The child logs to stdout as well, the result is the last JSON
+        # line.
+        lines = [line for line in out.stdout.decode('utf-8').splitlines()
+                 if line.startswith('{')]
+        result = json.loads(lines[-1])
+    except subprocess.TimeoutExpired:
+        LOG.warning('{0} with {1} workers timed out after {2} '
+                    'seconds'.format(case['engine'], case['workers'],
+                                     CONF.timeout))
+        result = {'timed_out': True}
+    except subprocess.CalledProcessError as e:
+        LOG.warning('{0} with {1} workers failed with exit code '
+                    '{2}'.format(case['engine'], case['workers'],
+                                 e.returncode))
+        result = {'failed': True}
+    finally:
+        os.unlink(f.name)
+        server_cpu = _stop_mock(mock)
+    if not traced:
+        result['server_cpu_seconds'] = server_cpu
+    return result
+
+
+def run_case(case):
+    """Runs one engine and worker count and returns the median run."""
+    runs = [_run_child(case, False) for _ in range(CONF.repeat)]
+    good = [r for r in runs if 'cpu_per_request_us' in r]
+    if not good:
+        return dict(case, **runs[0])
+    median = statistics.median_low(r['cpu_per_request_us'] for r in good)
+    result = dict(case, runs=len(good),
+                  **[r for r in good if r['cpu_per_request_us'] == median][0])
+    result['cpu_per_request_us_spread'] = [
+        min(r['cpu_per_request_us'] for r in good),
+        max(r['cpu_per_request_us'] for r in good)]
+    if CONF.allocations:
+        traced = _run_child(case, True)
+        for key in ('peak_kb_per_request', 'retained_kb_per_request'):
+            if key in traced:
+                result[key] = traced[key]
+    return result
+
+
+def cases():
+    for engine in CONF.engines:
+        if engine == 'parallel':
+            for workers in CONF.workers:
+                yield {'engine': engine, 'workers': workers}
+        else:
+            yield {'engine': engine, 'workers': 1}
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of results against a baseline.
+
+    :returns: list of (case name, metric, baseline value, new value).
+    """
+    old = dict(((r['engine'], r['workers']), r) for r in baseline)
+    regressions = []
+    for result in results:
+        before = old.get((result['engine'], result['workers']))
+        if before is None or 'cpu_per_request_us' not in result:
+            continue
+        name = '{0}/{1}'.format(result['engine'], result['workers'])
+        if (result['cpu_per_request_us'] >
+                before['cpu_per_request_us'] * (1 + tolerance)):
+            regressions.append((name, 'cpu_per_request_us',
+                                before['cpu_per_request_us'],
+                                result['cpu_per_request_us']))
+        if (result['requests_per_second'] <
+                before['requests_per_second'] / (1 + tolerance)):
+            regressions.append((name, 'requests_per_second',
+                                before['requests_per_second'],
+                                result['requests_per_second']))
+    return regressions
+
+
+def format_results(results):
+    lines = ['{0:<10} {1:>7} {2:>9} {3:>10} {4:>11} {5:>11} {6:>12} '
+             '{7:>10} {8:>9}'.format('engine', 'workers', 'requests',
+                                     'req/s', 'req/cpu-s', 'cpu us/req',
+                                     'engine us/at', 'peak KB/r',
+                                     'mock cpu')]
+    lines.append('-' * len(lines[0]))
+    for r in results:
+        if 'cpu_per_request_us' not in r:
+            lines.append('{0:<10} {1:>7} {2}'.format(
+                r['engine'], r['workers'],
+                'timed out' if r.get('timed_out') else 'failed'))
+            continue
+        engine_us = r.get('engine_cpu_per_atom_us')
+        peak = r.get('peak_kb_per_request')
+        lines.append(
+            '{0:<10} {1:>7} {2:>9} {3:>10.1f} {4:>11.1f} {5:>11.1f} {6:>12} '
+            '{7:>10} {8:>9.2f}'.format(
+                r['engine'], r['workers'], r['requests'],
+                r['requests_per_second'], r['requests_per_cpu_second'],
+                r['cpu_per_request_us'],
+                '' if engine_us is None else '{:.1f}'.format(engine_us),
+                '' if peak is None else '{:.2f}'.format(peak),
+                r['server_cpu_seconds']))
+    return '\n'.join(lines)
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        print(json.dumps(measure(json.loads(sys.argv[2]))))
+        return
+    CONF.register_cli_opts(bench_opts)
+    logging.register_options(CONF)
+    CONF(args=sys.argv[1:], project='stressoctaviaapi')
+    logging.setup(CONF, 'bench_client')
+
+    results = []
+    for case in cases():
+        LOG.info('Running {0} with {1} workers'.format(case['engine'],
+                                                      case['workers']))
+        results.append(run_case(case))
+    print(format_results(results))
+    if CONF.output:
+        with open(CONF.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        LOG.info('Wrote results to {}'.format(CONF.output))
+    if CONF.baseline:
+        with open(CONF.baseline) as f:
+            regressions = compare(results, json.load(f), CONF.tolerance)
+        for name, metric, before, after in regressions:
+            print('REGRESSION {0} {1}: {2:.1f} -> {3:.1f}'.format(
+                name, metric, before, after))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
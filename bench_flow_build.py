@@ -0,0 +1,159 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measures the cost of building the test flows as the tree grows.
+
+Every flow and member count is built in a fresh child process, so the
+peak RSS reported belongs to that build alone.  Nothing is sent to an
+API, except the load balancer lookup of teardown_flow, the build,
+TaskFlow compile and prepare steps are timed on their own.  Example::
+
+    python bench_flow_build.py --members 100,1000,10000 \\
+        --flows multiple_members_flow,compact_members_flow
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import timeit
+
+from oslo_config import cfg
+from oslo_config import types
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+bench_opts = [
+    cfg.ListOpt('flows',
+                default=['multiple_members_flow', 'compact_members_flow'],
+                help='Test flows to build.'),
+    cfg.ListOpt('members', item_type=types.Integer(min=1),
+                default=[100, 1000, 10000],
+                help='Members per pool to build each flow with.'),
+    cfg.IntOpt('load-balancers', default=1, min=1,
+               help='Load balancers in each tree.'),
+    cfg.IntOpt('listeners', default=1, min=1,
+               help='Listeners per load balancer.'),
+    cfg.IntOpt('pools', default=1, min=1,
+               help='Pools per listener.'),
+    cfg.StrOpt('engine', default='parallel',
+               help='TaskFlow engine to compile and prepare, or none to '
+                    'only build the flows.'),
+    cfg.IntOpt('timeout', default=600, min=1,
+               help='Seconds to give a single build before reporting it '
+                    'as timed out.'),
+    cfg.StrOpt('output',
+               help='File to write the results to as JSON.'),
+]
+
+
+def _rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure(params):
+    """Builds one flow in this process and returns its costs."""
+    import async_engine
+    import runner
+    import stressoctaviaapi  # noqa: F401 registers the test options
+    from taskflow import engines as tf_engines
+
+    for name in ('load_balancers', 'listeners', 'pools', 'members'):
+        CONF.set_override(name, params[name], 'test_params')
+    result = dict(params, base_rss_mb=_rss_mb())
+
+    start = timeit.default_timer()
+    flow = runner.build_flow(params['flow'])
+    result['build_seconds'] = timeit.default_timer() - start
+    result['atoms'] = sum(1 for _ in async_engine.iter_atoms(flow))
+
+    if params['engine'] != 'none':
+        start = timeit.default_timer()
+        eng = tf_engines.load(flow, engine=params['engine'])
+        eng.compile()
+        result['compile_seconds'] = timeit.default_timer() - start
+        start = timeit.default_timer()
+        eng.prepare()
+        result['prepare_seconds'] = timeit.default_timer() - start
+
+    result['peak_rss_mb'] = _rss_mb()
+    return result
+
+
+def _run_child(params, timeout):
+    try:
+        out = subprocess.run([sys.executable, __file__, '--child',
+                              json.dumps(params)],
+                             stdout=subprocess.PIPE, check=True,
+                             timeout=timeout)
+    except subprocess.TimeoutExpired:
+        LOG.warning('Building {0} with {1} members timed out after {2} '
+                    'seconds'.format(params['flow'], params['members'],
+                                     timeout))
+        return dict(params, timed_out=True)
+    return json.loads(out.stdout.decode('utf-8').splitlines()[-1])
+
+
+def format_results(results):
+    columns = ('flow', 'members', 'atoms', 'build_seconds',
+               'compile_seconds', 'prepare_seconds', 'peak_rss_mb')
+    lines = ['{0:<24} {1:>8} {2:>9} {3:>9} {4:>11} {5:>11} {6:>9}'.format(
+        'flow', 'members', 'atoms', 'build s', 'compile s', 'prepare s',
+        'peak MB')]
+    lines.append('-' * len(lines[0]))
+    for result in results:
+        if result.get('timed_out'):
+            lines.append('{0:<24} {1:>8} timed out'.format(
+                result['flow'], result['members']))
+            continue
+        row = [result.get(c, '') for c in columns]
+        lines.append(('{0:<24} {1:>8} {2:>9} {3:>9.3f} {4:>11} {5:>11} '
+                      '{6:>9.1f}').format(
+            row[0], row[1], row[2], row[3],
+            '' if row[4] == '' else '{:.3f}'.format(row[4]),
+            '' if row[5] == '' else '{:.3f}'.format(row[5]), row[6]))
+    return '\n'.join(lines)
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        print(json.dumps(measure(json.loads(sys.argv[2]))))
+        return
+    CONF.register_cli_opts(bench_opts)
+    logging.register_options(CONF)
+    CONF(args=sys.argv[1:], project='stressoctaviaapi')
+    logging.setup(CONF, 'bench_flow_build')
+
+    results = []
+    for flow in CONF.flows:
+        for members in CONF.members:
+            LOG.info('Building {0} with {1} members per pool'.format(
+                flow, members))
+            results.append(_run_child({
+                'flow': flow, 'members': members,
+                'load_balancers': CONF.load_balancers,
+                'listeners': CONF.listeners, 'pools': CONF.pools,
+                'engine': CONF.engine}, CONF.timeout))
+    print(format_results(results))
+    if CONF.output:
+        with open(CONF.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        LOG.info('Wrote results to {}'.format(CONF.output))
+
+
+if __name__ == "__main__":
+    main()
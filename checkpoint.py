@@ -0,0 +1,190 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Checkpoints of flow runs in a TaskFlow persistence backend.
+
+With [task_flow] persistence set the state and result of every atom,
+including the IDs of the resources created, are saved under [task_flow]
+run_id.  Running again with the same run ID resumes the flow: finished
+atoms are skipped, atoms that failed or were running when the process
+died are run again.  The create request of such an atom may have reached
+the API already, so before posting again it looks for the resource it
+would create and uses that instead.  A failed run that was reverted kept
+its resources, the tasks don't delete anything on revert, so the atoms
+that had finished before the failure are restored as finished.  The
+tokens of the earlier run are likely expired, so the GetToken atoms
+always run again and hand fresh tokens to the atoms that still have to
+run.
+"""
+
+import contextlib
+import os
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from taskflow import engines as tf_engines
+from taskflow import exceptions as tf_exceptions
+from taskflow.persistence import backends
+from taskflow.persistence.backends import impl_dir
+from taskflow.persistence import models
+from taskflow import states
+
+import async_engine
+import keystone_tasks
+import manifest
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+# Atoms in these states did not finish their work and run again, unless
+# they were only reverted after finishing.
+RERUN_STATES = (states.RUNNING, states.FAILURE, states.REVERTING,
+                states.REVERTED, states.REVERT_FAILURE)
+REVERT_STATES = (states.REVERTING, states.REVERTED, states.REVERT_FAILURE)
+
+
+class _AtomicDirConnection(impl_dir.Connection):
+
+    def _write_to(self, filename, contents):
+        # The stock file backend truncates the file before writing it, a
+        # run killed at that moment leaves an empty file that can't be
+        # resumed from.
+        contents = contents.encode(self.backend.encoding)
+        tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'wb') as fp:
+            fp.write(contents)
+        os.replace(tmp, filename)
+        self.backend.file_cache.pop(filename, None)
+
+
+class _AtomicDirBackend(impl_dir.DirBackend):
+
+    def get_connection(self):
+        return _AtomicDirConnection(self)
+
+
+def backend():
+    """Returns the backend for [task_flow] persistence.
+
+    A URL like sqlite:////var/tmp/runs.db selects that backend, anything
+    else is a directory for the file backend.
+    """
+    location = CONF.task_flow.persistence
+    if '://' in location:
+        result = backends.fetch({'connection': location})
+    else:
+        result = _AtomicDirBackend({'path': os.path.abspath(location)})
+    with contextlib.closing(result.get_connection()) as conn:
+        conn.upgrade()
+    return result
+
+
+def _uuid(*parts):
+    return uuid.uuid5(uuid.NAMESPACE_URL,
+                      'stressoctaviaapi/' + '/'.join(parts)).hex
+
+
+def _logbook(persistence, flow):
+    """Returns (logbook, flow detail, resumed) for this run and shard."""
+    run_id = CONF.task_flow.run_id
+    # Shards of a coordinated run share the run ID, each gets its own book.
+    shard = str(CONF.test_params.first_load_balancer)
+    book_uuid = _uuid(run_id, shard)
+    with contextlib.closing(persistence.get_connection()) as conn:
+        try:
+            book = conn.get_logbook(book_uuid)
+        except tf_exceptions.NotFound:
+            book = models.LogBook(run_id, uuid=book_uuid)
+        flow_detail = book.find(_uuid(run_id, shard, flow.name))
+        resumed = flow_detail is not None
+        if not resumed:
+            flow_detail = models.FlowDetail(
+                flow.name, uuid=_uuid(run_id, shard, flow.name))
+            book.add(flow_detail)
+            conn.save_logbook(book)
+    return book, flow_detail, resumed
+
+
+def _resume(eng, flow):
+    finished = restored = rerun = 0
+    failures = eng.storage.get_execute_failures()
+    for atom in async_engine.iter_atoms(flow):
+        state = eng.storage.get_atom_state(atom.name)
+        if isinstance(atom, keystone_tasks.GetToken):
+            eng.storage.set_atom_state(atom.name, states.PENDING)
+            eng.storage.set_atom_intention(atom.name, states.EXECUTE)
+        elif state in REVERT_STATES and atom.name not in failures:
+            # Finished before another atom failed, its result is still
+            # saved and its resource still exists.
+            eng.storage.set_atom_state(atom.name, states.SUCCESS)
+            eng.storage.set_atom_intention(atom.name, states.EXECUTE)
+            restored += 1
+        elif state in RERUN_STATES:
+            # Also drops the saved failure, which the engine would raise
+            # again at the end of the run.
+            eng.storage.reset(atom.name)
+            eng.storage.set_atom_intention(atom.name, states.EXECUTE)
+            if hasattr(atom, 'reconcile'):
+                atom.reconcile = True
+            rerun += 1
+        elif state == states.SUCCESS:
+            finished += 1
+        else:
+            # A revert also marks the atoms that never ran for reverting.
+            eng.storage.set_atom_intention(atom.name, states.EXECUTE)
+    LOG.info('Resuming run {0}: {1} atoms finished, {2} restored after a '
+             'revert, {3} to run again'.format(CONF.task_flow.run_id,
+                                               finished, restored, rerun))
+
+
+def _restore_manifest():
+    # The tasks look up the load balancer of a parent resource, which the
+    # earlier run only kept in memory and in the manifest file.
+    if not (CONF.test_params.manifest_file and
+            os.path.exists(CONF.test_params.manifest_file)):
+        return
+    for record in manifest.load():
+        manifest.remember(record['id'], record['lb_id'])
+
+
+def load(flow, store=None, **kwargs):
+    """Loads, compiles and prepares an engine that checkpoints the flow.
+
+    :param kwargs: Passed to taskflow.engines.load.
+    :returns: The engine, or None if the run already finished.
+    """
+    if not CONF.task_flow.run_id:
+        raise Exception('[task_flow] persistence needs a run_id.')
+    persistence = backend()
+    book, flow_detail, resumed = _logbook(persistence, flow)
+    eng = tf_engines.load(flow, store=store, flow_detail=flow_detail,
+                          book=book, backend=persistence, **kwargs)
+    eng.compile()
+    if resumed and eng.storage.get_flow_state() == states.REVERTED:
+        # prepare() resets every atom of a reverted flow and drops their
+        # results, _resume decides what runs again instead.
+        eng.storage.set_flow_state(states.FAILURE)
+    eng.prepare()
+    if not resumed:
+        LOG.info('Checkpointing run {0} to {1}'.format(
+            CONF.task_flow.run_id, CONF.task_flow.persistence))
+        return eng
+    if eng.storage.get_flow_state() == states.SUCCESS:
+        LOG.info('Run {} already finished, nothing to resume'.format(
+            CONF.task_flow.run_id))
+        return None
+    _restore_manifest()
+    _resume(eng, flow)
+    return eng
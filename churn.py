@@ -0,0 +1,263 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Steady state churn on existing load balancers.
+
+The load balancers of an earlier run, from [test_params] manifest_file or
+[churn] name_prefix, are discovered with their pools, health monitors and
+members.  [churn] concurrency_per_lb threads per load balancer then keep
+updating members, pools and health monitors and deleting and re-creating
+members for [churn] duration seconds, which keeps the load balancer lock
+busy.  Every [churn] interval the request and 409 counts of each
+operation are sampled, giving throughput and conflict ratio over time.
+"""
+
+import json
+import random
+import threading
+import time
+import timeit
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import keystone_tasks
+import manifest
+import metrics
+import octavia_tasks
+import workload
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+LB_ALGORITHMS = ('ROUND_ROBIN', 'LEAST_CONNECTIONS', 'SOURCE_IP')
+
+
+class Tree(object):
+    """The pools, health monitors and members of one load balancer."""
+
+    def __init__(self, token, lb_id):
+        self.token = token
+        self.lb_id = lb_id
+        self.pools = []
+        self.healthmonitors = []
+        # pool_id -> list of member dicts with id, name, address and port.
+        self.members = {}
+        self._lock = threading.Lock()
+
+    def discover(self):
+        show = octavia_tasks.ShowResource(name='show-churn-tree')
+        members = octavia_tasks.ListResources(name='list-churn-members')
+        lb = show.execute(self.token, 'loadbalancers', self.lb_id)
+        for ref in lb['listeners']:
+            manifest.remember(ref['id'], self.lb_id)
+        for ref in lb['pools']:
+            pool = show.execute(self.token, 'pools', ref['id'])
+            self.pools.append(pool['id'])
+            manifest.remember(pool['id'], self.lb_id)
+            if pool.get('healthmonitor_id'):
+                self.healthmonitors.append(pool['healthmonitor_id'])
+                manifest.remember(pool['healthmonitor_id'], self.lb_id)
+            self.members[pool['id']] = members.execute(
+                self.token, 'pools/{}/members'.format(pool['id']),
+                {'fields': ['id', 'name', 'address', 'protocol_port']})
+            for member in self.members[pool['id']]:
+                manifest.remember(member['id'], self.lb_id)
+        return self
+
+    def take_member(self, rng):
+        """Takes a random member out of the tree until it is put back.
+
+        :returns: (pool_id, member), or (None, None) if there is none.
+        """
+        with self._lock:
+            pools = [p for p in self.pools if self.members[p]]
+            if not pools:
+                return None, None
+            pool_id = rng.choice(pools)
+            members = self.members[pool_id]
+            return pool_id, members.pop(rng.randrange(len(members)))
+
+    def put_member(self, pool_id, member):
+        with self._lock:
+            self.members[pool_id].append(member)
+
+
+def update_member(tree, rng):
+    # Taken out of the tree so it is not re-created while being updated.
+    pool_id, member = tree.take_member(rng)
+    if member is None:
+        return
+    try:
+        octavia_tasks.UpdateResource(name='update-churn-member').execute(
+            tree.token, 'pools/{}/members'.format(pool_id), member['id'],
+            {'weight': rng.randint(1, 256),
+             'admin_state_up': rng.random() < 0.9})
+    finally:
+        tree.put_member(pool_id, member)
+
+
+def update_pool(tree, rng):
+    if not tree.pools:
+        return
+    octavia_tasks.UpdateResource(name='update-churn-pool').execute(
+        tree.token, 'pools', rng.choice(tree.pools),
+        {'lb_algorithm': rng.choice(LB_ALGORITHMS)})
+
+
+def update_healthmonitor(tree, rng):
+    if not tree.healthmonitors:
+        return
+    delay = rng.randint(5, 30)
+    octavia_tasks.UpdateResource(name='update-churn-hm').execute(
+        tree.token, 'healthmonitors', rng.choice(tree.healthmonitors),
+        {'delay': delay, 'timeout': rng.randint(1, delay)})
+
+
+def recreate_member(tree, rng):
+    pool_id, member = tree.take_member(rng)
+    if member is None:
+        return
+    deleted = False
+    try:
+        octavia_tasks.DeleteMember(name='delete-churn-member').execute(
+            tree.token, pool_id, member['id'])
+        deleted = True
+        member = dict(member, id=octavia_tasks.CreateMember(
+            name='create-churn-member').execute(
+                tree.token, member['name'], pool_id, member['address'],
+                member['protocol_port']))
+        deleted = False
+    finally:
+        # A member that failed to delete is still there, one that failed
+        # to be re-created is dropped.
+        if not deleted:
+            tree.put_member(pool_id, member)
+
+
+OPERATIONS = {
+    'update_member': update_member,
+    'update_pool': update_pool,
+    'update_healthmonitor': update_healthmonitor,
+    'recreate_member': recreate_member,
+}
+
+
+def _worker(tree, mix, deadline, rng):
+    while timeit.default_timer() < deadline:
+        name, operation = mix.choose(rng)
+        try:
+            operation(tree, rng)
+        except Exception as e:
+            LOG.warning('Churn {0} on load balancer {1} failed: {2}'.format(
+                name, tree.lb_id, e))
+            metrics.record_error(e)
+
+
+class Sampler(threading.Thread):
+    """Samples the request and 409 counts per operation at an interval."""
+
+    def __init__(self, interval):
+        super(Sampler, self).__init__(name='churn-sampler')
+        self.daemon = True
+        self.interval = interval
+        self.timeline = []
+        self._stop_event = threading.Event()
+        self._start = self._last = time.time()
+        self._previous = metrics.get_registry().status_counts()
+
+    def sample(self):
+        now = time.time()
+        counts = metrics.get_registry().status_counts()
+        for op, codes in sorted(counts.items()):
+            before = self._previous.get(op, {})
+            delta = dict((code, n - before.get(code, 0))
+                         for code, n in codes.items())
+            requests = sum(delta.values())
+            if not requests:
+                continue
+            ok = sum(n for code, n in delta.items() if code.startswith('2'))
+            conflicts = delta.get('409', 0)
+            self.timeline.append({
+                'offset': round(now - self._start, 3),
+                'operation': op,
+                'requests': requests,
+                'completed_per_second': ok / max(now - self._last, 0.001),
+                'conflicts': conflicts,
+                'conflict_ratio': conflicts / float(requests)})
+        self._previous = counts
+        self._last = now
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+def format_timeline(timeline):
+    lines = ['{0:>8} {1:<24} {2:>9} {3:>12} {4:>9}'.format(
+        'seconds', 'operation', 'requests', 'completed/s', '409 %')]
+    lines.append('-' * len(lines[0]))
+    for row in timeline:
+        lines.append('{0:>8.1f} {1:<24} {2:>9} {3:>12.1f} {4:>9.1f}'.format(
+            row['offset'], row['operation'], row['requests'],
+            row['completed_per_second'], row['conflict_ratio'] * 100))
+    return '\n'.join(lines)
+
+
+def run(duration=None):
+    """Churns the load balancers of an earlier run.
+
+    :param duration: Seconds to run, defaults to [churn] duration.
+    :returns: The timeline, a list of per interval and operation dicts.
+    """
+    duration = duration or CONF.churn.duration
+    token = keystone_tasks.GetToken(name='get-token').execute()
+    lb_ids = workload.find_load_balancers(token, CONF.churn.name_prefix)
+    if not lb_ids:
+        raise Exception('No load balancers to churn.')
+    trees = [Tree(token, lb_id).discover() for lb_id in lb_ids]
+    mix = workload.OperationMix(CONF.churn.operations, OPERATIONS)
+    seed = random.Random(CONF.churn.seed)
+
+    LOG.info('Churning {0} load balancers with {1} threads each for {2} '
+             'seconds'.format(len(trees), CONF.churn.concurrency_per_lb,
+                              duration))
+    sampler = Sampler(CONF.churn.interval)
+    sampler.start()
+    deadline = timeit.default_timer() + duration
+    threads = []
+    for tree in trees:
+        for i in range(CONF.churn.concurrency_per_lb):
+            thread = threading.Thread(
+                target=_worker, name='churn-{0}-{1}'.format(tree.lb_id, i),
+                args=(tree, mix, deadline, random.Random(seed.random())))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    sampler.stop()
+
+    print(format_timeline(sampler.timeline))
+    if CONF.churn.timeline_file:
+        with open(CONF.churn.timeline_file, 'w') as f:
+            json.dump(sampler.timeline, f, indent=2)
+        LOG.info('Wrote the churn timeline to {}'.format(
+            CONF.churn.timeline_file))
+    return sampler.timeline
@@ -0,0 +1,315 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Load balancer lock contention tracking.
+
+Every Octavia response is attributed to the load balancer it touched,
+using manifest.lb_for for child resources and for the parent named in
+the body of creates like POST listeners, and counted in wall clock
+buckets of [contention] interval seconds.  For each load balancer the
+report gives the requests, 409 and 503 responses per operation, the
+share of requests
+that were wasted retries, the longest immutable window (from the first
+409 until a write succeeds again) and the most writers waiting on the
+lock at the same time.  The buckets can be exported as CSV with absolute
+timestamps to line them up with server side metrics.
+"""
+
+import csv
+import json
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import event_log
+import manifest
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+UNKNOWN = 'unknown'
+
+# Body attributes naming the parent of a resource created with a POST to
+# its collection, like v2.0/lbaas/pools.
+PARENT_KEYS = ('loadbalancer_id', 'listener_id', 'pool_id')
+
+_lock = threading.Lock()
+_lbs = {}
+
+
+class _LoadBalancer(object):
+
+    def __init__(self):
+        # (bucket start, operation) -> [requests, 409s, 503s]
+        self.buckets = {}
+        # bucket start -> most writers waiting on the lock
+        self.queued_max = {}
+        self.queued = 0
+        self.max_queued = 0
+        self.window_start = None
+        self.window_last = None
+        self.longest_window = 0.0
+        self.longest_window_start = None
+
+    def bucket(self, start, operation):
+        bucket = self.buckets.get((start, operation))
+        if bucket is None:
+            bucket = self.buckets[(start, operation)] = [0, 0, 0]
+        return bucket
+
+    def close_window(self, end=None):
+        """Ends the immutable window.
+
+        :param end: Time of the write that succeeded after it, the last
+                    409 is used for a window that is still open.
+        """
+        if self.window_start is None:
+            return
+        length = (end or self.window_last) - self.window_start
+        if length >= self.longest_window:
+            self.longest_window = length
+            self.longest_window_start = self.window_start
+        self.window_start = None
+
+    def to_dict(self):
+        self.close_window()
+        return {'buckets': [[start, operation] + counts
+                            for (start, operation), counts
+                            in self.buckets.items()],
+                'queued': [[start, n] for start, n in self.queued_max.items()],
+                'max_queued': self.max_queued,
+                'longest_window': self.longest_window,
+                'longest_window_start': self.longest_window_start}
+
+    def merge(self, data):
+        for start, operation, requests, conflicts, unavailable in (
+                data['buckets']):
+            bucket = self.bucket(start, operation)
+            bucket[0] += requests
+            bucket[1] += conflicts
+            bucket[2] += unavailable
+        for start, n in data['queued']:
+            self.queued_max[start] = max(self.queued_max.get(start, 0), n)
+        self.max_queued = max(self.max_queued, data['max_queued'])
+        if data['longest_window'] >= self.longest_window:
+            self.longest_window = data['longest_window']
+            self.longest_window_start = data['longest_window_start']
+
+
+def _parent_lb_id(data):
+    """Returns the load balancer of the parent named in a create body."""
+    try:
+        body = json.loads(data)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(body, dict) or len(body) != 1:
+        return None
+    resource = list(body.values())[0]
+    if not isinstance(resource, dict):
+        return None
+    for key in PARENT_KEYS:
+        if resource.get(key):
+            if key == 'loadbalancer_id':
+                return resource[key]
+            return manifest.lb_for(resource[key])
+    return None
+
+
+def _lb_id(url, data=None):
+    resource = event_log.resource_id(url)
+    if resource is None and data:
+        return _parent_lb_id(data) or UNKNOWN
+    if resource is None:
+        return UNKNOWN
+    if '/lbaas/loadbalancers/' in url:
+        return resource
+    return manifest.lb_for(resource) or UNKNOWN
+
+
+def observe(method, url, operation, status, retry_state, t, data=None):
+    """Records one Octavia response.
+
+    :param retry_state: retry_policies.RetryState of the call, used to
+                        track the writers waiting on a load balancer.
+    :param t: Wall clock time of the response.
+    :param data: Request body, which names the parent of a resource
+                 created with a POST to its collection.
+    """
+    if not CONF.contention.enabled:
+        return
+    lb_id = _lb_id(url, data)
+    interval = CONF.contention.interval
+    start = int(t // interval) * interval
+    with _lock:
+        lb = _lbs.get(lb_id)
+        if lb is None:
+            lb = _lbs[lb_id] = _LoadBalancer()
+        bucket = lb.bucket(start, operation)
+        bucket[0] += 1
+        if status == 409:
+            bucket[1] += 1
+            if lb.window_start is None:
+                lb.window_start = t
+            lb.window_last = t
+            if retry_state.queued_on is None:
+                retry_state.queued_on = lb_id
+                lb.queued += 1
+                lb.max_queued = max(lb.max_queued, lb.queued)
+                lb.queued_max[start] = max(lb.queued_max.get(start, 0),
+                                           lb.queued)
+            return
+        if status == 503:
+            bucket[2] += 1
+            return
+        if method != 'GET' and 199 < status < 300:
+            lb.close_window(t)
+    done(retry_state)
+
+
+def done(retry_state):
+    """Marks a call as no longer waiting on a load balancer lock."""
+    lb_id = retry_state.queued_on
+    if lb_id is None:
+        return
+    retry_state.queued_on = None
+    with _lock:
+        _lbs[lb_id].queued -= 1
+
+
+def reset():
+    with _lock:
+        _lbs.clear()
+
+
+def to_dict():
+    with _lock:
+        return dict((lb_id, lb.to_dict()) for lb_id, lb in _lbs.items())
+
+
+def merge(data):
+    """Adds the contention recorded by another process."""
+    with _lock:
+        for lb_id, lb_data in data.items():
+            lb = _lbs.get(lb_id)
+            if lb is None:
+                lb = _lbs[lb_id] = _LoadBalancer()
+            lb.merge(lb_data)
+
+
+def report():
+    """Returns the contention report as a dict."""
+    data = to_dict()
+    lbs = {}
+    total_requests = total_wasted = 0
+    for lb_id, lb in data.items():
+        operations = {}
+        timeline = {}
+        for start, operation, requests, conflicts, unavailable in (
+                lb['buckets']):
+            for totals in (operations.setdefault(operation, [0, 0, 0]),
+                           timeline.setdefault(start, [0, 0, 0, 0])):
+                totals[0] += requests
+                totals[1] += conflicts
+                totals[2] += unavailable
+        for start, n in lb['queued']:
+            timeline.setdefault(start, [0, 0, 0, 0])[3] = n
+        requests = sum(o[0] for o in operations.values())
+        conflicts = sum(o[1] for o in operations.values())
+        unavailable = sum(o[2] for o in operations.values())
+        total_requests += requests
+        total_wasted += conflicts + unavailable
+        lbs[lb_id] = {
+            'requests': requests, 'conflicts': conflicts,
+            'unavailable': unavailable,
+            'wasted_share': ((conflicts + unavailable) / float(requests)
+                             if requests else 0),
+            'longest_immutable_seconds': lb['longest_window'],
+            'longest_immutable_start': lb['longest_window_start'],
+            'max_queued_writers': lb['max_queued'],
+            'operations': dict(
+                (operation, {'requests': o[0], 'conflicts': o[1],
+                             'unavailable': o[2]})
+                for operation, o in operations.items()),
+            'timeline': [{'time': start, 'requests': b[0],
+                          'conflicts': b[1], 'unavailable': b[2],
+                          'conflict_rate': (b[1] / float(b[0])
+                                            if b[0] else 0),
+                          'queued_writers': b[3]}
+                         for start, b in sorted(timeline.items())],
+            'buckets': sorted(lb['buckets'])}
+    return {'interval_seconds': CONF.contention.interval,
+            'total_requests': total_requests,
+            'wasted_requests': total_wasted,
+            'wasted_share': (total_wasted / float(total_requests)
+                             if total_requests else 0),
+            'load_balancers': lbs}
+
+
+def format_table(report, limit=20):
+    """Formats the load balancers with the most conflicts as a table."""
+    lines = ['Wasted retries: {0} of {1} requests ({2:.1f}%)'.format(
+        report['wasted_requests'], report['total_requests'],
+        report['wasted_share'] * 100)]
+    header = '{0:<38} {1:>9} {2:>9} {3:>7} {4:>8} {5:>12} {6:>7}'.format(
+        'load balancer', 'requests', '409', '503', 'wasted %',
+        'immutable s', 'queued')
+    lines.extend([header, '-' * len(header)])
+    lbs = sorted(report['load_balancers'].items(),
+                 key=lambda i: -i[1]['conflicts'])
+    for lb_id, lb in lbs[:limit]:
+        lines.append(
+            '{0:<38} {1:>9} {2:>9} {3:>7} {4:>8.1f} {5:>12.2f} '
+            '{6:>7}'.format(lb_id, lb['requests'], lb['conflicts'],
+                            lb['unavailable'], lb['wasted_share'] * 100,
+                            lb['longest_immutable_seconds'],
+                            lb['max_queued_writers']))
+    if len(lbs) > limit:
+        lines.append('... {} more load balancers'.format(len(lbs) - limit))
+    return '\n'.join(lines)
+
+
+def write_csv(report, path):
+    """Writes the timeline as CSV, one row per bucket, LB and operation."""
+    with open(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['time', 'interval_seconds', 'lb_id', 'operation',
+                         'requests', 'conflicts', 'unavailable',
+                         'conflict_rate', 'queued_writers'])
+        for lb_id, lb in sorted(report['load_balancers'].items()):
+            queued = dict((row['time'], row['queued_writers'])
+                          for row in lb['timeline'])
+            for (start, operation, requests, conflicts,
+                 unavailable) in lb['buckets']:
+                writer.writerow([
+                    '{:.3f}'.format(start), report['interval_seconds'],
+                    lb_id, operation, requests, conflicts, unavailable,
+                    '{:.4f}'.format(conflicts / float(requests)),
+                    queued.get(start, 0)])
+
+
+def emit_report():
+    """Prints the contention report and writes [contention] csv_file.
+
+    :returns: The report dict, None when nothing was tracked.
+    """
+    if not CONF.contention.enabled or not _lbs:
+        return None
+    result = report()
+    print(format_table(result))
+    if CONF.contention.csv_file:
+        write_csv(result, CONF.contention.csv_file)
+        LOG.info('Wrote the contention timeline to {}'.format(
+            CONF.contention.csv_file))
+    return result
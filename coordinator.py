@@ -0,0 +1,218 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Shards a test flow across local worker processes and remote agents.
+
+The load balancers of a run are split into contiguous shards.  Every
+shard builds and runs its own flow, with its own engine and token, in a
+separate process.  Remote agents are other hosts running
+stressoctaviaapi.py with [coordinator] serve_agent = True.  The metrics
+of all shards are merged into a single report.
+"""
+
+import concurrent.futures
+import hmac
+import json
+import multiprocessing
+import time
+
+from http import server as http_server
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import requests
+
+import contention
+import event_log
+import metrics
+import runner
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def split(load_balancers, shards, first=0):
+    """Splits load balancers into contiguous shards.
+
+    :returns: list of (load balancer count, index of the first one),
+              without empty shards.
+    """
+    result = []
+    base, extra = divmod(load_balancers, shards)
+    for i in range(shards):
+        count = base + (1 if i < extra else 0)
+        if count:
+            result.append((count, first))
+            first += count
+    return result
+
+
+def run_shard(load_balancers, first):
+    """Runs one shard in the current process.
+
+    :returns: The shard metrics as a dict, see metrics.Registry.to_dict,
+              with the lock contention under the contention key.
+    """
+    CONF.set_override('load_balancers', load_balancers, 'test_params')
+    CONF.set_override('first_load_balancer', first, 'test_params')
+    metrics.reset()
+    contention.reset()
+    if CONF.event_log.file:
+        event_log.start('{0}.{1}'.format(CONF.event_log.file, first))
+    LOG.info('Running load balancers {0} to {1}'.format(
+        first, first + load_balancers - 1))
+    try:
+        runner.run_flow(runner.build_flow())
+    except Exception as e:
+        LOG.exception('Shard starting at load balancer {} '
+                      'failed.'.format(first))
+        metrics.record_error(e)
+    finally:
+        event_log.stop()
+    registry = metrics.get_registry()
+    registry.end = time.time()
+    result = registry.to_dict()
+    result['contention'] = contention.to_dict()
+    return result
+
+
+def _run_remote(agent, load_balancers, first):
+    headers = {'Content-type': 'application/json'}
+    if CONF.coordinator.agent_secret:
+        headers['X-Agent-Secret'] = CONF.coordinator.agent_secret
+    r = requests.post('{}/shards'.format(agent.rstrip('/')),
+                      data=json.dumps({'load_balancers': load_balancers,
+                                       'first_load_balancer': first}),
+                      headers=headers, timeout=CONF.coordinator.agent_timeout)
+    if r.status_code != 200:
+        raise Exception('Agent {0} returned {1}: {2}'.format(
+            agent, r.status_code, r.content))
+    return r.json()
+
+
+def run(load_balancers=None, first=0, workers=None, agents=None):
+    """Runs the configured flow sharded over workers and agents.
+
+    :param load_balancers: Total load balancers, defaults to
+                           [test_params] load_balancers.
+    :param first: Index of the first load balancer.
+    :param workers: Local worker processes, defaults to
+                    [coordinator] workers.
+    :param agents: Remote agent URLs, defaults to [coordinator] agents.
+    :returns: metrics.Registry with the merged results.
+    """
+    if load_balancers is None:
+        load_balancers = CONF.test_params.load_balancers
+    if workers is None:
+        workers = CONF.coordinator.workers
+    if agents is None:
+        agents = CONF.coordinator.agents
+    if CONF.test_params.test_flow == 'teardown_flow':
+        # Every shard would find and delete all the load balancers.
+        raise Exception('teardown_flow can not be sharded, unset '
+                        '[coordinator] workers and agents. It already '
+                        'deletes the load balancers in parallel.')
+    workers = max(workers, 0)
+    shards = split(load_balancers, max(workers + len(agents), 1), first)
+    LOG.info('Running {0} load balancers in {1} shards on {2} local workers '
+             'and {3} agents'.format(load_balancers, len(shards), workers,
+                                     len(agents)))
+
+    merged = metrics.Registry()
+    futures = {}
+    # Workers are forked so they inherit the parsed configuration.
+    local = concurrent.futures.ProcessPoolExecutor(
+        max_workers=max(workers, 1),
+        mp_context=multiprocessing.get_context('fork'))
+    remote = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(len(agents), 1))
+    try:
+        for i, (count, start) in enumerate(shards):
+            if i < workers or not agents:
+                future = local.submit(run_shard, count, start)
+                futures[future] = 'local worker {}'.format(i)
+            else:
+                agent = agents[(i - workers) % len(agents)]
+                future = remote.submit(_run_remote, agent, count, start)
+                futures[future] = 'agent {}'.format(agent)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+                contention.merge(result.pop('contention', {}))
+                merged.merge(metrics.Registry.from_dict(result))
+            except Exception as e:
+                LOG.error('Shard on {0} failed: {1}'.format(futures[future],
+                                                           e))
+                merged.record_error(e)
+    finally:
+        local.shutdown()
+        remote.shutdown()
+    merged.end = time.time()
+    return merged
+
+
+class _AgentHandler(http_server.BaseHTTPRequestHandler):
+
+    def _reply(self, code, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/shards':
+            self._reply(404, {'error': 'Unknown path'})
+            return
+        secret = CONF.coordinator.agent_secret
+        if secret and not hmac.compare_digest(
+                self.headers.get('X-Agent-Secret', ''), secret):
+            self._reply(401, {'error': 'Bad agent secret'})
+            return
+        try:
+            body = json.loads(self.rfile.read(
+                int(self.headers.get('Content-Length', 0))))
+            load_balancers = int(body['load_balancers'])
+            first = int(body.get('first_load_balancer', 0))
+        except (KeyError, TypeError, ValueError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        LOG.info('Agent received shard of {0} load balancers starting at '
+                 '{1}'.format(load_balancers, first))
+        # Shards always run in child processes so the agent stays clean
+        # between runs, only the contention they report is merged here.
+        contention.reset()
+        registry = run(load_balancers, first,
+                       workers=max(CONF.coordinator.workers, 1), agents=[])
+        self._reply(200, dict(registry.to_dict(),
+                              contention=contention.to_dict()))
+
+    def log_message(self, format, *args):
+        LOG.debug(format, *args)
+
+
+def serve_agent():
+    """Serves shard requests from a coordinator until interrupted."""
+    httpd = http_server.ThreadingHTTPServer(
+        (CONF.coordinator.agent_bind_host, CONF.coordinator.agent_port),
+        _AgentHandler)
+    LOG.info('Agent listening on {0}:{1}'.format(
+        CONF.coordinator.agent_bind_host, CONF.coordinator.agent_port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
@@ -0,0 +1,247 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Structured per request event log.
+
+With [event_log] file set every API request is written to that file as
+one JSON object per line::
+
+    {"t": 1509472800.12, "op": "create_member", "id": "<pool id>",
+     "status": 201, "latency": 0.0123, "retry": 0}
+
+The request path only puts a tuple on a bounded queue, a background
+thread formats and writes the records.  Records are dropped and counted
+when the queue is full instead of growing without bound, and record()
+returns straight away when the log is disabled.
+
+Run this module to filter and summarize a log after the run::
+
+    python event_log.py /tmp/events.jsonl --operation create_member
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import metrics
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_queue = None
+_writer = None
+_pid = None
+_dropped = 0
+
+reader_opts = [
+    cfg.MultiStrOpt('files', positional=True,
+                    help='Event log files to read.'),
+    cfg.StrOpt('operation',
+               help='Only read records of this operation.'),
+    cfg.StrOpt('status',
+               help='Only read records with this status.'),
+    cfg.StrOpt('resource-id',
+               help='Only read records for this resource.'),
+    cfg.FloatOpt('since',
+                 help='Only read records from this Unix time on.'),
+    cfg.FloatOpt('until',
+                 help='Only read records before this Unix time.'),
+    cfg.BoolOpt('print', default=False,
+                help='Print the matching records instead of a summary.'),
+]
+
+
+def resource_id(url):
+    """Returns the ID of the resource a request URL addresses.
+
+    Requests on a collection, like creating a member, return the ID of
+    the parent, the pool in that case.
+    """
+    path = url.split('?', 1)[0]
+    marker = path.find('/lbaas/')
+    if marker == -1:
+        return None
+    parts = [p for p in path[marker + len('/lbaas/'):].split('/') if p]
+    if len(parts) % 2 == 0:
+        return parts[-1]
+    if len(parts) > 1:
+        return parts[-2]
+    return None
+
+
+_STOP = object()
+
+
+class _Writer(threading.Thread):
+
+    def __init__(self, path, events):
+        super(_Writer, self).__init__(name='event-log-writer')
+        self.daemon = True
+        self.path = path
+        self.events = events
+        self.written = 0
+
+    def _format(self, event):
+        t, operation, url, status, latency, retry = event
+        return json.dumps({'t': round(t, 6), 'op': operation,
+                           'id': resource_id(url), 'status': status,
+                           'latency': round(latency, 6), 'retry': retry},
+                          separators=(',', ':'))
+
+    def run(self):
+        with open(self.path, 'a', buffering=1 << 16) as f:
+            last_flush = time.time()
+            while True:
+                try:
+                    event = self.events.get(
+                        timeout=CONF.event_log.flush_interval)
+                except queue.Empty:
+                    event = None
+                if event is not None and event is not _STOP:
+                    f.write(self._format(event))
+                    f.write('\n')
+                    self.written += 1
+                if (event is None or event is _STOP or
+                        time.time() - last_flush >=
+                        CONF.event_log.flush_interval):
+                    f.flush()
+                    last_flush = time.time()
+                if event is _STOP:
+                    return
+
+
+def start(path=None):
+    """Starts writing events to a file.
+
+    :param path: File to append to, defaults to [event_log] file.  Does
+                 nothing when neither is set.
+    """
+    global _queue, _writer, _pid, _dropped
+    path = path or CONF.event_log.file
+    if not path:
+        return
+    if _writer is not None and _pid == os.getpid():
+        stop()
+    # A forked worker inherits the queue but not the writer thread, so it
+    # always starts its own.
+    _dropped = 0
+    _pid = os.getpid()
+    _queue = queue.Queue(maxsize=CONF.event_log.queue_size)
+    _writer = _Writer(path, _queue)
+    _writer.start()
+    LOG.info('Writing request events to {}'.format(path))
+
+
+def record(operation, url, status, latency, retry=0):
+    """Queues one request event, a no-op when the log is not started.
+
+    :param url: Request URL, the resource ID is taken from it.
+    :param status: HTTP status code or exception name.
+    :param latency: Seconds the request took.
+    :param retry: Retry number of the request, 0 for the first attempt.
+    """
+    global _dropped
+    if _queue is None:
+        return
+    try:
+        _queue.put_nowait((time.time(), operation, url, status, latency,
+                           retry))
+    except queue.Full:
+        _dropped += 1
+
+
+def stop():
+    """Writes the queued events and stops the writer."""
+    global _queue, _writer
+    if _writer is None:
+        return
+    events, writer = _queue, _writer
+    _queue = None
+    _writer = None
+    if _pid != os.getpid():
+        return
+    events.put(_STOP)
+    writer.join()
+    if _dropped:
+        LOG.warning('The event log queue was full, dropped {} '
+                    'events'.format(_dropped))
+    LOG.info('Wrote {0} request events to {1}'.format(writer.written,
+                                                      writer.path))
+
+
+def read(paths, operation=None, status=None, resource=None, since=None,
+         until=None):
+    """Yields the matching records of event log files."""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if operation and event['op'] != operation:
+                    continue
+                if status and str(event['status']) != status:
+                    continue
+                if resource and event['id'] != resource:
+                    continue
+                if since is not None and event['t'] < since:
+                    continue
+                if until is not None and event['t'] >= until:
+                    continue
+                yield event
+
+
+def summarize(events):
+    """Summarizes events per operation.
+
+    :returns: A report in the format of metrics.Registry.report.
+    """
+    registry = metrics.Registry()
+    first = last = None
+    for event in events:
+        registry.record_request(event['op'], event['latency'],
+                                event['status'])
+        if isinstance(event['status'], int) and event['status'] < 400:
+            registry.record_call(event['op'], event['retry'])
+        first = event['t'] if first is None else min(first, event['t'])
+        last = event['t'] if last is None else max(last, event['t'])
+    if first is not None:
+        registry.start = first
+        registry.end = last
+    return registry.report()
+
+
+def main():
+    CONF.register_cli_opts(reader_opts)
+    logging.register_options(CONF)
+    CONF(args=sys.argv[1:], project='stressoctaviaapi')
+    logging.setup(CONF, 'event_log')
+    events = read(CONF.files, operation=CONF.operation, status=CONF.status,
+                  resource=CONF.resource_id, since=CONF.since,
+                  until=CONF.until)
+    if CONF.print:
+        for event in events:
+            print(json.dumps(event, separators=(',', ':')))
+        return
+    print(metrics.format_table(summarize(events)))
+
+
+if __name__ == "__main__":
+    main()
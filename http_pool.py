@@ -0,0 +1,103 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import requests
+from requests import adapters
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _pool_size():
+    if CONF.http_pool.pool_size:
+        return CONF.http_pool.pool_size
+    return CONF.task_flow.max_workers
+
+
+def get_session():
+    """Returns the process wide keep-alive session.
+
+    The session is shared by every task.  The adapter pool is sized from
+    [http_pool] pool_size (or [task_flow] max_workers) and blocks when all
+    connections are checked out, so the number of sockets to the API is
+    bounded no matter how many tasks are in flight.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                size = _pool_size()
+                session = requests.Session()
+                adapter = adapters.HTTPAdapter(pool_connections=size,
+                                               pool_maxsize=size,
+                                               pool_block=True)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if not CONF.http_pool.keep_alive:
+                    session.headers['Connection'] = 'close'
+                _session = session
+    return _session
+
+
+def request(method, url, **kwargs):
+    """Issues a request through the shared session."""
+    kwargs.setdefault('timeout', (CONF.http_pool.connect_timeout,
+                                  CONF.http_pool.read_timeout))
+    return get_session().request(method, url, **kwargs)
+
+
+def connection_stats():
+    """Returns connection usage counters for the shared session.
+
+    :returns: dict with the number of requests sent, connections opened
+              and requests that reused an existing connection.
+    """
+    stats = {'requests': 0, 'connections': 0, 'reused': 0}
+    if _session is None:
+        return stats
+    seen = set()
+    for adapter in _session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+    stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+    return stats
+
+
+def log_connection_stats():
+    stats = connection_stats()
+    LOG.info('HTTP connection pool: {requests} requests over {connections} '
+             'connections, {reused} requests reused a kept-alive '
+             'connection.'.format(**stats))
+
+
+def close():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
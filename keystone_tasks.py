@@ -13,12 +13,18 @@
 #    under the License.
 
 import functools
+import timeit
 
 from oslo_config import cfg
 from oslo_log import log as logging
-import requests
 from taskflow import task
 
+import aio_http
+import event_log
+import http_pool
+import metrics
+import token_cache
+
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
@@ -32,8 +38,9 @@ class BaseKeystoneTask(task.Task):
         self.post = functools.partial(self._request, 'POST')
         self.put = functools.partial(self._request, 'PUT')
         self.delete = functools.partial(self._request, 'DELETE')
+        self.apost = functools.partial(self._arequest, 'POST')
 
-    def _request(self, method, url, data=None, params=None):
+    def _prepare(self, url, data, params):
         headers = {
             'Content-type': 'application/json',
             'User-Agent': 'Stress_Octavia_API'
@@ -43,32 +50,95 @@ class BaseKeystoneTask(task.Task):
         LOG.debug("url = %s", url)
         LOG.debug("data = %s", data)
         LOG.debug("params = %s", str(params))
-        r = requests.request(method, url, data=data,
-                             params=params, headers=headers)
-        LOG.debug("Keystone Response Code: {0}".format(r.status_code))
-        LOG.debug("Keystone Response Body: {0}".format(r.content))
-        LOG.debug("Keystone Response Headers: {0}".format(r.headers))
+        return url, headers
+
+    def _check_response(self, url, operation, r, latency):
+        metrics.record_request(operation, latency, r.status_code)
+        metrics.record_call(operation, 0)
+        event_log.record(operation, url, r.status_code, latency)
+        LOG.debug("Keystone Response Code: %s", r.status_code)
+        LOG.debug("Keystone Response Body: %s", r.content)
+        LOG.debug("Keystone Response Headers: %s", r.headers)
+
+    def _request(self, method, url, data=None, params=None,
+                 operation='keystone'):
+        url, headers = self._prepare(url, data, params)
+        start = timeit.default_timer()
+        try:
+            r = http_pool.request(method, url, data=data,
+                                  params=params, headers=headers)
+        except Exception as e:
+            latency = timeit.default_timer() - start
+            metrics.record_request(operation, latency, type(e).__name__)
+            event_log.record(operation, url, type(e).__name__, latency)
+            raise
+        self._check_response(url, operation, r,
+                             timeit.default_timer() - start)
 
         return r
 
+    async def _arequest(self, method, url, data=None, params=None,
+                        operation='keystone'):
+        """Non-blocking version of _request for the asyncio engine."""
+        url, headers = self._prepare(url, data, params)
+        start = timeit.default_timer()
+        try:
+            r = await aio_http.request(method, url, data=data,
+                                       params=params, headers=headers)
+        except Exception as e:
+            latency = timeit.default_timer() - start
+            metrics.record_request(operation, latency, type(e).__name__)
+            event_log.record(operation, url, type(e).__name__, latency)
+            raise
+        self._check_response(url, operation, r,
+                             timeit.default_timer() - start)
 
-class GetToken(BaseKeystoneTask):
-    """Task to get a keystone token."""
-
-    def execute(self):
-
-        data=('{{"auth":{{"identity":{{"methods":["password"],'
-              '"password":{{"user":{{"name":"{name}",'
-              '"domain":{{"name": "{domain}"}},'
-              '"password":"{password}"}}}}}},'
-              '"scope":{{"project":{{"name":"{proj}",'
-              '"domain": {{"name": "{domain}"}}}}}}}}'
-              '}}').format(name=CONF.keystone_authtoken.username,
-                           password=CONF.keystone_authtoken.password,
-                           proj=CONF.keystone_authtoken.project_name,
-                           domain=CONF.keystone_authtoken.project_domain_name)
-
+        return r
 
-        r = self.post('/v3/auth/tokens', data)
 
-        return r.headers['X-Subject-Token']
+class GetToken(BaseKeystoneTask):
+    """Task to get a keystone token.
+
+    Tokens come from token_cache, Keystone is only asked when there is no
+    cached token that is still valid.
+
+    :param project_name: Project to scope the token to, defaults to
+                         [keystone_authtoken] project_name.
+    """
+
+    def _data(self, project_name):
+        return ('{{"auth":{{"identity":{{"methods":["password"],'
+                '"password":{{"user":{{"name":"{name}",'
+                '"domain":{{"name": "{domain}"}},'
+                '"password":"{password}"}}}}}},'
+                '"scope":{{"project":{{"name":"{proj}",'
+                '"domain": {{"name": "{domain}"}}}}}}}}'
+                '}}').format(
+                    name=CONF.keystone_authtoken.username,
+                    password=CONF.keystone_authtoken.password,
+                    proj=project_name,
+                    domain=CONF.keystone_authtoken.project_domain_name)
+
+    def _token(self, r):
+        return r.headers['X-Subject-Token'], r.json()['token']['expires_at']
+
+    def _authenticate(self, project_name):
+        r = self.post('/v3/auth/tokens', self._data(project_name),
+                      operation='keystone_token')
+        return self._token(r)
+
+    def execute(self, project_name=None):
+
+        project_name = project_name or CONF.keystone_authtoken.project_name
+        return token_cache.get(project_name, self._authenticate)
+
+    async def aexecute(self, project_name=None):
+
+        project_name = project_name or CONF.keystone_authtoken.project_name
+        token = token_cache.cached(project_name, self._authenticate)
+        if token is not None:
+            return token
+        r = await self.apost('/v3/auth/tokens', self._data(project_name),
+                             operation='keystone_token')
+        return token_cache.store(project_name, *self._token(r),
+                                 fetch=self._authenticate)
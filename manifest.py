@@ -0,0 +1,89 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Record of the resources a run created.
+
+Every resource is mapped to the load balancer it belongs to, which the
+tasks use to find the load balancer behind a pool or listener id.  When
+[test_params] manifest_file is set the records are also appended to that
+file, one JSON object per line, so a later teardown run can find them.
+"""
+
+import json
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_lb_ids = {}
+_lock = threading.Lock()
+_file = None
+
+
+def record(kind, resource_id, lb_id, name=None):
+    """Records a created resource.
+
+    :param kind: loadbalancer, listener, pool, healthmonitor, member,
+                 l7policy or l7rule.
+    :param resource_id: ID of the new resource.
+    :param lb_id: ID of the load balancer it belongs to.
+    :param name: Name of the new resource.
+    """
+    global _file
+    _lb_ids[resource_id] = lb_id
+    if not CONF.test_params.manifest_file:
+        return
+    line = json.dumps({'kind': kind, 'id': resource_id, 'lb_id': lb_id,
+                       'name': name}) + '\n'
+    with _lock:
+        if _file is None:
+            _file = open(CONF.test_params.manifest_file, 'a')
+        _file.write(line)
+        _file.flush()
+
+
+def remember(resource_id, lb_id):
+    """Maps an existing resource to its load balancer without recording it."""
+    _lb_ids[resource_id] = lb_id
+
+
+def lb_for(resource_id):
+    """Returns the load balancer a recorded resource belongs to."""
+    return _lb_ids.get(resource_id)
+
+
+def load(path=None):
+    """Reads the records of a manifest file.
+
+    :returns: list of record dicts, oldest first.
+    """
+    path = path or CONF.test_params.manifest_file
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def close():
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
@@ -0,0 +1,495 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Values below 2^SUB_BUCKET_BITS microseconds are recorded exactly, larger
+# values keep SUB_BUCKET_BITS - 1 bits of precision (under 1% error).
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+# Largest trackable value is roughly 2^36 microseconds (19 hours).
+MAX_MAGNITUDE = 36 - SUB_BUCKET_BITS
+BUCKET_COUNT = SUB_BUCKET_COUNT + MAX_MAGNITUDE * SUB_BUCKET_HALF
+
+
+def _index(value):
+    if value < SUB_BUCKET_COUNT:
+        return value
+    magnitude = min(value.bit_length() - SUB_BUCKET_BITS, MAX_MAGNITUDE)
+    mantissa = min(value >> magnitude, SUB_BUCKET_COUNT - 1)
+    return (SUB_BUCKET_COUNT + (magnitude - 1) * SUB_BUCKET_HALF +
+            mantissa - SUB_BUCKET_HALF)
+
+
+def _value(index):
+    """Returns the midpoint of the values recorded in a bucket."""
+    if index < SUB_BUCKET_COUNT:
+        return index
+    magnitude = (index - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+    mantissa = (index - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + SUB_BUCKET_HALF
+    return (mantissa << magnitude) + ((1 << magnitude) >> 1)
+
+
+class Histogram(object):
+    """Fixed memory log-linear histogram of microsecond values.
+
+    This follows the HdrHistogram layout: memory use does not depend on
+    the number of values recorded and histograms from different workers
+    can be merged by adding bucket counts.
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        value = max(int(value), 0)
+        self.counts[_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = max(int(round(self.count * percent / 100.0)), 1)
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(_value(i), self.max)
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return 0
+        return self.total / float(self.count)
+
+    def to_dict(self):
+        return {'counts': dict((str(i), c) for i, c in
+                               enumerate(self.counts) if c),
+                'count': self.count, 'total': self.total,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        for i, c in data['counts'].items():
+            hist.counts[int(i)] = c
+        hist.count = data['count']
+        hist.total = data['total']
+        hist.min = data['min']
+        hist.max = data['max']
+        return hist
+
+    def summary(self):
+        """Returns count, mean, percentiles and max in milliseconds."""
+        result = {'count': self.count,
+                  'mean_ms': self.mean() / 1000.0,
+                  'max_ms': self.max / 1000.0}
+        for p in PERCENTILES:
+            result['p{}_ms'.format(p)] = self.percentile(p) / 1000.0
+        return result
+
+
+class OperationStats(object):
+    """Statistics for one type of API operation."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.status_codes = {}
+        self.calls = 0
+        self.retries = 0
+        self.max_retries = 0
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        for code, count in other.status_codes.items():
+            self.status_codes[code] = self.status_codes.get(code, 0) + count
+        self.calls += other.calls
+        self.retries += other.retries
+        self.max_retries = max(self.max_retries, other.max_retries)
+
+    def to_dict(self):
+        return {'latency': self.latency.to_dict(),
+                'status_codes': self.status_codes, 'calls': self.calls,
+                'retries': self.retries, 'max_retries': self.max_retries}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.latency = Histogram.from_dict(data['latency'])
+        stats.status_codes = dict(data['status_codes'])
+        stats.calls = data['calls']
+        stats.retries = data['retries']
+        stats.max_retries = data['max_retries']
+        return stats
+
+
+class Registry(object):
+    """Collects the statistics of a run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start = time.time()
+        self.end = None
+        self.operations = {}
+        self.time_to_active = {}
+        # Client side latencies of whole workload operations, which are
+        # not HTTP requests and stay out of the request totals.
+        self.latencies = {}
+        self.errors = {}
+
+    def _operation(self, operation):
+        stats = self.operations.get(operation)
+        if stats is None:
+            stats = self.operations[operation] = OperationStats()
+        return stats
+
+    def record_request(self, operation, latency, status):
+        with self._lock:
+            stats = self._operation(operation)
+            stats.latency.record(latency * 1000000)
+            status = str(status)
+            stats.status_codes[status] = stats.status_codes.get(status, 0) + 1
+
+    def record_call(self, operation, retries):
+        with self._lock:
+            stats = self._operation(operation)
+            stats.calls += 1
+            stats.retries += retries
+            stats.max_retries = max(stats.max_retries, retries)
+
+    def record_latency(self, name, latency, outcome=None):
+        with self._lock:
+            stats = self.latencies.get(name)
+            if stats is None:
+                stats = self.latencies[name] = OperationStats()
+            stats.latency.record(latency * 1000000)
+            if outcome is not None:
+                outcome = str(outcome)
+                stats.status_codes[outcome] = (
+                    stats.status_codes.get(outcome, 0) + 1)
+
+    def record_time_to_active(self, resource_type, seconds):
+        with self._lock:
+            hist = self.time_to_active.get(resource_type)
+            if hist is None:
+                hist = self.time_to_active[resource_type] = Histogram()
+            hist.record(seconds * 1000000)
+
+    def record_error(self, error):
+        with self._lock:
+            error = str(error)
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    def status_counts(self):
+        """Returns a snapshot of the status code counts per operation."""
+        with self._lock:
+            return dict((op, dict(s.status_codes)) for op, s in
+                        self.operations.items())
+
+    def merge(self, other):
+        with self._lock:
+            self.start = min(self.start, other.start)
+            if other.end is not None:
+                self.end = max(self.end or other.end, other.end)
+            for op, stats in other.operations.items():
+                self._operation(op).merge(stats)
+            for res, hist in other.time_to_active.items():
+                if res not in self.time_to_active:
+                    self.time_to_active[res] = Histogram()
+                self.time_to_active[res].merge(hist)
+            for name, stats in other.latencies.items():
+                if name not in self.latencies:
+                    self.latencies[name] = OperationStats()
+                self.latencies[name].merge(stats)
+            for error, count in other.errors.items():
+                self.errors[error] = self.errors.get(error, 0) + count
+
+    def to_dict(self):
+        with self._lock:
+            return {'start': self.start, 'end': self.end,
+                    'operations': dict((op, s.to_dict()) for op, s in
+                                       self.operations.items()),
+                    'time_to_active': dict(
+                        (res, h.to_dict()) for res, h in
+                        self.time_to_active.items()),
+                    'latencies': dict((name, s.to_dict()) for name, s in
+                                      self.latencies.items()),
+                    'errors': dict(self.errors)}
+
+    @classmethod
+    def from_dict(cls, data):
+        registry = cls()
+        registry.start = data['start']
+        registry.end = data['end']
+        registry.operations = dict(
+            (op, OperationStats.from_dict(s)) for op, s in
+            data['operations'].items())
+        registry.time_to_active = dict(
+            (res, Histogram.from_dict(h)) for res, h in
+            data['time_to_active'].items())
+        registry.latencies = dict(
+            (name, OperationStats.from_dict(s)) for name, s in
+            data.get('latencies', {}).items())
+        registry.errors = dict(data.get('errors', {}))
+        return registry
+
+    def report(self):
+        """Returns the aggregated report for the run as a dict."""
+        with self._lock:
+            elapsed = self.elapsed()
+            operations = {}
+            total = 0
+            for op, stats in sorted(self.operations.items()):
+                summary = stats.latency.summary()
+                summary['requests_per_second'] = (
+                    stats.latency.count / elapsed if elapsed else 0)
+                summary['status_codes'] = dict(stats.status_codes)
+                summary['calls'] = stats.calls
+                summary['retries'] = stats.retries
+                summary['max_retries'] = stats.max_retries
+                operations[op] = summary
+                total += stats.latency.count
+            time_to_active = dict(
+                (res, hist.summary()) for res, hist in
+                sorted(self.time_to_active.items()))
+            latencies = {}
+            for name, stats in sorted(self.latencies.items()):
+                summary = stats.latency.summary()
+                summary['per_second'] = (
+                    stats.latency.count / elapsed if elapsed else 0)
+                summary['outcomes'] = dict(stats.status_codes)
+                latencies[name] = summary
+            errors = dict(self.errors)
+        return {'elapsed_seconds': elapsed,
+                'total_requests': total,
+                'requests_per_second': total / elapsed if elapsed else 0,
+                'operations': operations,
+                'time_to_active': time_to_active,
+                'latencies': latencies,
+                'errors': errors}
+
+
+_registry = Registry()
+
+
+def get_registry():
+    return _registry
+
+
+def reset():
+    """Starts a new registry and returns the previous one."""
+    global _registry
+    old = _registry
+    old.end = old.end or time.time()
+    _registry = Registry()
+    return old
+
+
+def record_request(operation, latency, status):
+    """Records one HTTP request.
+
+    :param operation: Operation name, see operation_name().
+    :param latency: Seconds the request took.
+    :param status: Response status code or a short error string.
+    """
+    _registry.record_request(operation, latency, status)
+
+
+def record_call(operation, retries):
+    """Records a completed API call and the number of retries it took."""
+    _registry.record_call(operation, retries)
+
+
+def record_latency(name, latency, outcome=None):
+    """Records the client side latency of a workload operation.
+
+    Unlike record_request this is not counted as an HTTP request.
+
+    :param name: Name to report the latency under, like scheduled_<op>.
+    :param latency: Seconds the operation took.
+    :param outcome: 'ok' or a short error string, None to not count one.
+    """
+    _registry.record_latency(name, latency, outcome)
+
+
+def record_time_to_active(resource_type, seconds):
+    """Records how long a change took to make the load balancer ACTIVE."""
+    _registry.record_time_to_active(resource_type, seconds)
+
+
+def record_error(error):
+    """Records a failure that aborted a flow or a worker."""
+    _registry.record_error(error)
+
+
+def _singular(collection):
+    if collection.endswith('ies'):
+        return collection[:-3] + 'y'
+    if collection.endswith('s'):
+        return collection[:-1]
+    return collection
+
+
+def operation_name(method, path):
+    """Derives an operation name from an Octavia API request.
+
+    'POST v2.0/lbaas/pools/<id>/members' becomes 'create_member',
+    'GET v2.0/lbaas/loadbalancers/<id>' becomes 'show_loadbalancer'.
+    """
+    path = path.split('?', 1)[0].strip('/')
+    if path.startswith('v2.0/lbaas/'):
+        path = path[len('v2.0/lbaas/'):]
+    elif path.startswith('v2/lbaas/'):
+        path = path[len('v2/lbaas/'):]
+    parts = [p for p in path.split('/') if p]
+    if not parts:
+        return method.lower()
+    if len(parts) % 2:
+        collection = parts[-1]
+        has_id = False
+    else:
+        collection = parts[-2]
+        has_id = True
+    if collection == 'rules':
+        collection = 'l7rules'
+    if parts[-1] in ('status', 'stats', 'failover'):
+        return '{0}_{1}'.format(_singular(parts[-3]), parts[-1])
+    if method == 'POST':
+        verb = 'create'
+    elif method == 'GET':
+        verb = 'show' if has_id else 'list'
+    elif method == 'PUT':
+        verb = 'update' if has_id else 'batch_update'
+    elif method == 'DELETE':
+        verb = 'delete'
+    else:
+        verb = method.lower()
+    return '{0}_{1}'.format(verb, _singular(collection))
+
+
+def format_table(report):
+    """Formats a report as a human readable table."""
+    lines = []
+    header = ('{0:<28} {1:>8} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9} {7:>9} '
+              '{8:>8}'.format('operation', 'requests', 'req/s', 'p50 ms',
+                              'p90 ms', 'p99 ms', 'p99.9 ms', 'max ms',
+                              'retries'))
+    row = ('{0:<28} {1:>8} {2:>8.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f} '
+           '{6:>9.1f} {7:>9.1f} {8:>8}')
+    lines.append(header)
+    lines.append('-' * len(header))
+    for op, s in sorted(report['operations'].items()):
+        lines.append(row.format(op, s['count'], s['requests_per_second'],
+                                s['p50_ms'], s['p90_ms'], s['p99_ms'],
+                                s['p99.9_ms'], s['max_ms'], s['retries']))
+        codes = ', '.join('{0}: {1}'.format(code, count) for code, count in
+                          sorted(s['status_codes'].items()))
+        lines.append('{0:<28} status codes {1}'.format('', codes))
+    lines.append('')
+    lines.append('Total: {0} requests in {1:.1f} seconds, {2:.1f} '
+                 'requests/sec'.format(report['total_requests'],
+                                       report['elapsed_seconds'],
+                                       report['requests_per_second']))
+    if report['time_to_active']:
+        lines.append('')
+        header = ('{0:<28} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+            'time to ACTIVE', 'count', 'p50 ms', 'p90 ms', 'p99 ms',
+            'p99.9 ms', 'max ms'))
+        row = ('{0:<28} {1:>8} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f} '
+               '{6:>9.1f}')
+        lines.append(header)
+        lines.append('-' * len(header))
+        for res, s in sorted(report['time_to_active'].items()):
+            lines.append(row.format(res, s['count'], s['p50_ms'],
+                                    s['p90_ms'], s['p99_ms'], s['p99.9_ms'],
+                                    s['max_ms']))
+    if report.get('latencies'):
+        lines.append('')
+        header = ('{0:<28} {1:>8} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9} '
+                  '{7:>9}'.format('workload latency', 'count', 'per s',
+                                  'p50 ms', 'p90 ms', 'p99 ms', 'p99.9 ms',
+                                  'max ms'))
+        row = ('{0:<28} {1:>8} {2:>8.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f} '
+               '{6:>9.1f} {7:>9.1f}')
+        lines.append(header)
+        lines.append('-' * len(header))
+        for name, s in sorted(report['latencies'].items()):
+            lines.append(row.format(name, s['count'], s['per_second'],
+                                    s['p50_ms'], s['p90_ms'], s['p99_ms'],
+                                    s['p99.9_ms'], s['max_ms']))
+            if s['outcomes']:
+                outcomes = ', '.join(
+                    '{0}: {1}'.format(outcome, count) for outcome, count in
+                    sorted(s['outcomes'].items()))
+                lines.append('{0:<28} outcomes {1}'.format('', outcomes))
+    if report.get('errors'):
+        lines.append('')
+        lines.append('Errors:')
+        for error, count in sorted(report['errors'].items()):
+            lines.append('  {0} x {1}'.format(count, error))
+    return '\n'.join(lines)
+
+
+def emit_report(registry=None):
+    """Writes the JSON report and prints the table for a registry.
+
+    :returns: The report dict.
+    """
+    registry = registry or _registry
+    registry.end = registry.end or time.time()
+    report = registry.report()
+    print(format_table(report))
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if CONF.metrics.report_file:
+        with open(CONF.metrics.report_file, 'w') as f:
+            f.write(text)
+        LOG.info('Wrote metrics report to {}'.format(
+            CONF.metrics.report_file))
+    else:
+        print(text)
+    return report
@@ -0,0 +1,103 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Mixed read and write workload.
+
+A pool of reader threads lists and shows resources while a pool of
+writer threads keeps creating and updating members, which takes the
+load balancer lock.  [mixed] read_ratio splits [mixed] concurrency
+between the two pools.  Besides the usual per operation numbers, the
+workload latencies of the report have every read as mixed_read and every
+write as mixed_write, so the effect of the writes on read latency is
+visible at a glance.
+"""
+
+import random
+import threading
+import timeit
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import metrics
+import workload
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def _worker(side, mix, target, deadline, rng):
+    while timeit.default_timer() < deadline:
+        name, operation = mix.choose(rng)
+        status = 'ok'
+        start = timeit.default_timer()
+        try:
+            operation(target)
+        except Exception as e:
+            LOG.warning('Mixed {0} {1} failed: {2}'.format(side, name, e))
+            status = type(e).__name__
+        metrics.record_latency('mixed_' + side,
+                               timeit.default_timer() - start, status)
+
+
+def split(concurrency, read_ratio):
+    """Returns the number of (readers, writers) for a read ratio.
+
+    :raises Exception: If a read ratio between 0 and 1 can't get both a
+                       reader and a writer.
+    """
+    if 0 < read_ratio < 1 and concurrency < 2:
+        raise Exception('A read_ratio of {0} needs a concurrency of at '
+                        'least 2, got {1}.'.format(read_ratio, concurrency))
+    readers = int(round(concurrency * read_ratio))
+    if read_ratio > 0:
+        readers = max(readers, 1)
+    if read_ratio < 1:
+        readers = min(readers, concurrency - 1)
+    return readers, concurrency - readers
+
+
+def run(target=None, duration=None):
+    """Runs readers and writers against a target for a fixed duration.
+
+    :param target: workload.Target to use, prepared if not given.
+    :param duration: Seconds to run, defaults to [mixed] duration.
+    """
+    if target is None:
+        target = workload.prepare_target()
+    duration = duration or CONF.mixed.duration
+    readers, writers = split(CONF.mixed.concurrency, CONF.mixed.read_ratio)
+    read_mix = workload.OperationMix(CONF.mixed.read_operations,
+                                     workload.READ_OPERATIONS)
+    write_mix = workload.OperationMix(CONF.mixed.write_operations,
+                                      workload.WRITE_OPERATIONS)
+    seed = random.Random(CONF.mixed.seed)
+    target.rng.seed(seed.random())
+
+    LOG.info('Mixed workload: {0} readers and {1} writers for {2} '
+             'seconds'.format(readers, writers, duration))
+    deadline = timeit.default_timer() + duration
+    threads = []
+    for side, mix, count in (('read', read_mix, readers),
+                             ('write', write_mix, writers)):
+        for i in range(count):
+            thread = threading.Thread(
+                target=_worker, name='mixed-{0}-{1}'.format(side, i),
+                args=(side, mix, target, deadline,
+                      random.Random(seed.random())))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,726 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Local stand-in for the Octavia and Keystone APIs.
+
+Implements the parts of the APIs used by the stress tasks so flows can be
+run without a cloud.  Load balancer status transitions are evaluated
+lazily when a load balancer is accessed, so there are no timers and the
+server stays cheap at very high request rates.
+
+Example::
+
+    python mock_octavia.py --port 9876 --active-delay 0.5
+
+and point the tool at it with::
+
+    [keystone_authtoken]
+    auth_url = http://127.0.0.1:9876/identity
+    [test_params]
+    api_endpoint = http://127.0.0.1:9876/load-balancer
+"""
+
+import asyncio
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+from urllib import parse
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+mock_opts = [
+    cfg.StrOpt('bind-host', default='127.0.0.1',
+               help='Address to listen on.'),
+    cfg.PortOpt('port', default=9876,
+                help='Port to listen on.'),
+    cfg.FloatOpt('active-delay', default=0.5, min=0,
+                 help='Seconds a load balancer stays PENDING_UPDATE after '
+                      'a change.'),
+    cfg.FloatOpt('create-delay', default=1.0, min=0,
+                 help='Seconds a new load balancer stays PENDING_CREATE.'),
+    cfg.FloatOpt('error-rate', default=0.0, min=0, max=1,
+                 help='Fraction of changes that leave the load balancer in '
+                      'ERROR.'),
+    cfg.FloatOpt('unavailable-rate', default=0.0, min=0, max=1,
+                 help='Fraction of requests answered with a 503.'),
+    cfg.IntOpt('token-lifetime', default=3600, min=1,
+               help='Seconds until issued tokens expire.'),
+]
+
+REASONS = {200: 'OK', 201: 'Created', 202: 'Accepted', 204: 'No Content',
+           400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict',
+           503: 'Service Unavailable'}
+
+IMMUTABLE = ('PENDING_CREATE', 'PENDING_UPDATE', 'PENDING_DELETE')
+
+READ_ONLY = ('id', 'provisioning_status', 'operating_status', 'project_id',
+             'loadbalancers', 'listeners', 'pools', 'members', 'address',
+             'protocol', 'protocol_port', 'vip_address', 'vip_subnet_id',
+             'l7policies', 'rules', 'listener_id')
+
+COLLECTIONS = {
+    'loadbalancers': 'loadbalancer',
+    'listeners': 'listener',
+    'pools': 'pool',
+    'healthmonitors': 'healthmonitor',
+    'l7policies': 'l7policy',
+}
+
+L7POLICY_ACTIONS = ('REJECT', 'REDIRECT_TO_URL', 'REDIRECT_TO_POOL')
+
+
+class HTTPError(Exception):
+    def __init__(self, code, message):
+        super(HTTPError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+class MockOctavia(object):
+    """In memory Octavia and Keystone API state."""
+
+    def __init__(self, active_delay=0.5, create_delay=1.0, error_rate=0.0,
+                 unavailable_rate=0.0, token_lifetime=3600):
+        self.active_delay = active_delay
+        self.create_delay = create_delay
+        self.error_rate = error_rate
+        self.unavailable_rate = unavailable_rate
+        self.token_lifetime = token_lifetime
+        self.resources = dict((c, {}) for c in COLLECTIONS)
+        self.members = {}
+        self.l7rules = {}
+        self.requests = 0
+
+    # Load balancer status handling
+
+    def _refresh(self, lb):
+        until = lb['_until']
+        if until is not None and time.time() >= until:
+            lb['provisioning_status'] = lb['_next']
+            lb['_until'] = None
+            if lb['_next'] == 'DELETED':
+                self._purge(lb)
+        return lb
+
+    def _purge(self, lb):
+        """Removes a deleted load balancer and everything below it."""
+        for pool_id in lb['_pools']:
+            self._remove_pool(self.resources['pools'][pool_id])
+        for listener_id in lb['_listeners']:
+            self._remove_listener(self.resources['listeners'][listener_id])
+        del self.resources['loadbalancers'][lb['id']]
+
+    def _lock(self, lb, pending='PENDING_UPDATE', delay=None):
+        """Moves a load balancer to a PENDING state or raises a 409."""
+        self._refresh(lb)
+        if lb['provisioning_status'] in IMMUTABLE:
+            raise HTTPError(409, 'Load Balancer {0} is immutable and cannot '
+                                 'be updated.'.format(lb['id']))
+        self._transition(lb, pending, delay)
+
+    def _transition(self, lb, pending, delay=None, done='ACTIVE'):
+        if delay is None:
+            delay = self.active_delay
+        lb['provisioning_status'] = pending
+        lb['_until'] = time.time() + delay
+        if self.error_rate and random.random() < self.error_rate:
+            lb['_next'] = 'ERROR'
+        else:
+            lb['_next'] = done
+
+    def _get(self, collection, resource_id):
+        obj = self.resources[collection].get(resource_id)
+        if obj is not None and collection == 'loadbalancers':
+            self._refresh(obj)
+            if obj['provisioning_status'] == 'DELETED':
+                obj = None
+        if obj is None:
+            raise HTTPError(404, '{0} {1} not found.'.format(
+                COLLECTIONS[collection].capitalize(), resource_id))
+        return obj
+
+    def _get_member(self, pool_id, member_id):
+        member = self.members.get(member_id)
+        if member is None or member['_pool'] != pool_id:
+            raise HTTPError(404, 'Member {} not found.'.format(member_id))
+        return member
+
+    def _get_l7rule(self, l7policy_id, l7rule_id):
+        rule = self.l7rules.get(l7rule_id)
+        if rule is None or rule['_l7policy'] != l7policy_id:
+            raise HTTPError(404, 'L7rule {} not found.'.format(l7rule_id))
+        return rule
+
+    def _lb_for(self, obj):
+        return self.resources['loadbalancers'][obj['_lb']]
+
+    @staticmethod
+    def _public(obj):
+        result = dict((k, v) for k, v in obj.items() if not k.startswith('_'))
+        # Child IDs are kept as plain lists, the API shows them as objects.
+        for key in ('listeners', 'pools', 'members', 'l7policies', 'rules'):
+            if '_' + key in obj:
+                result[key] = [{'id': i} for i in obj['_' + key]]
+        return result
+
+    def _new(self, body, lb_id, **fields):
+        obj = {'id': str(uuid.uuid4()), 'name': body.get('name', ''),
+               'provisioning_status': 'ACTIVE', 'operating_status': 'ONLINE',
+               'admin_state_up': body.get('admin_state_up', True),
+               'project_id': body.get('project_id', ''), '_lb': lb_id}
+        obj.update(fields)
+        return obj
+
+    # Keystone
+
+    def create_token(self, body):
+        try:
+            project = body['auth']['scope']['project']['name']
+        except (KeyError, TypeError):
+            project = ''
+        expires = (datetime.datetime.utcnow() +
+                   datetime.timedelta(seconds=self.token_lifetime))
+        token = uuid.uuid4().hex
+        result = {'token': {
+            'expires_at': expires.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+            'project': {'name': project, 'id': uuid.uuid5(
+                uuid.NAMESPACE_DNS, project or 'default').hex}}}
+        return 201, result, {'X-Subject-Token': token}
+
+    # Octavia
+
+    def create_loadbalancer(self, body):
+        body = body['loadbalancer']
+        lb = self._new(body, None, vip_subnet_id=body.get('vip_subnet_id'),
+                       vip_address='10.0.0.{}'.format(
+                           len(self.resources['loadbalancers']) % 250 + 2),
+                       _listeners=[], _pools=[], _until=None,
+                       _next='ACTIVE')
+        lb['_lb'] = lb['id']
+        self._transition(lb, 'PENDING_CREATE', self.create_delay)
+        self.resources['loadbalancers'][lb['id']] = lb
+        return 201, {'loadbalancer': self._public(lb)}
+
+    def create_listener(self, body):
+        body = body['listener']
+        lb = self._get('loadbalancers', body.get('loadbalancer_id'))
+        port = body.get('protocol_port')
+        for listener_id in lb['_listeners']:
+            if self.resources['listeners'][listener_id][
+                    'protocol_port'] == port:
+                raise HTTPError(409, 'Another Listener on this Load Balancer '
+                                     'is already using protocol_port '
+                                     '{}'.format(port))
+        self._lock(lb)
+        listener = self._new(body, lb['id'], protocol=body.get('protocol'),
+                             protocol_port=port,
+                             loadbalancers=[{'id': lb['id']}],
+                             default_pool_id=None, _l7policies=[])
+        self.resources['listeners'][listener['id']] = listener
+        lb['_listeners'].append(listener['id'])
+        return 201, {'listener': self._public(listener)}
+
+    def create_pool(self, body):
+        body = body['pool']
+        listener = None
+        if body.get('listener_id'):
+            listener = self._get('listeners', body['listener_id'])
+            lb = self._lb_for(listener)
+        else:
+            lb = self._get('loadbalancers', body.get('loadbalancer_id'))
+        self._lock(lb)
+        pool = self._new(body, lb['id'], protocol=body.get('protocol'),
+                         lb_algorithm=body.get('lb_algorithm'),
+                         loadbalancers=[{'id': lb['id']}],
+                         listeners=[], _members=[], healthmonitor_id=None)
+        if listener is not None:
+            pool['listeners'].append({'id': listener['id']})
+            listener['default_pool_id'] = pool['id']
+        self.resources['pools'][pool['id']] = pool
+        lb['_pools'].append(pool['id'])
+        return 201, {'pool': self._public(pool)}
+
+    def create_healthmonitor(self, body):
+        body = body['healthmonitor']
+        pool = self._get('pools', body.get('pool_id'))
+        if pool['healthmonitor_id']:
+            raise HTTPError(409, 'This Pool already has a Health '
+                                 'Monitor')
+        self._lock(self._lb_for(pool))
+        hm = self._new(body, pool['_lb'], type=body.get('type'),
+                       delay=body.get('delay'), timeout=body.get('timeout'),
+                       max_retries=body.get('max_retries'),
+                       pools=[{'id': pool['id']}])
+        self.resources['healthmonitors'][hm['id']] = hm
+        pool['healthmonitor_id'] = hm['id']
+        return 201, {'healthmonitor': self._public(hm)}
+
+    def create_member(self, pool_id, body):
+        body = body['member']
+        pool = self._get('pools', pool_id)
+        key = (body.get('address'), body.get('protocol_port'))
+        for member_id in pool['_members']:
+            member = self.members[member_id]
+            if (member['address'], member['protocol_port']) == key:
+                raise HTTPError(409, 'Duplicate member with address '
+                                     '{0} and port {1}'.format(*key))
+        self._lock(self._lb_for(pool))
+        member = self._new(body, pool['_lb'], address=key[0],
+                           protocol_port=key[1],
+                           subnet_id=body.get('subnet_id'),
+                           weight=body.get('weight', 1), _pool=pool_id)
+        self.members[member['id']] = member
+        pool['_members'].append(member['id'])
+        return 201, {'member': self._public(member)}
+
+    def create_l7policy(self, body):
+        body = body['l7policy']
+        listener = self._get('listeners', body.get('listener_id'))
+        lb = self._lb_for(listener)
+        action = body.get('action')
+        if action not in L7POLICY_ACTIONS:
+            raise HTTPError(400, 'Invalid input for field/attribute action. '
+                                 'Value: {}'.format(action))
+        if action == 'REDIRECT_TO_POOL':
+            pool = self.resources['pools'].get(body.get('redirect_pool_id'))
+            if pool is None or pool['_lb'] != lb['id']:
+                raise HTTPError(400, 'Pool {} not found on this Load '
+                                     'Balancer.'.format(
+                                         body.get('redirect_pool_id')))
+        self._lock(lb)
+        policy = self._new(body, lb['id'], action=action,
+                           listener_id=listener['id'],
+                           redirect_pool_id=body.get('redirect_pool_id'),
+                           redirect_url=body.get('redirect_url'),
+                           position=None, _rules=[])
+        self.resources['l7policies'][policy['id']] = policy
+        # Positions start at 1, anything past the end appends.
+        policies = listener['_l7policies']
+        position = body.get('position') or len(policies) + 1
+        policies.insert(min(position, len(policies) + 1) - 1, policy['id'])
+        self._renumber(listener)
+        return 201, {'l7policy': self._public(policy)}
+
+    def _renumber(self, listener):
+        for i, policy_id in enumerate(listener['_l7policies']):
+            self.resources['l7policies'][policy_id]['position'] = i + 1
+
+    def create_l7rule(self, l7policy_id, body):
+        body = body['rule']
+        policy = self._get('l7policies', l7policy_id)
+        for key in ('type', 'compare_type', 'value'):
+            if not body.get(key):
+                raise HTTPError(400, 'Invalid input for field/attribute '
+                                     '{}.'.format(key))
+        self._lock(self._lb_for(policy))
+        rule = self._new(body, policy['_lb'], type=body['type'],
+                         compare_type=body['compare_type'],
+                         key=body.get('key'), value=body['value'],
+                         invert=body.get('invert', False),
+                         _l7policy=l7policy_id)
+        self.l7rules[rule['id']] = rule
+        policy['_rules'].append(rule['id'])
+        return 201, {'rule': self._public(rule)}
+
+    def batch_update_members(self, pool_id, body):
+        wanted = body['members']
+        pool = self._get('pools', pool_id)
+        self._lock(self._lb_for(pool))
+        existing = dict(((self.members[m]['address'],
+                          self.members[m]['protocol_port']), m)
+                        for m in pool['_members'])
+        members = []
+        for spec in wanted:
+            key = (spec.get('address'), spec.get('protocol_port'))
+            member_id = existing.pop(key, None)
+            if member_id is None:
+                member = self._new(spec, pool['_lb'], address=key[0],
+                                   protocol_port=key[1],
+                                   subnet_id=spec.get('subnet_id'),
+                                   weight=spec.get('weight', 1),
+                                   _pool=pool_id)
+                member_id = member['id']
+                self.members[member_id] = member
+            else:
+                self.members[member_id].update(
+                    (k, v) for k, v in spec.items()
+                    if k in ('name', 'weight', 'admin_state_up'))
+            members.append(member_id)
+        for member_id in existing.values():
+            del self.members[member_id]
+        pool['_members'] = members
+        return 202, None
+
+    def show(self, collection, resource_id):
+        obj = self._get(collection, resource_id)
+        return 200, {COLLECTIONS[collection]: self._public(obj)}
+
+    def show_member(self, pool_id, member_id):
+        self._get('pools', pool_id)
+        return 200, {'member': self._public(self._get_member(pool_id,
+                                                             member_id))}
+
+    def show_l7rule(self, l7policy_id, l7rule_id):
+        self._get('l7policies', l7policy_id)
+        return 200, {'rule': self._public(self._get_l7rule(l7policy_id,
+                                                           l7rule_id))}
+
+    def list(self, collection, query, path, pool_id=None, l7policy_id=None):
+        """Lists a collection with filters, fields and marker paging."""
+        if pool_id is not None:
+            objs = [self.members[m]
+                    for m in self._get('pools', pool_id)['_members']]
+        elif l7policy_id is not None:
+            objs = [self.l7rules[r]
+                    for r in self._get('l7policies', l7policy_id)['_rules']]
+        else:
+            if collection == 'loadbalancers':
+                for lb in list(self.resources['loadbalancers'].values()):
+                    self._refresh(lb)
+            objs = list(self.resources[collection].values())
+        limit = int(query.pop('limit', [0])[0])
+        marker = query.pop('marker', [None])[0]
+        fields = query.pop('fields', [])
+        for name, values in query.items():
+            objs = [o for o in objs if str(o.get(name)) in values]
+        if marker is not None:
+            ids = [o['id'] for o in objs]
+            if marker not in ids:
+                raise HTTPError(404, 'Marker {} not found.'.format(marker))
+            objs = objs[ids.index(marker) + 1:]
+        links = []
+        if limit and len(objs) > limit:
+            objs = objs[:limit]
+            links.append({'rel': 'next', 'href': '{0}?{1}'.format(
+                path, parse.urlencode({'limit': limit,
+                                       'marker': objs[-1]['id']}))})
+        results = [self._public(o) for o in objs]
+        if fields:
+            fields = set(f for value in fields for f in value.split(','))
+            results = [dict((k, v) for k, v in o.items() if k in fields)
+                       for o in results]
+        return 200, {collection: results, collection + '_links': links}
+
+    def _update(self, obj, body):
+        self._lock(self._lb_for(obj))
+        for key, value in body.items():
+            if key in obj and key not in READ_ONLY:
+                obj[key] = value
+        return self._public(obj)
+
+    def update(self, collection, resource_id, body):
+        key = COLLECTIONS[collection]
+        obj = self._get(collection, resource_id)
+        return 202, {key: self._update(obj, body[key])}
+
+    def update_member(self, pool_id, member_id, body):
+        self._get('pools', pool_id)
+        member = self._get_member(pool_id, member_id)
+        return 202, {'member': self._update(member, body['member'])}
+
+    def update_l7rule(self, l7policy_id, l7rule_id, body):
+        self._get('l7policies', l7policy_id)
+        rule = self._get_l7rule(l7policy_id, l7rule_id)
+        return 202, {'rule': self._update(rule, body['rule'])}
+
+    def delete_loadbalancer(self, lb_id, query):
+        lb = self._get('loadbalancers', lb_id)
+        cascade = query.get('cascade', ['false'])[0].lower() == 'true'
+        if not cascade and (lb['_listeners'] or lb['_pools']):
+            raise HTTPError(400, 'Cannot delete Load Balancer {} - it has '
+                                 'children'.format(lb_id))
+        self._lock(lb, 'PENDING_DELETE')
+        # Errors are only injected into updates.
+        lb['_next'] = 'DELETED'
+        return 204, None
+
+    def delete_listener(self, listener_id, query):
+        listener = self._get('listeners', listener_id)
+        lb = self._lb_for(listener)
+        self._lock(lb)
+        for pool_id in lb['_pools']:
+            pool = self.resources['pools'][pool_id]
+            pool['listeners'] = [p for p in pool['listeners']
+                                 if p['id'] != listener_id]
+        lb['_listeners'].remove(listener_id)
+        self._remove_listener(listener)
+        return 204, None
+
+    def _remove_listener(self, listener):
+        # The L7 policies and rules of a listener go with it.
+        for policy_id in listener['_l7policies']:
+            self._remove_l7policy(self.resources['l7policies'][policy_id])
+        del self.resources['listeners'][listener['id']]
+
+    def _remove_l7policy(self, policy):
+        for rule_id in policy['_rules']:
+            del self.l7rules[rule_id]
+        del self.resources['l7policies'][policy['id']]
+
+    def _remove_pool(self, pool):
+        for member_id in pool['_members']:
+            del self.members[member_id]
+        if pool['healthmonitor_id']:
+            del self.resources['healthmonitors'][pool['healthmonitor_id']]
+        del self.resources['pools'][pool['id']]
+
+    def delete_pool(self, pool_id, query):
+        pool = self._get('pools', pool_id)
+        lb = self._lb_for(pool)
+        for policy in self.resources['l7policies'].values():
+            if policy['redirect_pool_id'] == pool_id:
+                raise HTTPError(409, 'Pool {0} is in use by L7 policy '
+                                     '{1}'.format(pool_id, policy['id']))
+        self._lock(lb)
+        for listener_id in lb['_listeners']:
+            listener = self.resources['listeners'][listener_id]
+            if listener['default_pool_id'] == pool_id:
+                listener['default_pool_id'] = None
+        lb['_pools'].remove(pool_id)
+        self._remove_pool(pool)
+        return 204, None
+
+    def delete_healthmonitor(self, healthmonitor_id, query):
+        hm = self._get('healthmonitors', healthmonitor_id)
+        self._lock(self._lb_for(hm))
+        self.resources['pools'][hm['pools'][0]['id']][
+            'healthmonitor_id'] = None
+        del self.resources['healthmonitors'][healthmonitor_id]
+        return 204, None
+
+    def delete_l7policy(self, l7policy_id, query):
+        policy = self._get('l7policies', l7policy_id)
+        self._lock(self._lb_for(policy))
+        listener = self.resources['listeners'][policy['listener_id']]
+        listener['_l7policies'].remove(l7policy_id)
+        self._renumber(listener)
+        self._remove_l7policy(policy)
+        return 204, None
+
+    def delete_l7rule(self, l7policy_id, l7rule_id):
+        policy = self._get('l7policies', l7policy_id)
+        self._get_l7rule(l7policy_id, l7rule_id)
+        self._lock(self._lb_for(policy))
+        policy['_rules'].remove(l7rule_id)
+        del self.l7rules[l7rule_id]
+        return 204, None
+
+    def delete_member(self, pool_id, member_id):
+        pool = self._get('pools', pool_id)
+        self._get_member(pool_id, member_id)
+        self._lock(self._lb_for(pool))
+        pool['_members'].remove(member_id)
+        del self.members[member_id]
+        return 204, None
+
+    # Request dispatch
+
+    def handle(self, method, path, body):
+        """Handles one request.
+
+        :returns: (status code, response dict or None, extra headers)
+        """
+        self.requests += 1
+        if self.unavailable_rate and random.random() < self.unavailable_rate:
+            return 503, {'faultstring': 'Injected failure'}, {}
+        path, _, query = path.partition('?')
+        try:
+            data = json.loads(body) if body else {}
+            if path.endswith('/v3/auth/tokens'):
+                if method != 'POST':
+                    raise HTTPError(405, 'Method not allowed')
+                return self.create_token(data)
+            result = self._route(method, path, data, parse.parse_qs(query))
+            return result[0], result[1], {}
+        except HTTPError as e:
+            return e.code, {'faultcode': 'Client',
+                            'faultstring': e.message}, {}
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'faultcode': 'Client',
+                         'faultstring': 'Invalid input: {}'.format(e)}, {}
+
+    def _route(self, method, path, data, query):
+        marker = path.find('/lbaas/')
+        if marker == -1:
+            raise HTTPError(404, 'Unknown path {}'.format(path))
+        parts = [p for p in path[marker + len('/lbaas/'):].split('/') if p]
+        collection = parts[0]
+        if collection not in COLLECTIONS:
+            raise HTTPError(404, 'Unknown collection {}'.format(collection))
+        if len(parts) == 1 and method == 'POST':
+            return getattr(self, 'create_' + COLLECTIONS[collection])(data)
+        if len(parts) == 1 and method == 'GET':
+            return self.list(collection, query, path)
+        if len(parts) == 2 and method == 'GET':
+            return self.show(collection, parts[1])
+        if len(parts) == 2 and method == 'PUT':
+            return self.update(collection, parts[1], data)
+        if len(parts) == 2 and method == 'DELETE':
+            return getattr(self, 'delete_' + COLLECTIONS[collection])(
+                parts[1], query)
+        if collection == 'pools' and len(parts) == 3 and parts[2] == 'members':
+            if method == 'POST':
+                return self.create_member(parts[1], data)
+            if method == 'PUT':
+                return self.batch_update_members(parts[1], data)
+            if method == 'GET':
+                return self.list('members', query, path, pool_id=parts[1])
+        if collection == 'pools' and len(parts) == 4 and parts[2] == 'members':
+            if method == 'GET':
+                return self.show_member(parts[1], parts[3])
+            if method == 'PUT':
+                return self.update_member(parts[1], parts[3], data)
+            if method == 'DELETE':
+                return self.delete_member(parts[1], parts[3])
+        if (collection == 'l7policies' and len(parts) == 3 and
+                parts[2] == 'rules'):
+            if method == 'POST':
+                return self.create_l7rule(parts[1], data)
+            if method == 'GET':
+                return self.list('rules', query, path, l7policy_id=parts[1])
+        if (collection == 'l7policies' and len(parts) == 4 and
+                parts[2] == 'rules'):
+            if method == 'GET':
+                return self.show_l7rule(parts[1], parts[3])
+            if method == 'PUT':
+                return self.update_l7rule(parts[1], parts[3], data)
+            if method == 'DELETE':
+                return self.delete_l7rule(parts[1], parts[3])
+        raise HTTPError(405, 'Method {0} not allowed on {1}'.format(
+            method, path))
+
+
+class MockServer(object):
+    """Serves a MockOctavia over HTTP/1.1 with keep-alive."""
+
+    def __init__(self, api=None, host='127.0.0.1', port=0):
+        self.api = api or MockOctavia()
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, version = lines[0].split(' ', 2)
+                length = 0
+                close = version == 'HTTP/1.0'
+                for line in lines[1:]:
+                    if not line:
+                        continue
+                    name, _, value = line.partition(':')
+                    name = name.strip().lower()
+                    if name == 'content-length':
+                        length = int(value)
+                    elif name == 'connection':
+                        value = value.strip().lower()
+                        close = value == 'close'
+                body = await reader.readexactly(length) if length else b''
+                code, result, headers = self.api.handle(method, target, body)
+                payload = b'' if result is None else json.dumps(
+                    result).encode('utf-8')
+                out = ['HTTP/1.1 {0} {1}'.format(code, REASONS.get(code, '')),
+                       'Content-Type: application/json',
+                       'Content-Length: {}'.format(len(payload))]
+                for name, value in headers.items():
+                    out.append('{0}: {1}'.format(name, value))
+                if close:
+                    out.append('Connection: close')
+                writer.write(('\r\n'.join(out) + '\r\n\r\n').encode('latin-1')
+                             + payload)
+                await writer.drain()
+                if close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+
+    async def start_async(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    def start(self):
+        """Starts serving in a background thread.
+
+        :returns: The port the server listens on.
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start_async())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='mock-octavia')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def url(self, prefix):
+        return 'http://{0}:{1}/{2}'.format(self.host, self.port, prefix)
+
+
+def main():
+    CONF.register_cli_opts(mock_opts)
+    logging.register_options(CONF)
+    CONF(args=sys.argv[1:], project='stressoctaviaapi')
+    logging.setup(CONF, 'mock_octavia')
+    api = MockOctavia(active_delay=CONF.active_delay,
+                      create_delay=CONF.create_delay,
+                      error_rate=CONF.error_rate,
+                      unavailable_rate=CONF.unavailable_rate,
+                      token_lifetime=CONF.token_lifetime)
+    server = MockServer(api, CONF.bind_host, CONF.port)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.start_async())
+    LOG.info('Serving mock Octavia API on {}'.format(
+        server.url('load-balancer')))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    LOG.info('Served {} requests.'.format(api.requests))
+
+
+if __name__ == "__main__":
+    main()
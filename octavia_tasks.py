@@ -12,170 +12,1077 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import asyncio
+import concurrent.futures
 import functools
+import ipaddress
+import json
+import time
 import timeit
+from urllib import parse
 
 from oslo_config import cfg
 from oslo_log import log as logging
-import requests
 from taskflow import task
 
+import aio_http
+import contention
+import event_log
+import http_pool
+import manifest
+import metrics
+import retry_policies
+import status_watcher
+import token_cache
+
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
+# Lower cased starts of the Octavia duplicate entry faultstrings.  A 409 to
+# a create with one of them is about the resource itself, not the load
+# balancer lock, and retrying it can't succeed:
+# DuplicateListenerEntry, DuplicateMemberEntry (both wordings),
+# DuplicateHealthMonitor and DuplicatePoolEntry.
+DUPLICATE_MESSAGES = (
+    'another listener on this load balancer is already using',
+    'another member on this pool is already using ip',
+    'duplicate member with address',
+    'this pool already has a health monitor',
+    'this listener already has a default pool')
+
 
 class BaseOctaviaTask(task.Task):
     """Base task to load code common to the tasks."""
 
     def __init__(self, **kwargs):
         super(BaseOctaviaTask, self).__init__(**kwargs)
+        # Set by checkpoint when a resumed run re-runs this atom, whose
+        # create may have reached the API before the run was interrupted.
+        self.reconcile = False
         self.get = functools.partial(self._request, 'GET')
         self.post = functools.partial(self._request, 'POST')
         self.put = functools.partial(self._request, 'PUT')
         self.delete = functools.partial(self._request, 'DELETE')
+        self.aget = functools.partial(self._arequest, 'GET')
+        self.apost = functools.partial(self._arequest, 'POST')
+        self.aput = functools.partial(self._arequest, 'PUT')
+        self.adelete = functools.partial(self._arequest, 'DELETE')
 
-    def _request(self, method, url, token=None, data=None,
-                params=None):
+    def _prepare(self, method, url, token, data, params, operation):
+        if operation is None:
+            operation = metrics.operation_name(method, str(url))
         headers = {
             'Content-type': 'application/json',
             'User-Agent': 'Stress_Octavia_API',
-            'X-Auth-Token': token
+            'X-Auth-Token': token_cache.current(token)
         }
 
         url = '{}/{}'.format(CONF.test_params.api_endpoint, str(url))
         LOG.debug("url = %s", url)
         LOG.debug("data = %s", data)
         LOG.debug("params = %s", str(params))
+        return url, headers, operation
+
+    def _check_response(self, method, url, operation, r, retry_state,
+                        latency, accept=(), data=None):
+        """Records a response and decides whether to retry it.
+
+        :param accept: Extra status codes to return instead of failing on.
+        :param data: Request body.
+
+        :returns: None if the request succeeded, otherwise the seconds to
+                  wait before retrying.
+        :raises Exception: If the request failed or ran out of retries.
+        """
+        metrics.record_request(operation, latency, r.status_code)
+        event_log.record(operation, url, r.status_code, latency,
+                         retry_state.attempt)
+        contention.observe(method, url, operation, r.status_code,
+                           retry_state, time.time(), data)
+        LOG.debug("Octavia Response Code: %s", r.status_code)
+        LOG.debug("Octavia Response Body: %s", r.content)
+        LOG.debug("Octavia Response Headers: %s", r.headers)
+        if (r.status_code > 199 and r.status_code < 300 or
+                r.status_code in accept):
+            retry_count = retry_state.attempt
+            metrics.record_call(operation, retry_count)
+            if retry_count > 0:
+                LOG.info('{0} to {1} retried {2} '
+                         'times.'.format(method, url, retry_count))
+            return None
+        elif (r.status_code == 409 and method == 'POST' and
+              self._duplicate(r)):
+            LOG.error('{0} to {1} returned {2} with '
+                      'message: {3}'.format(method, url,
+                                            r.status_code, r.content))
+            metrics.record_call(operation, retry_state.attempt)
+            contention.done(retry_state)
+            raise Exception('{0} to {1} failed, the resource already '
+                            'exists. Aborting.'.format(method, url))
+        elif r.status_code == 409 or r.status_code == 503:
+            try:
+                delay = retry_state.next_delay(r.headers)
+            except Exception:
+                LOG.error('{0} to {1} returned {2} after {3} '
+                          'retries.'.format(method, url, r.status_code,
+                                            retry_state.attempt - 1))
+                metrics.record_call(operation, retry_state.attempt - 1)
+                contention.done(retry_state)
+                raise
+            LOG.debug('%s to %s returned %s. Retrying in %.3f seconds.',
+                      method, url, r.status_code, delay)
+            return delay
+        else:
+            LOG.error('{0} to {1} returned {2} with '
+                      'message: {3}'.format(method, url,
+                                            r.status_code, r.content))
+            metrics.record_call(operation, retry_state.attempt)
+            raise Exception('{0} to {1} failed. Aborting.'.format(
+                method, url))
+
+    def _duplicate(self, r):
+        try:
+            message = r.json().get('faultstring') or ''
+        except ValueError:
+            return False
+        return message.lower().startswith(DUPLICATE_MESSAGES)
 
-        retry = True
-        retry_count = 0
-        while retry:
-            r = requests.request(method, url, data=data,
-                                 params=params, headers=headers)
-            LOG.debug("Octavia Response Code: {0}".format(r.status_code))
-            LOG.debug("Octavia Response Body: {0}".format(r.content))
-            LOG.debug("Octavia Response Headers: {0}".format(r.headers))
-            if r.status_code > 199 and r.status_code < 300:
-                retry = False
-            elif r.status_code == 409 or r.status_code == 503:
-                LOG.debug('{0} to {1} returned {2}. '
-                          'Retrying.'.format(method, url, r.status_code))
-                retry_count += 1
-            else:
-                LOG.error('{0} to {1} returned {2} with '
-                          'message: {3}'.format(method, url,
-                                                r.status_code, r.content))
-                raise Exception('{0} to {1} failed. Aborting.'.format(
-                    method, url))
-        if retry_count > 0:
-            LOG.info('{0} to {1} retried {2} '
-                     'times.'.format(method, url, retry_count))
-        return r
+    def _existing(self, resources, match):
+        """Returns the ID of the one listed resource that matches."""
+        found = [resource for resource in resources if match(resource)]
+        if len(found) > 1:
+            LOG.warning('{0} - {1} existing resources match, creating a '
+                        'new one'.format(self.name, len(found)))
+            return None
+        if not found:
+            return None
+        LOG.info('{0} - Found {1}, created before the run was '
+                 'interrupted'.format(self.name, found[0]['id']))
+        return found[0]['id']
+
+    def _find(self, token, collection, params, match):
+        """Looks up what an interrupted run of this atom created.
+
+        :returns: The ID of the resource, None if the atom isn't being
+                  reconciled or nothing matches.
+        """
+        if not self.reconcile:
+            return None
+        self.reconcile = False
+        resources = ListResources(name=self.name).execute(token, collection,
+                                                           params)
+        return self._existing(resources, match)
+
+    def _request(self, method, url, token=None, data=None,
+                 params=None, operation=None, accept=()):
+        url, headers, operation = self._prepare(method, url, token, data,
+                                                params, operation)
+        retry_state = retry_policies.start()
+        while True:
+            start = timeit.default_timer()
+            try:
+                r = http_pool.request(method, url, data=data,
+                                      params=params, headers=headers)
+            except Exception as e:
+                latency = timeit.default_timer() - start
+                metrics.record_request(operation, latency, type(e).__name__)
+                event_log.record(operation, url, type(e).__name__, latency,
+                                 retry_state.attempt)
+                contention.done(retry_state)
+                raise
+            delay = self._check_response(method, url, operation, r,
+                                         retry_state,
+                                         timeit.default_timer() - start,
+                                         accept, data)
+            if delay is None:
+                return r
+            if delay:
+                time.sleep(delay)
+
+    async def _arequest(self, method, url, token=None, data=None,
+                        params=None, operation=None, accept=()):
+        """Non-blocking version of _request for the asyncio engine."""
+        url, headers, operation = self._prepare(method, url, token, data,
+                                                params, operation)
+        retry_state = retry_policies.start()
+        while True:
+            start = timeit.default_timer()
+            try:
+                r = await aio_http.request(method, url, data=data,
+                                           params=params, headers=headers)
+            except Exception as e:
+                latency = timeit.default_timer() - start
+                metrics.record_request(operation, latency, type(e).__name__)
+                event_log.record(operation, url, type(e).__name__, latency,
+                                 retry_state.attempt)
+                contention.done(retry_state)
+                raise
+            delay = self._check_response(method, url, operation, r,
+                                         retry_state,
+                                         timeit.default_timer() - start,
+                                         accept, data)
+            if delay is None:
+                return r
+            if delay:
+                await asyncio.sleep(delay)
 
 
 class CreateLoadBalancer(BaseOctaviaTask):
     """Task to create a load balancer."""
 
+    def _data(self, name):
+        return ('{{"loadbalancer": {{"vip_subnet_id": "{subnet}",'
+                '"name": "{name}"}}}}'.format(
+                    subnet=CONF.test_params.vip_subnet_id, name=name))
+
+    def _lookup(self, name):
+        def match(lb):
+            return lb['provisioning_status'] not in ('PENDING_DELETE',
+                                                     'DELETED')
+        return 'loadbalancers', {'name': name}, match
+
+    def _result(self, r, name):
+        return self._record(r.json()['loadbalancer']['id'], name)
+
+    def _record(self, lb_id, name):
+        manifest.record('loadbalancer', lb_id, lb_id, name)
+        return lb_id
+
     def execute(self, token, name):
 
+        lb_id = self._find(token, *self._lookup(name))
+        if lb_id:
+            return self._record(lb_id, name)
         LOG.info('{0} - Creating load balancer: {1}'.format(self.name, name))
-        data=('{{"loadbalancer": {{"vip_subnet_id": "{subnet}",'
-              '"name": "{name}"}}}}'.format(
-            subnet=CONF.test_params.vip_subnet_id, name=name))
+        r = self.post('v2.0/lbaas/loadbalancers', token=token,
+                      data=self._data(name))
 
-        r = self.post('v2.0/lbaas/loadbalancers', token=token, data=data)
+        return self._result(r, name)
 
-        return r.json()['loadbalancer']['id']
+    async def aexecute(self, token, name):
+
+        LOG.info('{0} - Creating load balancer: {1}'.format(self.name, name))
+        r = await self.apost('v2.0/lbaas/loadbalancers', token=token,
+                             data=self._data(name))
+
+        return self._result(r, name)
 
 
 class WaitForActive(BaseOctaviaTask):
-    """Task to wait for a load balancer to go active."""
+    """Task to wait for a load balancer to go active.
+
+    :param resource_type: The kind of change being waited on, used to
+                          group the time to ACTIVE in the metrics report.
+    """
+
+    target = 'ACTIVE'
+    failures = ('ERROR', 'DELETED')
+
+    def __init__(self, resource_type='loadbalancer', **kwargs):
+        super(WaitForActive, self).__init__(**kwargs)
+        self.resource_type = resource_type
+
+    def _status(self, r):
+        if r.status_code == 404:
+            return 'DELETED'
+        return r.json()['loadbalancer']['provisioning_status']
+
+    def _get_status(self, token, lb_id):
+        r = self.get('v2.0/lbaas/loadbalancers/{0}'.format(lb_id),
+                     token=token, accept=(404,))
+        return self._status(r)
+
+    async def _aget_status(self, token, lb_id):
+        r = await self.aget('v2.0/lbaas/loadbalancers/{0}'.format(lb_id),
+                            token=token, accept=(404,))
+        return self._status(r)
+
+    def _done(self, start_time, polls):
+        elapsed = timeit.default_timer() - start_time
+        metrics.record_time_to_active(self.resource_type, elapsed)
+        LOG.info('{0} - Waited for {1} API queries before LB '
+                 '{2}'.format(self.name, polls, self.target))
+        LOG.info('{0} - Elapsed time: {1}'.format(self.name, elapsed))
+
+    def _failed(self, status):
+        LOG.error('LB went into {}, aborting'.format(status))
+        raise Exception('ABORT: LB went into {}'.format(status))
+
+    def _expired(self, i):
+        LOG.error('LB wait for {0} {1} retries expired, Aborting.'.format(
+            self.target, i))
+        raise Exception('LB did not go {0} in {1} tries, '
+                        'Aborting.'.format(self.target, i))
 
     def execute(self, token, lb_id):
 
         start_time = timeit.default_timer()
+        if CONF.status_poller.coalesce:
+            status, i = status_watcher.wait_for_status(
+                token, lb_id, self._get_status, targets=(self.target,),
+                failures=self.failures,
+                max_polls=CONF.test_params.retries_check_active)
+            self._done(start_time, i)
+            return
         for i in range(CONF.test_params.retries_check_active):
-            r = self.get('v2.0/lbaas/loadbalancers/{0}'.format(lb_id),
-                     token=token)
-            status = r.json()['loadbalancer']['provisioning_status']
-            if status == 'ACTIVE':
-                LOG.info('{0} - Queried API {1} times before LB ACTIVE'.format(
-                    self.name, i))
-                LOG.info('{0} - Elapsed time: {1}'.format(self.name,
-                    timeit.default_timer() - start_time))
+            status = self._get_status(token, lb_id)
+            if status == self.target:
+                self._done(start_time, i)
                 return
-            elif status == 'ERROR':
-                LOG.error('LB went into ERROR, aborting')
-                raise Exception('ABORT: LB went into ERROR')
-        LOG.error('LB wait for ACTIVE {} retries expired, Aborting.'.format(i))
-        raise Exception('LB did not go ACTIVE in {} tries, '
-                        'Aborting.'.format(i))
+            elif status in self.failures:
+                self._failed(status)
+        self._expired(i)
+
+    async def aexecute(self, token, lb_id):
+
+        start_time = timeit.default_timer()
+        if CONF.status_poller.coalesce:
+            status, i = await status_watcher.async_wait_for_status(
+                token, lb_id, self._aget_status, targets=(self.target,),
+                failures=self.failures,
+                max_polls=CONF.test_params.retries_check_active)
+            self._done(start_time, i)
+            return
+        for i in range(CONF.test_params.retries_check_active):
+            status = await self._aget_status(token, lb_id)
+            if status == self.target:
+                self._done(start_time, i)
+                return
+            elif status in self.failures:
+                self._failed(status)
+        self._expired(i)
+
+
+class WaitForDeleted(WaitForActive):
+    """Task to wait for a load balancer to be deleted."""
+
+    target = 'DELETED'
+    failures = ('ERROR',)
+
+    def __init__(self, resource_type='loadbalancer_delete', **kwargs):
+        super(WaitForDeleted, self).__init__(resource_type=resource_type,
+                                             **kwargs)
+
+
+class GetLoadBalancerStatus(BaseOctaviaTask):
+    """Task to get the provisioning status of a load balancer."""
+
+    def execute(self, token, lb_id):
+
+        r = self.get('v2.0/lbaas/loadbalancers/{0}'.format(lb_id),
+                     token=token)
+        return r.json()['loadbalancer']['provisioning_status']
+
+    async def aexecute(self, token, lb_id):
+
+        r = await self.aget('v2.0/lbaas/loadbalancers/{0}'.format(lb_id),
+                            token=token)
+        return r.json()['loadbalancer']['provisioning_status']
 
 
 class CreateListener(BaseOctaviaTask):
     """Task to create a listener."""
 
+    def _data(self, name, lb_id, port):
+        return ('{{"listener": {{"protocol": "HTTP", "protocol_port": {port},'
+                '"name": "{name}", "loadbalancer_id": "{lb_id}"}}}}'.format(
+                    name=name, lb_id=lb_id, port=port))
+
+    def _lookup(self, name, lb_id, port):
+        def match(listener):
+            return {'id': lb_id} in listener['loadbalancers']
+        return 'listeners', {'name': name, 'protocol_port': port}, match
+
+    def _result(self, r, name, lb_id):
+        return self._record(r.json()['listener']['id'], name, lb_id)
+
+    def _record(self, listener_id, name, lb_id):
+        manifest.record('listener', listener_id, lb_id, name)
+        return listener_id
+
     def execute(self, token, name, lb_id, port):
 
+        listener_id = self._find(token, *self._lookup(name, lb_id, port))
+        if listener_id:
+            return self._record(listener_id, name, lb_id)
         LOG.info('{0} - Creating listener: {1}'.format(self.name, name))
-        data=('{{"listener": {{"protocol": "HTTP", "protocol_port": {port},'
-              '"name": "{name}", "loadbalancer_id": "{lb_id}"}}}}'.format(
-            subnet=CONF.test_params.vip_subnet_id, name=name, lb_id=lb_id,
-            port=port))
+        r = self.post('v2.0/lbaas/listeners', token=token,
+                      data=self._data(name, lb_id, port))
+
+        return self._result(r, name, lb_id)
 
-        r = self.post('v2.0/lbaas/listeners', token=token, data=data)
+    async def aexecute(self, token, name, lb_id, port):
 
-        return r.json()['listener']['id']
+        LOG.info('{0} - Creating listener: {1}'.format(self.name, name))
+        r = await self.apost('v2.0/lbaas/listeners', token=token,
+                             data=self._data(name, lb_id, port))
+
+        return self._result(r, name, lb_id)
 
 
 class CreatePool(BaseOctaviaTask):
     """Task to create a pool."""
 
-#    def execute(self, token, name, lb_id):
+#    def _data(self, name, lb_id):
+    def _data(self, name, listener_id):
+#        return ('{{"pool": {{"loadbalancer_id": "{lb_id}",'
+        return ('{{"pool": {{"listener_id": "{listener_id}",'
+                '"lb_algorithm": "ROUND_ROBIN", "protocol": "HTTP",'
+                '"name": "{name}"}}}}'.format(
+#                    lb_id=lb_id, name=name))
+                    listener_id=listener_id, name=name))
+
+    def _lookup(self, name, listener_id):
+        def match(pool):
+            return {'id': listener_id} in pool['listeners']
+        return 'pools', {'name': name}, match
+
+    def _result(self, r, name, listener_id):
+        return self._record(r.json()['pool']['id'], name, listener_id)
+
+    def _record(self, pool_id, name, listener_id):
+        manifest.record('pool', pool_id, manifest.lb_for(listener_id), name)
+        return pool_id
+
     def execute(self, token, name, listener_id):
 
+        pool_id = self._find(token, *self._lookup(name, listener_id))
+        if pool_id:
+            return self._record(pool_id, name, listener_id)
         LOG.info('{0} - Creating pool: {1}'.format(self.name, name))
-#        data=('{{"pool": {{"loadbalancer_id": "{lb_id}",'
-        data=('{{"pool": {{"listener_id": "{listener_id}",'
-              '"lb_algorithm": "ROUND_ROBIN", "protocol": "HTTP",'
-              '"name": "{name}"}}}}'.format(
-#            lb_id=lb_id, name=name))
-            listener_id=listener_id, name=name))
+        r = self.post('v2.0/lbaas/pools', token=token,
+                      data=self._data(name, listener_id))
+
+        return self._result(r, name, listener_id)
 
-        r = self.post('v2.0/lbaas/pools', token=token, data=data)
+    async def aexecute(self, token, name, listener_id):
 
-        return r.json()['pool']['id']
+        LOG.info('{0} - Creating pool: {1}'.format(self.name, name))
+        r = await self.apost('v2.0/lbaas/pools', token=token,
+                             data=self._data(name, listener_id))
+
+        return self._result(r, name, listener_id)
 
 
 class CreateHealthMonitor(BaseOctaviaTask):
     """Task to create a health monitor."""
 
+    def _data(self, name, pool_id):
+        return ('{{"healthmonitor": {{"pool_id": "{pool}",'
+                '"delay": 5, "max_retries": 1, "timeout": 1, "type": "PING",'
+                '"name": "{name}"}}}}'.format(pool=pool_id, name=name))
+
+    def _lookup(self, name, pool_id):
+        def match(hm):
+            return {'id': pool_id} in hm['pools']
+        return 'healthmonitors', {'name': name}, match
+
+    def _result(self, r, name, pool_id):
+        return self._record(r.json()['healthmonitor']['id'], name, pool_id)
+
+    def _record(self, hm_id, name, pool_id):
+        manifest.record('healthmonitor', hm_id, manifest.lb_for(pool_id),
+                        name)
+        return hm_id
+
     def execute(self, token, name, pool_id):
 
+        hm_id = self._find(token, *self._lookup(name, pool_id))
+        if hm_id:
+            return self._record(hm_id, name, pool_id)
         LOG.info('{0} - Creating health monitor: {1}'.format(self.name, name))
-        data=('{{"healthmonitor": {{"pool_id": "{pool}",'
-              '"delay": 5, "max_retries": 1, "timeout": 1, "type": "PING",'
-              '"name": "{name}"}}}}'.format(
-            pool=pool_id, name=name))
+        r = self.post('v2.0/lbaas/healthmonitors', token=token,
+                      data=self._data(name, pool_id))
+
+        return self._result(r, name, pool_id)
 
-        r = self.post('v2.0/lbaas/healthmonitors', token=token, data=data)
+    async def aexecute(self, token, name, pool_id):
 
-        return r.json()['healthmonitor']['id']
+        LOG.info('{0} - Creating health monitor: {1}'.format(self.name, name))
+        r = await self.apost('v2.0/lbaas/healthmonitors', token=token,
+                             data=self._data(name, pool_id))
+
+        return self._result(r, name, pool_id)
 
 
 class CreateMember(BaseOctaviaTask):
     """Task to create a member."""
 
+    def _data(self, name, address, port):
+        return ('{{"member": {{"address": "{address}", '
+                '"protocol_port": {port}, "subnet_id": "{subnet}",'
+                '"name": "{name}"}}}}'.format(
+                    name=name, address=address, port=port,
+                    subnet=CONF.test_params.member_subnet_id))
+
+    def _lookup(self, name, pool_id, address, port):
+        def match(member):
+            return (member['address'], member['protocol_port']) == (address,
+                                                                    port)
+        return ('pools/{}/members'.format(pool_id), {'name': name}, match)
+
+    def _result(self, r, name, pool_id):
+        return self._record(r.json()['member']['id'], name, pool_id)
+
+    def _record(self, member_id, name, pool_id):
+        manifest.record('member', member_id, manifest.lb_for(pool_id), name)
+        return member_id
+
     def execute(self, token, name, pool_id, address, port):
 
+        member_id = self._find(token,
+                               *self._lookup(name, pool_id, address, port))
+        if member_id:
+            return self._record(member_id, name, pool_id)
         LOG.info('{0} - Creating member: {1}'.format(self.name, name))
-        data=('{{"member": {{"address": "{address}", "protocol_port": {port},'
-              '"subnet_id": "{subnet}",'
-              '"name": "{name}"}}}}'.format(
-                  pool=pool_id, name=name, address=address, port=port,
-                  subnet=CONF.test_params.member_subnet_id))
-
         r = self.post('v2.0/lbaas/pools/{}/members'.format(pool_id),
-                      token=token, data=data)
+                      token=token, data=self._data(name, address, port))
+
+        return self._result(r, name, pool_id)
+
+    async def aexecute(self, token, name, pool_id, address, port):
+
+        LOG.info('{0} - Creating member: {1}'.format(self.name, name))
+        r = await self.apost('v2.0/lbaas/pools/{}/members'.format(pool_id),
+                             token=token,
+                             data=self._data(name, address, port))
+
+        return self._result(r, name, pool_id)
+
+
+def member_address(address, i, unique=False):
+    """Returns the address of member i.
+
+    :param unique: Give member i the i-th address after address instead
+                   of address itself.
+    """
+    if not unique:
+        return address
+    return str(ipaddress.ip_address(address) + i)
+
+
+class BatchUpdateMembers(BaseOctaviaTask):
+    """Task to set the members of a pool with the batch update API.
+
+    The batch API replaces the whole member list, so the request always
+    carries members 0 to count - 1 and only the ones not created by an
+    earlier batch are new.
+
+    :param unique_addresses: See member_address.
+    """
+
+    def __init__(self, unique_addresses=False, **kwargs):
+        super(BatchUpdateMembers, self).__init__(**kwargs)
+        self.unique_addresses = unique_addresses
+
+    def _data(self, count, address):
+        members = ','.join(
+            '{{"address": "{address}", "protocol_port": {port}, '
+            '"subnet_id": "{subnet}", "name": "member{i}"}}'.format(
+                address=member_address(address, i, self.unique_addresses),
+                port=i + 1, i=i, subnet=CONF.test_params.member_subnet_id)
+            for i in range(count))
+        return '{{"members": [{}]}}'.format(members)
+
+    def execute(self, token, pool_id, count, address):
+
+        LOG.info('{0} - Setting {1} members on pool {2}'.format(
+            self.name, count, pool_id))
+        self.put('v2.0/lbaas/pools/{}/members'.format(pool_id),
+                 token=token, data=self._data(count, address))
+
+    async def aexecute(self, token, pool_id, count, address):
+
+        LOG.info('{0} - Setting {1} members on pool {2}'.format(
+            self.name, count, pool_id))
+        await self.aput('v2.0/lbaas/pools/{}/members'.format(pool_id),
+                        token=token, data=self._data(count, address))
+
+
+class CreateMembers(BaseOctaviaTask):
+    """Task to create the members of a pool one request at a time.
+
+    Does the same requests and waits as one CreateMember and WaitForActive
+    pair per member, but as a single atom, so very large trees stay cheap
+    to build.  Member i is named member<i> and uses port i + 1.
+
+    :param concurrency: Members created at the same time.
+    :param unique_addresses: See member_address.
+    """
+
+    def __init__(self, concurrency=1, unique_addresses=False, **kwargs):
+        super(CreateMembers, self).__init__(**kwargs)
+        self.concurrency = concurrency
+        self.unique_addresses = unique_addresses
+        self._create = CreateMember(name=self.name)
+        self._wait = WaitForActive(name=self.name, resource_type='member')
+        self._list = ListResources(name=self.name)
+
+    def _create_member(self, token, lb_id, pool_id, address, i):
+        self._create.execute(
+            token, 'member{}'.format(i), pool_id,
+            member_address(address, i, self.unique_addresses), i + 1)
+        self._wait.execute(token, lb_id)
+
+    async def _acreate_member(self, token, lb_id, pool_id, address, i):
+        await self._create.aexecute(
+            token, 'member{}'.format(i), pool_id,
+            member_address(address, i, self.unique_addresses), i + 1)
+        await self._wait.aexecute(token, lb_id)
+
+    def _missing(self, members, pool_id, count):
+        """Returns the indexes of the members not in the pool yet."""
+        names = set(member['name'] for member in members)
+        missing = [i for i in range(count)
+                   if 'member{}'.format(i) not in names]
+        for member in members:
+            manifest.record('member', member['id'], manifest.lb_for(pool_id),
+                            member['name'])
+        LOG.info('{0} - {1} members created before the run was '
+                 'interrupted'.format(self.name, count - len(missing)))
+        return missing
+
+    def execute(self, token, lb_id, pool_id, count, address):
+
+        indexes = range(count)
+        if self.reconcile:
+            self.reconcile = False
+            indexes = self._missing(
+                self._list.execute(
+                    token, 'pools/{}/members'.format(pool_id)),
+                pool_id, count)
+        LOG.info('{0} - Creating {1} members on pool {2}'.format(
+            self.name, len(indexes), pool_id))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._create_member, token, lb_id,
+                                       pool_id, address, i)
+                       for i in indexes]
+            for future in futures:
+                future.result()
+
+    async def aexecute(self, token, lb_id, pool_id, count, address):
+
+        LOG.info('{0} - Creating {1} members on pool {2}'.format(
+            self.name, count, pool_id))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def create(i):
+            async with semaphore:
+                await self._acreate_member(token, lb_id, pool_id, address, i)
+
+        await asyncio.gather(*[create(i) for i in range(count)])
+
+
+class CreateL7Policy(BaseOctaviaTask):
+    """Task to create an L7 policy.
+
+    REDIRECT_TO_POOL policies need redirect_pool_id, REDIRECT_TO_URL ones
+    redirect_url.
+    """
+
+    def _data(self, name, listener_id, action, redirect_pool_id,
+              redirect_url):
+        policy = {'listener_id': listener_id, 'action': action,
+                  'name': name}
+        if redirect_pool_id:
+            policy['redirect_pool_id'] = redirect_pool_id
+        if redirect_url:
+            policy['redirect_url'] = redirect_url
+        return json.dumps({'l7policy': policy})
+
+    def _lookup(self, name, listener_id):
+        def match(l7policy):
+            return l7policy['listener_id'] == listener_id
+        return 'l7policies', {'name': name, 'listener_id': listener_id}, match
+
+    def _result(self, r, name, listener_id):
+        return self._record(r.json()['l7policy']['id'], name, listener_id)
+
+    def _record(self, l7policy_id, name, listener_id):
+        manifest.record('l7policy', l7policy_id,
+                        manifest.lb_for(listener_id), name)
+        return l7policy_id
+
+    def execute(self, token, name, listener_id, action,
+                redirect_pool_id=None, redirect_url=None):
+
+        l7policy_id = self._find(token, *self._lookup(name, listener_id))
+        if l7policy_id:
+            return self._record(l7policy_id, name, listener_id)
+        LOG.info('{0} - Creating L7 policy: {1}'.format(self.name, name))
+        r = self.post('v2.0/lbaas/l7policies', token=token,
+                      data=self._data(name, listener_id, action,
+                                      redirect_pool_id, redirect_url))
+
+        return self._result(r, name, listener_id)
+
+    async def aexecute(self, token, name, listener_id, action,
+                       redirect_pool_id=None, redirect_url=None):
+
+        LOG.info('{0} - Creating L7 policy: {1}'.format(self.name, name))
+        r = await self.apost('v2.0/lbaas/l7policies', token=token,
+                             data=self._data(name, listener_id, action,
+                                             redirect_pool_id, redirect_url))
+
+        return self._result(r, name, listener_id)
+
+
+class CreateL7Rule(BaseOctaviaTask):
+    """Task to create a rule of an L7 policy."""
+
+    def _data(self, rule_type, compare_type, value):
+        return json.dumps({'rule': {'type': rule_type,
+                                    'compare_type': compare_type,
+                                    'value': value}})
+
+    def _lookup(self, l7policy_id, rule_type, compare_type, value):
+        def match(rule):
+            return (rule['type'], rule['compare_type']) == (rule_type,
+                                                            compare_type)
+        return ('l7policies/{}/rules'.format(l7policy_id), {'value': value},
+                match)
+
+    def _result(self, r, l7policy_id, value):
+        return self._record(r.json()['rule']['id'], l7policy_id, value)
+
+    def _record(self, l7rule_id, l7policy_id, value):
+        manifest.record('l7rule', l7rule_id, manifest.lb_for(l7policy_id),
+                        value)
+        return l7rule_id
+
+    def execute(self, token, l7policy_id, rule_type, compare_type, value):
+
+        l7rule_id = self._find(token, *self._lookup(l7policy_id, rule_type,
+                                                    compare_type, value))
+        if l7rule_id:
+            return self._record(l7rule_id, l7policy_id, value)
+        LOG.info('{0} - Creating L7 rule: {1}'.format(self.name, value))
+        r = self.post('v2.0/lbaas/l7policies/{}/rules'.format(l7policy_id),
+                      token=token,
+                      data=self._data(rule_type, compare_type, value))
+
+        return self._result(r, l7policy_id, value)
+
+    async def aexecute(self, token, l7policy_id, rule_type, compare_type,
+                       value):
+
+        LOG.info('{0} - Creating L7 rule: {1}'.format(self.name, value))
+        r = await self.apost(
+            'v2.0/lbaas/l7policies/{}/rules'.format(l7policy_id),
+            token=token, data=self._data(rule_type, compare_type, value))
+
+        return self._result(r, l7policy_id, value)
+
+
+class ListResources(BaseOctaviaTask):
+    """Task to list every resource in a collection, following pagination.
+
+    The collection is the path below v2.0/lbaas, for example
+    loadbalancers or pools/<pool_id>/members.
+    """
+
+    def _page(self, r, collection, params):
+        body = r.json()
+        key = collection.rsplit('/', 1)[-1]
+        marker = None
+        for link in body.get('{}_links'.format(key), []):
+            if link.get('rel') == 'next':
+                query = parse.parse_qs(parse.urlsplit(link['href']).query)
+                marker = query.get('marker', [None])[0]
+        if marker:
+            params['marker'] = marker
+        return body[key], marker
+
+    def execute(self, token, collection, params=None):
+
+        params = dict(params or {})
+        results = []
+        while True:
+            r = self.get('v2.0/lbaas/{}'.format(collection), token=token,
+                         params=params)
+            page, marker = self._page(r, collection, params)
+            results.extend(page)
+            if not marker:
+                return results
+
+    async def aexecute(self, token, collection, params=None):
+
+        params = dict(params or {})
+        results = []
+        while True:
+            r = await self.aget('v2.0/lbaas/{}'.format(collection),
+                                token=token, params=params)
+            page, marker = self._page(r, collection, params)
+            results.extend(page)
+            if not marker:
+                return results
+
+
+class ShowResource(BaseOctaviaTask):
+    """Task to show a single resource.
+
+    The collection is the path below v2.0/lbaas, for example listeners or
+    pools/<pool_id>/members.
+    """
+
+    def _key(self, collection):
+        key = collection.rsplit('/', 1)[-1]
+        if key.endswith('ies'):
+            return key[:-3] + 'y'
+        return key[:-1]
+
+    def execute(self, token, collection, resource_id, params=None):
+
+        r = self.get('v2.0/lbaas/{0}/{1}'.format(collection, resource_id),
+                     token=token, params=params)
+        return r.json()[self._key(collection)]
+
+    async def aexecute(self, token, collection, resource_id, params=None):
+
+        r = await self.aget('v2.0/lbaas/{0}/{1}'.format(collection,
+                                                         resource_id),
+                            token=token, params=params)
+        return r.json()[self._key(collection)]
+
+
+class UpdateResource(ShowResource):
+    """Task to update a single resource.
+
+    :param data: dict of the attributes to change.
+    """
+
+    def _data(self, collection, data):
+        return json.dumps({self._key(collection): data})
+
+    def execute(self, token, collection, resource_id, data):
+
+        LOG.info('{0} - Updating {1}/{2}'.format(self.name, collection,
+                                                 resource_id))
+        self.put('v2.0/lbaas/{0}/{1}'.format(collection, resource_id),
+                 token=token, data=self._data(collection, data))
+
+    async def aexecute(self, token, collection, resource_id, data):
+
+        LOG.info('{0} - Updating {1}/{2}'.format(self.name, collection,
+                                                 resource_id))
+        await self.aput('v2.0/lbaas/{0}/{1}'.format(collection, resource_id),
+                        token=token, data=self._data(collection, data))
+
+
+class DeleteLoadBalancer(BaseOctaviaTask):
+    """Task to delete a load balancer.
+
+    A load balancer that is already gone is not an error.
+    """
+
+    def _params(self, cascade):
+        return {'cascade': 'true'} if cascade else None
+
+    def execute(self, token, lb_id, cascade=False):
+
+        LOG.info('{0} - Deleting load balancer: {1}'.format(self.name, lb_id))
+        self.delete('v2.0/lbaas/loadbalancers/{}'.format(lb_id),
+                    token=token, params=self._params(cascade),
+                    accept=(404,))
+
+    async def aexecute(self, token, lb_id, cascade=False):
+
+        LOG.info('{0} - Deleting load balancer: {1}'.format(self.name, lb_id))
+        await self.adelete('v2.0/lbaas/loadbalancers/{}'.format(lb_id),
+                           token=token, params=self._params(cascade),
+                           accept=(404,))
+
+
+class DeleteListener(BaseOctaviaTask):
+    """Task to delete a listener."""
+
+    def execute(self, token, listener_id):
+
+        LOG.info('{0} - Deleting listener: {1}'.format(self.name,
+                                                       listener_id))
+        self.delete('v2.0/lbaas/listeners/{}'.format(listener_id),
+                    token=token, accept=(404,))
+
+    async def aexecute(self, token, listener_id):
+
+        LOG.info('{0} - Deleting listener: {1}'.format(self.name,
+                                                       listener_id))
+        await self.adelete('v2.0/lbaas/listeners/{}'.format(listener_id),
+                           token=token, accept=(404,))
+
+
+class DeletePool(BaseOctaviaTask):
+    """Task to delete a pool."""
+
+    def execute(self, token, pool_id):
+
+        LOG.info('{0} - Deleting pool: {1}'.format(self.name, pool_id))
+        self.delete('v2.0/lbaas/pools/{}'.format(pool_id), token=token,
+                    accept=(404,))
+
+    async def aexecute(self, token, pool_id):
+
+        LOG.info('{0} - Deleting pool: {1}'.format(self.name, pool_id))
+        await self.adelete('v2.0/lbaas/pools/{}'.format(pool_id),
+                           token=token, accept=(404,))
+
+
+class DeleteHealthMonitor(BaseOctaviaTask):
+    """Task to delete a health monitor."""
+
+    def execute(self, token, healthmonitor_id):
+
+        LOG.info('{0} - Deleting health monitor: {1}'.format(
+            self.name, healthmonitor_id))
+        self.delete('v2.0/lbaas/healthmonitors/{}'.format(healthmonitor_id),
+                    token=token, accept=(404,))
+
+    async def aexecute(self, token, healthmonitor_id):
+
+        LOG.info('{0} - Deleting health monitor: {1}'.format(
+            self.name, healthmonitor_id))
+        await self.adelete(
+            'v2.0/lbaas/healthmonitors/{}'.format(healthmonitor_id),
+            token=token, accept=(404,))
+
+
+class DeleteL7Policy(BaseOctaviaTask):
+    """Task to delete an L7 policy and its rules."""
+
+    def execute(self, token, l7policy_id):
+
+        LOG.info('{0} - Deleting L7 policy: {1}'.format(self.name,
+                                                        l7policy_id))
+        self.delete('v2.0/lbaas/l7policies/{}'.format(l7policy_id),
+                    token=token, accept=(404,))
+
+    async def aexecute(self, token, l7policy_id):
+
+        LOG.info('{0} - Deleting L7 policy: {1}'.format(self.name,
+                                                        l7policy_id))
+        await self.adelete('v2.0/lbaas/l7policies/{}'.format(l7policy_id),
+                           token=token, accept=(404,))
+
+
+class DeleteMember(BaseOctaviaTask):
+    """Task to delete a member."""
+
+    def execute(self, token, pool_id, member_id):
+
+        LOG.info('{0} - Deleting member: {1}'.format(self.name, member_id))
+        self.delete('v2.0/lbaas/pools/{0}/members/{1}'.format(pool_id,
+                                                              member_id),
+                    token=token, accept=(404,))
+
+    async def aexecute(self, token, pool_id, member_id):
+
+        LOG.info('{0} - Deleting member: {1}'.format(self.name, member_id))
+        await self.adelete(
+            'v2.0/lbaas/pools/{0}/members/{1}'.format(pool_id, member_id),
+            token=token, accept=(404,))
+
+
+class DeleteLoadBalancerChildren(BaseOctaviaTask):
+    """Task to delete the children of a load balancer one by one.
+
+    Reads the tree of the load balancer, then deletes the L7 policies and
+    members, then the health monitors, pools and listeners, waiting for
+    the load balancer to go ACTIVE after every delete.  Pools can't be
+    deleted while an L7 policy redirects to them.
+
+    :param concurrency: Resources read or deleted at the same time.
+    """
+
+    def __init__(self, concurrency=1, **kwargs):
+        super(DeleteLoadBalancerChildren, self).__init__(**kwargs)
+        self.concurrency = concurrency
+        self._show = ShowResource(name=self.name)
+        self._deletes = {
+            'l7policy': DeleteL7Policy(name=self.name),
+            'member': DeleteMember(name=self.name),
+            'healthmonitor': DeleteHealthMonitor(name=self.name),
+            'pool': DeletePool(name=self.name),
+            'listener': DeleteListener(name=self.name)}
+        self._waits = dict(
+            (kind, WaitForActive(name=self.name,
+                                 resource_type='{}_delete'.format(kind)))
+            for kind in self._deletes)
+
+    def _phases(self, lb_id, pools, listeners):
+        """Returns the (kind, IDs) to delete, in lists deleted in order."""
+        first, hms, pool_ids, listener_ids = [], [], [], []
+        for pool in pools:
+            for member in pool['members']:
+                first.append(('member', {'pool_id': pool['id'],
+                                         'member_id': member['id']}))
+            if pool.get('healthmonitor_id'):
+                hms.append(('healthmonitor',
+                            {'healthmonitor_id': pool['healthmonitor_id']}))
+            pool_ids.append(('pool', {'pool_id': pool['id']}))
+        for listener in listeners:
+            for policy in listener.get('l7policies', []):
+                first.append(('l7policy', {'l7policy_id': policy['id']}))
+            listener_ids.append(('listener',
+                                 {'listener_id': listener['id']}))
+        phases = [first, hms, pool_ids, listener_ids]
+        self._remember(lb_id, [list(ids.values())[-1]
+                               for phase in phases for kind, ids in phase])
+        LOG.info('{0} - Deleting {1} children of load balancer {2}'.format(
+            self.name, sum(len(phase) for phase in phases), lb_id))
+        return phases
+
+    def _remember(self, lb_id, resource_ids):
+        # So the lock contention of the reads and deletes is charged to
+        # the load balancer.
+        for resource_id in resource_ids:
+            manifest.remember(resource_id, lb_id)
+
+    def _delete_child(self, token, lb_id, kind, ids):
+        self._deletes[kind].execute(token, **ids)
+        self._waits[kind].execute(token, lb_id)
+
+    async def _adelete_child(self, token, lb_id, kind, ids):
+        await self._deletes[kind].aexecute(token, **ids)
+        await self._waits[kind].aexecute(token, lb_id)
+
+    def execute(self, token, lb_id):
+
+        lb = self._show.execute(token, 'loadbalancers', lb_id)
+        self._remember(lb_id, [child['id'] for child in
+                               lb['pools'] + lb['listeners']])
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.concurrency) as executor:
+            pools = list(executor.map(
+                lambda pool: self._show.execute(token, 'pools', pool['id']),
+                lb['pools']))
+            listeners = list(executor.map(
+                lambda listener: self._show.execute(token, 'listeners',
+                                                    listener['id']),
+                lb['listeners']))
+            for phase in self._phases(lb_id, pools, listeners):
+                list(executor.map(
+                    lambda child: self._delete_child(token, lb_id, *child),
+                    phase))
+
+    async def aexecute(self, token, lb_id):
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limit(coro):
+            async with semaphore:
+                return await coro
 
-        return r.json()['member']['id']
+        lb = await self._show.aexecute(token, 'loadbalancers', lb_id)
+        self._remember(lb_id, [child['id'] for child in
+                               lb['pools'] + lb['listeners']])
+        pools = await asyncio.gather(*[
+            limit(self._show.aexecute(token, 'pools', pool['id']))
+            for pool in lb['pools']])
+        listeners = await asyncio.gather(*[
+            limit(self._show.aexecute(token, 'listeners', listener['id']))
+            for listener in lb['listeners']])
+        for phase in self._phases(lb_id, pools, listeners):
+            await asyncio.gather(*[
+                limit(self._adelete_child(token, lb_id, *child))
+                for child in phase])
@@ -0,0 +1,98 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Open loop load generator.
+
+Operations are scheduled at a fixed target rate, independent of how fast
+the API answers.  Latency is measured from the time an operation was
+scheduled, not from when a worker got around to sending it, so queueing
+in the client and the API shows up in the numbers instead of being hidden
+by coordinated omission.  The corrected latencies are reported as
+scheduled_<operation> and the time operations waited for a worker as
+dispatch_lag, both in the workload latencies of the report.  The per
+request service times are reported as usual.
+"""
+
+import concurrent.futures
+import random
+import time
+import timeit
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import metrics
+import workload
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def _issue(name, operation, target, scheduled):
+    metrics.record_latency('dispatch_lag', timeit.default_timer() - scheduled)
+    status = 'ok'
+    try:
+        operation(target)
+    except Exception as e:
+        LOG.warning('Open loop {0} failed: {1}'.format(name, e))
+        status = type(e).__name__
+    metrics.record_latency('scheduled_' + name,
+                           timeit.default_timer() - scheduled, status)
+
+
+def run(target=None, rate=None, duration=None):
+    """Issues operations at a constant rate for a fixed duration.
+
+    :param target: workload.Target to use, prepared if not given.
+    :param rate: Operations per second, defaults to [open_loop] rate.
+    :param duration: Seconds to run, defaults to [open_loop] duration.
+    :returns: The number of operations issued.
+    """
+    if target is None:
+        target = workload.prepare_target()
+    rate = rate or CONF.open_loop.rate
+    duration = duration or CONF.open_loop.duration
+    mix = workload.OperationMix(CONF.workload.operations)
+    rng = random.Random(CONF.open_loop.seed)
+    target.rng.seed(rng.random())
+    poisson = CONF.open_loop.arrival == 'poisson'
+
+    LOG.info('Open loop: {0} operations/sec for {1} seconds with {2} '
+             'arrivals'.format(rate, duration, CONF.open_loop.arrival))
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=CONF.open_loop.max_outstanding)
+    start = timeit.default_timer()
+    scheduled = start
+    issued = 0
+    try:
+        while True:
+            if poisson:
+                scheduled += rng.expovariate(rate)
+            else:
+                scheduled += 1.0 / rate
+            if scheduled - start > duration:
+                break
+            delay = scheduled - timeit.default_timer()
+            if delay > 0:
+                time.sleep(delay)
+            name, operation = mix.choose(rng)
+            executor.submit(_issue, name, operation, target, scheduled)
+            issued += 1
+    finally:
+        executor.shutdown(wait=True)
+    elapsed = timeit.default_timer() - start
+    LOG.info('Open loop issued {0} operations in {1:.1f} seconds, {2:.1f} '
+             'operations/sec (target {3})'.format(issued, elapsed,
+                                                  issued / elapsed, rate))
+    return issued
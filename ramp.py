@@ -0,0 +1,215 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Step load profile that finds the saturation point of the API.
+
+The [workload] operations are run at increasing levels, either closed
+loop concurrency (threads issuing operations back to back) or an open
+loop target rate.  Every level is held for [ramp] hold seconds with its
+own metrics, giving throughput and latency percentiles per step.  The
+ramp stops after the first step whose p99 or error rate passes its
+threshold.  The knee is the highest level up to which throughput still
+grew near linearly with the level, that is the throughput per unit of
+load stayed within [ramp] linearity of the first step.
+"""
+
+import json
+import random
+import threading
+import timeit
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import metrics
+import open_loop
+import workload
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def levels(start, step, maximum):
+    """Returns the levels of the ramp, start to maximum in steps."""
+    result = []
+    level = start
+    while level <= maximum + 1e-9:
+        result.append(level)
+        level += step
+    return result
+
+
+def _worker(mix, target, deadline, rng):
+    while timeit.default_timer() < deadline:
+        name, operation = mix.choose(rng)
+        status = 'ok'
+        start = timeit.default_timer()
+        try:
+            operation(target)
+        except Exception as e:
+            LOG.warning('Ramp {0} failed: {1}'.format(name, e))
+            status = type(e).__name__
+        metrics.record_latency('ramp_' + name,
+                               timeit.default_timer() - start, status)
+
+
+def _run_concurrency(level, target, mix, seed):
+    deadline = timeit.default_timer() + CONF.ramp.hold
+    threads = []
+    for i in range(int(level)):
+        thread = threading.Thread(
+            target=_worker, name='ramp-{0}-{1}'.format(level, i),
+            args=(mix, target, deadline, random.Random(seed.random())))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+def summarize_step(level, registry, prefix):
+    """Returns throughput, latency and error rate of one step.
+
+    :param prefix: Prefix of the workload latencies of the operations,
+                   ramp_ or scheduled_.
+    """
+    latency = metrics.Histogram()
+    ok = failed = 0
+    for op, stats in registry.latencies.items():
+        if not op.startswith(prefix):
+            continue
+        latency.merge(stats.latency)
+        for status, count in stats.status_codes.items():
+            if status == 'ok':
+                ok += count
+            else:
+                failed += count
+    elapsed = registry.elapsed()
+    step = dict(latency.summary())
+    step.update({'level': level, 'elapsed_seconds': elapsed,
+                 'completed': ok, 'failed': failed,
+                 'throughput': ok / elapsed if elapsed else 0,
+                 'error_rate': (failed / float(ok + failed)
+                                if ok + failed else 0)})
+    return step
+
+
+def breached(step):
+    """Returns why a step passed a threshold, or None."""
+    if (CONF.ramp.max_p99_ms and
+            step['p99_ms'] > CONF.ramp.max_p99_ms):
+        return 'p99 {0:.1f} ms above {1} ms'.format(step['p99_ms'],
+                                                    CONF.ramp.max_p99_ms)
+    if step['error_rate'] > CONF.ramp.max_error_rate:
+        return 'error rate {0:.1%} above {1:.1%}'.format(
+            step['error_rate'], CONF.ramp.max_error_rate)
+    return None
+
+
+def find_knee(steps, linearity):
+    """Returns the highest level with near linear throughput, or None.
+
+    Every step is compared to the first one: its throughput divided by
+    its level must be at least linearity times that of the first step.
+    The knee is the last step of the unbroken run of such steps that did
+    not breach a threshold.
+    """
+    if not steps or not steps[0]['throughput']:
+        return None
+    base = steps[0]['throughput'] / steps[0]['level']
+    for step in steps:
+        step['efficiency'] = step['throughput'] / step['level'] / base
+    knee = None
+    for step in steps:
+        if step.get('breached') or step['efficiency'] < linearity:
+            break
+        knee = step['level']
+    return knee
+
+
+def format_steps(result):
+    lines = ['{0:>10} {1:>11} {2:>9} {3:>9} {4:>9} {5:>8} {6:>11}'.format(
+        result['kind'], 'ops/s', 'p50 ms', 'p99 ms', 'errors %', 'linear',
+        'completed')]
+    lines.append('-' * len(lines[0]))
+    for step in result['steps']:
+        lines.append(
+            '{0:>10g} {1:>11.1f} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>8.2f} '
+            '{6:>11}'.format(step['level'], step['throughput'],
+                             step['p50_ms'], step['p99_ms'],
+                             step['error_rate'] * 100,
+                             step.get('efficiency', 0), step['completed']))
+    if result['stopped_by']:
+        lines.append('Stopped at {0:g}: {1}'.format(
+            result['steps'][-1]['level'], result['stopped_by']))
+    if result['knee'] is None:
+        lines.append('No knee found, the first step did not complete any '
+                     'operations or already breached a threshold.')
+    else:
+        lines.append('Knee: {0} {1:g}'.format(result['kind'],
+                                              result['knee']))
+    return '\n'.join(lines)
+
+
+def run(target=None):
+    """Runs the ramp and reports the steps and the knee.
+
+    :param target: workload.Target to use, prepared if not given.
+    :returns: metrics.Registry with the metrics of all steps merged.
+    """
+    if target is None:
+        target = workload.prepare_target()
+    kind = CONF.ramp.kind
+    steps_levels = levels(CONF.ramp.start, CONF.ramp.step,
+                          CONF.ramp.maximum)
+    if kind == 'concurrency':
+        steps_levels = [int(level) for level in steps_levels
+                        if int(level) >= 1]
+    if not steps_levels:
+        raise Exception('The ramp has no levels.')
+    mix = workload.OperationMix(CONF.workload.operations)
+    seed = random.Random(CONF.ramp.seed)
+    target.rng.seed(seed.random())
+    prefix = 'ramp_' if kind == 'concurrency' else 'scheduled_'
+
+    total = metrics.reset()
+    steps = []
+    stopped_by = None
+    for level in steps_levels:
+        LOG.info('Ramp step: {0} {1:g} for {2} seconds'.format(
+            kind, level, CONF.ramp.hold))
+        if kind == 'concurrency':
+            _run_concurrency(level, target, mix, seed)
+        else:
+            open_loop.run(target, rate=level, duration=CONF.ramp.hold)
+        registry = metrics.reset()
+        total.merge(registry)
+        step = summarize_step(level, registry, prefix)
+        stopped_by = breached(step)
+        step['breached'] = stopped_by
+        steps.append(step)
+        if stopped_by:
+            LOG.info('Stopping the ramp at {0:g}: {1}'.format(level,
+                                                              stopped_by))
+            break
+
+    result = {'kind': kind, 'hold_seconds': CONF.ramp.hold,
+              'knee': find_knee(steps, CONF.ramp.linearity),
+              'stopped_by': stopped_by, 'steps': steps}
+    print(format_steps(result))
+    if CONF.ramp.report_file:
+        with open(CONF.ramp.report_file, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        LOG.info('Wrote the ramp report to {}'.format(CONF.ramp.report_file))
+    return total
@@ -0,0 +1,381 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Store of run results with baseline comparison.
+
+Every run saves its [test_params] and [task_flow] settings, its metrics
+report and whether it completed as one JSON file in [results] store_dir.
+Runs that failed or were interrupted are left out of latest and labels,
+a baseline or run ID still selects them.  Runs tagged with
+the same [results] label are repeats of one configuration, and a named
+baseline is a saved list of runs.  Run this module to list the runs,
+name baselines and compare two runs, labels or baselines::
+
+    python results_store.py --config-file stressoctaviaapi.conf list
+    python results_store.py --config-file stressoctaviaapi.conf \\
+        baseline last-week 20171101-120000-1a2b3c 20171101-130000-4d5e6f
+    python results_store.py --config-file stressoctaviaapi.conf \\
+        compare last-week latest
+
+compare prints the latency percentile, throughput and conflict rate
+change per operation.  With at least two runs on both sides a Welch
+t-test tells whether the change is significant.  It exits with 1 when a
+change passes a [results] threshold, and with several runs on both sides
+only when the change is also significant.
+"""
+
+import json
+import math
+import os
+import sys
+import time
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+BASELINES = 'baselines.json'
+CONFIG_GROUPS = ('test_params', 'task_flow')
+LATENCIES = ('p50_ms', 'p90_ms', 'p99_ms')
+
+
+def _store_dir():
+    return os.path.expanduser(CONF.results.store_dir)
+
+
+def _config():
+    config = {}
+    for group in CONFIG_GROUPS:
+        config[group] = dict((name, CONF[group][name])
+                             for name in CONF[group])
+    return config
+
+
+def save(report, contention=None, status='completed'):
+    """Saves the report of a finished run.
+
+    :param report: metrics.Registry report of the run.
+    :param contention: contention.report of the run.
+    :param status: completed, failed or interrupted.
+    :returns: The ID of the saved run, None when the store is disabled.
+    """
+    if not CONF.results.store_dir:
+        return None
+    now = time.gmtime()
+    run_id = '{0}-{1}'.format(time.strftime('%Y%m%d-%H%M%S', now),
+                              uuid.uuid4().hex[:6])
+    run = {'id': run_id, 'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', now),
+           'label': CONF.results.label, 'config': _config(),
+           'status': status,
+           'errors': sum(report.get('errors', {}).values()),
+           'report': report}
+    if contention:
+        run['contention'] = dict(
+            (k, v) for k, v in contention.items() if k != 'load_balancers')
+    os.makedirs(_store_dir(), exist_ok=True)
+    path = os.path.join(_store_dir(), run_id + '.json')
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True, default=str)
+    LOG.info('Saved the results of {0} run {1} to {2}'.format(status, run_id,
+                                                              path))
+    return run_id
+
+
+def runs():
+    """Returns all stored runs, oldest first."""
+    result = []
+    if not os.path.isdir(_store_dir()):
+        return result
+    for name in sorted(os.listdir(_store_dir())):
+        if name.endswith('.json') and name != BASELINES:
+            with open(os.path.join(_store_dir(), name)) as f:
+                result.append(json.load(f))
+    return result
+
+
+def baselines():
+    path = os.path.join(_store_dir(), BASELINES)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def set_baseline(name, run_ids):
+    """Names a list of runs as a baseline."""
+    known = set(r['id'] for r in runs())
+    for run_id in run_ids:
+        if run_id not in known:
+            raise Exception('Unknown run {}'.format(run_id))
+    saved = baselines()
+    saved[name] = list(run_ids)
+    os.makedirs(_store_dir(), exist_ok=True)
+    with open(os.path.join(_store_dir(), BASELINES), 'w') as f:
+        json.dump(saved, f, indent=2, sort_keys=True)
+
+
+def completed(run):
+    """Returns whether a run completed."""
+    # Runs saved before the status was stored did.
+    return run.get('status', 'completed') == 'completed'
+
+
+def select(selector):
+    """Returns the runs a baseline name, label or run ID stands for.
+
+    latest is the newest completed run and a label the completed runs
+    tagged with it.  Run IDs may be shortened to a unique prefix.
+    """
+    all_runs = runs()
+    if not all_runs:
+        raise Exception('No runs stored in {}'.format(_store_dir()))
+    if selector == 'latest':
+        latest = [r for r in all_runs if completed(r)][-1:]
+        if not latest:
+            raise Exception('No completed runs stored in {}'.format(
+                _store_dir()))
+        return latest
+    named = baselines().get(selector)
+    if named is not None:
+        return [r for r in all_runs if r['id'] in named]
+    labeled = [r for r in all_runs if r.get('label') == selector]
+    if labeled:
+        if not any(completed(r) for r in labeled):
+            raise Exception('No run labeled {} completed'.format(selector))
+        return [r for r in labeled if completed(r)]
+    matches = [r for r in all_runs if r['id'].startswith(selector)]
+    if len(matches) == 1:
+        return matches
+    if matches:
+        raise Exception('{} matches several runs'.format(selector))
+    raise Exception('No baseline, label or run {}'.format(selector))
+
+
+def _betacf(a, b, x):
+    # Continued fraction for the incomplete beta function, see Numerical
+    # Recipes 6.4.
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+    h = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+        c = 1.0 + aa / c
+        c = c if abs(c) > 1e-30 else 1e-30
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+        c = 1.0 + aa / c
+        c = c if abs(c) > 1e-30 else 1e-30
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-10:
+            break
+    return h
+
+
+def _betai(a, b, x):
+    """Regularized incomplete beta function I_x(a, b)."""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def welch_t_test(old, new):
+    """Two sided Welch t-test.
+
+    :returns: The p-value, or None with fewer than two values a side.
+    """
+    if len(old) < 2 or len(new) < 2:
+        return None
+    m1, m2 = sum(old) / len(old), sum(new) / len(new)
+    v1 = sum((x - m1) ** 2 for x in old) / (len(old) - 1)
+    v2 = sum((x - m2) ** 2 for x in new) / (len(new) - 1)
+    se1, se2 = v1 / len(old), v2 / len(new)
+    if se1 + se2 == 0:
+        return 1.0 if m1 == m2 else 0.0
+    t = (m2 - m1) / math.sqrt(se1 + se2)
+    df = (se1 + se2) ** 2 / (se1 ** 2 / (len(old) - 1) +
+                             se2 ** 2 / (len(new) - 1))
+    return _betai(df / 2.0, 0.5, df / (df + t * t))
+
+
+def _conflict_rate(summary):
+    count = sum(summary['status_codes'].values())
+    return summary['status_codes'].get('409', 0) / float(count or 1)
+
+
+def _metrics(run):
+    """Returns {(operation, metric): value} for one run.
+
+    The operation is None for the totals of the run.
+    """
+    report = run['report']
+    values = {(None, 'requests_per_second'): report['requests_per_second']}
+    requests = conflicts = 0
+    for op, summary in report['operations'].items():
+        if summary['count'] < CONF.results.min_requests:
+            continue
+        for latency in LATENCIES:
+            values[(op, latency)] = summary[latency]
+        values[(op, 'requests_per_second')] = summary['requests_per_second']
+        values[(op, 'conflict_rate')] = _conflict_rate(summary)
+        requests += sum(summary['status_codes'].values())
+        conflicts += summary['status_codes'].get('409', 0)
+    values[(None, 'conflict_rate')] = conflicts / float(requests or 1)
+    for name, summary in report.get('latencies', {}).items():
+        if summary['count'] < CONF.results.min_requests:
+            continue
+        for latency in LATENCIES:
+            values[(name, latency)] = summary[latency]
+    return values
+
+
+def _regressed(metric, old, new):
+    """Returns whether a change of the mean passes its threshold."""
+    if metric in LATENCIES:
+        return (CONF.results.max_latency_increase and old and
+                new > old * (1 + CONF.results.max_latency_increase))
+    if metric == 'requests_per_second':
+        return (CONF.results.max_throughput_drop and old and
+                new < old * (1 - CONF.results.max_throughput_drop))
+    return (CONF.results.max_conflict_rate_increase and
+            new - old > CONF.results.max_conflict_rate_increase)
+
+
+def compare(old_runs, new_runs):
+    """Compares two groups of runs.
+
+    :returns: list of row dicts with operation, metric, old and new means,
+              relative change, p-value and whether it is a regression.
+    """
+    old_values = [_metrics(r) for r in old_runs]
+    new_values = [_metrics(r) for r in new_runs]
+    keys = set(old_values[0]).intersection(*(old_values[1:] + new_values))
+    rows = []
+    for op, metric in sorted(keys, key=lambda k: (k[0] or '', k[1])):
+        old = [v[(op, metric)] for v in old_values]
+        new = [v[(op, metric)] for v in new_values]
+        old_mean, new_mean = sum(old) / len(old), sum(new) / len(new)
+        p_value = welch_t_test(old, new)
+        significant = p_value is None or p_value < CONF.results.alpha
+        rows.append({
+            'operation': op or 'all', 'metric': metric,
+            'old': old_mean, 'new': new_mean,
+            'change': (new_mean - old_mean) / old_mean if old_mean else None,
+            'p_value': p_value,
+            'regression': bool(significant and
+                               _regressed(metric, old_mean, new_mean))})
+    return rows
+
+
+def format_comparison(rows):
+    lines = ['{0:<28} {1:<20} {2:>11} {3:>11} {4:>8} {5:>8}'.format(
+        'operation', 'metric', 'old', 'new', 'change', 'p')]
+    lines.append('-' * len(lines[0]))
+    for row in rows:
+        lines.append('{0:<28} {1:<20} {2:>11.4g} {3:>11.4g} {4:>8} {5:>8} '
+                     '{6}'.format(
+                         row['operation'], row['metric'], row['old'],
+                         row['new'],
+                         '' if row['change'] is None else
+                         '{:+.1%}'.format(row['change']),
+                         '' if row['p_value'] is None else
+                         '{:.3f}'.format(row['p_value']),
+                         'REGRESSION' if row['regression'] else ''))
+    return '\n'.join(lines)
+
+
+def _list():
+    for run in runs():
+        report = run['report']
+        print('{0}  {1:<16} {2:<24} {3:>8} requests {4:>8.1f} req/s '
+              '{5}'.format(
+                  run['id'], run.get('label') or '',
+                  run['config']['test_params'].get('test_flow') or '',
+                  report['total_requests'], report['requests_per_second'],
+                  '' if completed(run) else run['status']).rstrip())
+    for name, run_ids in sorted(baselines().items()):
+        print('baseline {0}: {1}'.format(name, ' '.join(run_ids)))
+
+
+def _show():
+    for run in select(CONF.command.run):
+        print(json.dumps(run, indent=2, sort_keys=True))
+
+
+def _baseline():
+    run_ids = [r['id'] for selector in CONF.command.runs
+               for r in select(selector)]
+    set_baseline(CONF.command.baseline, run_ids)
+    print('baseline {0}: {1}'.format(CONF.command.baseline,
+                                     ' '.join(run_ids)))
+
+
+def _compare():
+    old_runs = select(CONF.command.old)
+    new_runs = select(CONF.command.new)
+    LOG.info('Comparing {0} runs of {1} with {2} runs of {3}'.format(
+        len(old_runs), CONF.command.old, len(new_runs), CONF.command.new))
+    rows = compare(old_runs, new_runs)
+    print(format_comparison(rows))
+    if any(row['regression'] for row in rows):
+        sys.exit(1)
+
+
+def add_command_parsers(subparsers):
+    subparsers.add_parser('list', help='List the stored runs and '
+                                       'baselines.').set_defaults(func=_list)
+    parser = subparsers.add_parser('show', help='Print stored runs.')
+    parser.add_argument('run')
+    parser.set_defaults(func=_show)
+    parser = subparsers.add_parser('baseline',
+                                   help='Name a list of runs as a baseline.')
+    # CONF.command.name is the name of the sub-command itself.
+    parser.add_argument('baseline', metavar='name')
+    parser.add_argument('runs', nargs='+')
+    parser.set_defaults(func=_baseline)
+    parser = subparsers.add_parser('compare', help='Compare new runs with '
+                                                   'old ones.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.set_defaults(func=_compare)
+
+
+def main():
+    import stressoctaviaapi  # noqa: F401 registers the [results] options
+
+    CONF.register_cli_opt(cfg.SubCommandOpt('command',
+                                            handler=add_command_parsers))
+    logging.register_options(CONF)
+    CONF(args=sys.argv[1:], project='stressoctaviaapi')
+    logging.setup(CONF, 'results_store')
+    CONF.command.func()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import email.utils
+import random
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+class RetryPolicy(object):
+    """Base retry policy, retries immediately."""
+
+    def __init__(self, base_delay=0, max_delay=0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, attempt, previous_delay):
+        """Returns the seconds to sleep before the given retry attempt.
+
+        :param attempt: The retry number, starting at 1.
+        :param previous_delay: The delay used before the previous attempt.
+        """
+        return 0
+
+
+class FixedDelayPolicy(RetryPolicy):
+    """Sleeps base_delay seconds between every retry."""
+
+    def next_delay(self, attempt, previous_delay):
+        return self.base_delay
+
+
+class ExponentialJitterPolicy(RetryPolicy):
+    """Exponential backoff with "full jitter".
+
+    Sleeps a random time between zero and base_delay * 2^attempt, capped at
+    max_delay.
+    """
+
+    # Past this the ceiling is max_delay anyway, and a larger exponent
+    # overflows the float multiplication.
+    MAX_EXPONENT = 62
+
+    def next_delay(self, attempt, previous_delay):
+        exponent = min(attempt, self.MAX_EXPONENT)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** exponent))
+        return random.uniform(0, ceiling)
+
+
+class DecorrelatedJitterPolicy(RetryPolicy):
+    """Exponential backoff with "decorrelated jitter".
+
+    Sleeps a random time between base_delay and three times the previous
+    delay, capped at max_delay.
+    """
+
+    def next_delay(self, attempt, previous_delay):
+        upper = max(self.base_delay, previous_delay * 3)
+        return min(self.max_delay, random.uniform(self.base_delay, upper))
+
+
+POLICIES = {
+    'immediate': RetryPolicy,
+    'fixed': FixedDelayPolicy,
+    'exponential': ExponentialJitterPolicy,
+    'decorrelated': DecorrelatedJitterPolicy,
+}
+
+
+class RetryBudget(object):
+    """Counts retries across the whole run."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self):
+        """Takes one retry from the budget.
+
+        :returns: False if the budget is exhausted.
+        """
+        with self._lock:
+            if self.limit and self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+class RetryState(object):
+    """Tracks the retries of a single request."""
+
+    def __init__(self, policy, budget):
+        self.policy = policy
+        self.budget = budget
+        self.attempt = 0
+        self.delay = 0
+        # Load balancer this request is waiting on after a 409, see
+        # contention.observe.
+        self.queued_on = None
+
+    def next_delay(self, headers=None):
+        """Accounts for a retry and returns how long to sleep before it.
+
+        :param headers: Response headers of the failed attempt, checked for
+                        Retry-After when [retry] honor_retry_after is set.
+        :raises Exception: If a retry budget is exhausted.
+        """
+        self.attempt += 1
+        if (CONF.retry.max_retries_per_request and
+                self.attempt > CONF.retry.max_retries_per_request):
+            raise Exception('Retry budget of {0} retries for the request '
+                            'exhausted.'.format(
+                                CONF.retry.max_retries_per_request))
+        if not self.budget.consume():
+            raise Exception('Global retry budget of {0} retries '
+                            'exhausted.'.format(self.budget.limit))
+        delay = None
+        if CONF.retry.honor_retry_after and headers:
+            delay = parse_retry_after(headers.get('Retry-After'))
+        if delay is None:
+            delay = self.policy.next_delay(self.attempt, self.delay)
+        self.delay = delay
+        return delay
+
+
+def parse_retry_after(value):
+    """Converts a Retry-After header value to seconds.
+
+    :returns: Seconds to wait or None if the value can't be used.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(when.timestamp() - time.time(), 0)
+
+
+def _get_policy():
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                policy_cls = POLICIES[CONF.retry.policy]
+                _policy = (policy_cls(base_delay=CONF.retry.base_delay,
+                                      max_delay=CONF.retry.max_delay),
+                           RetryBudget(CONF.retry.global_retry_budget))
+    return _policy
+
+
+def start():
+    """Returns the retry state for a new request."""
+    policy, budget = _get_policy()
+    return RetryState(policy, budget)
+
+
+def retries_used():
+    """Returns the number of retries taken from the global budget."""
+    return _get_policy()[1].used
@@ -0,0 +1,85 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import concurrent.futures
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from taskflow import engines as tf_engines
+from taskflow.listeners import logging as tf_logging
+
+import async_engine
+import checkpoint
+import http_pool
+import test_flows
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+def build_flow(name=None):
+    """Builds the test flow named by [test_params] test_flow."""
+    test_flows_cls = test_flows.TestFlows()
+    return getattr(test_flows_cls, name or CONF.test_params.test_flow)()
+
+
+def load_engine(flow, store=None):
+    """Loads, compiles and prepares the TaskFlow engine for a flow.
+
+    :returns: The engine, or None if a checkpointed run already finished.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=CONF.task_flow.max_workers)
+
+    if CONF.task_flow.persistence:
+        return checkpoint.load(
+            flow,
+            store=store,
+            engine=CONF.task_flow.engine,
+            executor=executor,
+            never_resolve=CONF.task_flow.disable_revert)
+    eng = tf_engines.load(
+            flow,
+            store=store,
+            engine=CONF.task_flow.engine,
+            executor=executor,
+            never_resolve=CONF.task_flow.disable_revert)
+    eng.compile()
+    eng.prepare()
+    return eng
+
+
+def run_flow(flow, store=None, eng=None):
+    """Runs a flow with the engine selected by [task_flow] engine.
+
+    :param eng: Engine from load_engine, loaded here if not given.
+    """
+    try:
+        if CONF.task_flow.engine == 'asyncio':
+            if CONF.task_flow.persistence:
+                raise Exception('[task_flow] persistence needs a TaskFlow '
+                                'engine, it does not work with asyncio.')
+            async_engine.run(flow, store=store)
+        else:
+            if eng is None:
+                eng = load_engine(flow, store=store)
+                if eng is None:
+                    return
+
+            with tf_logging.DynamicLoggingListener(eng, log=LOG):
+
+                    eng.run()
+    finally:
+        http_pool.log_connection_stats()
+        http_pool.close()
@@ -0,0 +1,271 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import asyncio
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+_async_watchers = {}
+
+
+class StatusWatcher(object):
+    """Polls the status of one load balancer on behalf of many waiters.
+
+    A single thread issues the status GETs for a load balancer and every
+    task waiting on that load balancer is woken by its observations.  A
+    waiter only accepts observations from GETs that were sent after it
+    subscribed, so it never sees a status that predates its own change.
+    """
+
+    def __init__(self, lb_id, fetch):
+        self.lb_id = lb_id
+        self._fetch = fetch
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        # Protected by _watchers_lock
+        self._waiters = 0
+        self._running = False
+        # Protected by _cond
+        self._token = None
+        self._sent = 0
+        self._observed = 0
+        self._status = None
+        self._error = None
+        self._interval = CONF.status_poller.poll_interval
+        self._next_poll = 0
+
+    def _subscribe(self, token):
+        with self._cond:
+            self._token = token
+            # New work on the LB, poll soon rather than at the backed off
+            # interval.
+            self._interval = CONF.status_poller.poll_interval
+            soon = time.time() + self._interval
+            if self._next_poll > soon:
+                self._next_poll = soon
+                self._wake.set()
+            return self._sent
+
+    def _run(self):
+        last_status = None
+        while True:
+            with _watchers_lock:
+                if self._waiters == 0:
+                    self._running = False
+                    _watchers.pop(self.lb_id, None)
+                    return
+            with self._cond:
+                self._sent += 1
+                generation = self._sent
+                token = self._token
+            status = None
+            error = None
+            try:
+                status = self._fetch(token, self.lb_id)
+            except Exception as e:
+                error = e
+            with self._cond:
+                self._status = status
+                self._error = error
+                self._observed = generation
+                self._cond.notify_all()
+                if status == last_status:
+                    self._interval = min(
+                        self._interval * CONF.status_poller.backoff_factor,
+                        CONF.status_poller.max_poll_interval)
+                else:
+                    self._interval = CONF.status_poller.poll_interval
+                last_status = status
+                self._next_poll = time.time() + self._interval
+            while True:
+                delay = self._next_poll - time.time()
+                if delay <= 0:
+                    break
+                self._wake.wait(delay)
+                self._wake.clear()
+
+    def _wait(self, token, targets, failures, max_polls):
+        seen = self._subscribe(token)
+        polls = 0
+        with self._cond:
+            while True:
+                while self._observed <= seen:
+                    self._cond.wait()
+                seen = self._observed
+                polls += 1
+                if self._error is not None:
+                    raise self._error
+                if self._status in targets:
+                    return self._status, polls
+                if self._status in failures:
+                    raise Exception('ABORT: LB {0} went into {1}'.format(
+                        self.lb_id, self._status))
+                if max_polls is not None and polls >= max_polls:
+                    raise Exception('LB {0} did not reach {1} in {2} '
+                                    'polls, Aborting.'.format(
+                                        self.lb_id, '/'.join(targets),
+                                        polls))
+
+
+def wait_for_status(token, lb_id, fetch, targets, failures=('ERROR',),
+                    max_polls=None):
+    """Blocks until a load balancer reaches one of the target statuses.
+
+    All callers waiting on the same load balancer share one poller.
+
+    :param token: Token to use for the status GETs.
+    :param lb_id: The load balancer to wait on.
+    :param fetch: Callable taking (token, lb_id) and returning the
+                  provisioning status.
+    :param targets: Statuses that end the wait.
+    :param failures: Statuses that abort the wait.
+    :param max_polls: Maximum number of observations to wait for.
+    :returns: (status, number of observations waited for)
+    """
+    with _watchers_lock:
+        watcher = _watchers.get(lb_id)
+        if watcher is None:
+            watcher = StatusWatcher(lb_id, fetch)
+            _watchers[lb_id] = watcher
+        watcher._waiters += 1
+        if not watcher._running:
+            watcher._running = True
+            thread = threading.Thread(
+                target=watcher._run,
+                name='status-watcher-{}'.format(lb_id))
+            thread.daemon = True
+            thread.start()
+    try:
+        return watcher._wait(token, targets, failures, max_polls)
+    finally:
+        with _watchers_lock:
+            watcher._waiters -= 1
+
+
+class AsyncStatusWatcher(object):
+    """StatusWatcher for the asyncio engine.
+
+    Runs as a task on the event loop instead of a thread, the fetch
+    callable is a coroutine function.
+    """
+
+    def __init__(self, lb_id, fetch):
+        self.lb_id = lb_id
+        self._fetch = fetch
+        self._cond = asyncio.Condition()
+        self._wake = asyncio.Event()
+        self._waiters = 0
+        self._token = None
+        self._sent = 0
+        self._observed = 0
+        self._status = None
+        self._error = None
+        self._interval = CONF.status_poller.poll_interval
+        self._next_poll = 0
+        self._task = None
+
+    def _subscribe(self, token):
+        self._token = token
+        self._interval = CONF.status_poller.poll_interval
+        soon = time.time() + self._interval
+        if self._next_poll > soon:
+            self._next_poll = soon
+            self._wake.set()
+        return self._sent
+
+    async def _run(self):
+        last_status = None
+        while self._waiters:
+            self._sent += 1
+            generation = self._sent
+            status = None
+            error = None
+            try:
+                status = await self._fetch(self._token, self.lb_id)
+            except Exception as e:
+                error = e
+            async with self._cond:
+                self._status = status
+                self._error = error
+                self._observed = generation
+                self._cond.notify_all()
+            if status == last_status:
+                self._interval = min(
+                    self._interval * CONF.status_poller.backoff_factor,
+                    CONF.status_poller.max_poll_interval)
+            else:
+                self._interval = CONF.status_poller.poll_interval
+            last_status = status
+            self._next_poll = time.time() + self._interval
+            while True:
+                delay = self._next_poll - time.time()
+                if delay <= 0 or not self._waiters:
+                    break
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        if _async_watchers.get(self.lb_id) is self:
+            del _async_watchers[self.lb_id]
+
+    async def _wait(self, token, targets, failures, max_polls):
+        seen = self._subscribe(token)
+        polls = 0
+        async with self._cond:
+            while True:
+                await self._cond.wait_for(lambda: self._observed > seen)
+                seen = self._observed
+                polls += 1
+                if self._error is not None:
+                    raise self._error
+                if self._status in targets:
+                    return self._status, polls
+                if self._status in failures:
+                    raise Exception('ABORT: LB {0} went into {1}'.format(
+                        self.lb_id, self._status))
+                if max_polls is not None and polls >= max_polls:
+                    raise Exception('LB {0} did not reach {1} in {2} '
+                                    'polls, Aborting.'.format(
+                                        self.lb_id, '/'.join(targets),
+                                        polls))
+
+
+async def async_wait_for_status(token, lb_id, fetch, targets,
+                                failures=('ERROR',), max_polls=None):
+    """Coroutine version of wait_for_status for the asyncio engine.
+
+    :param fetch: Coroutine function taking (token, lb_id) and returning
+                  the provisioning status.
+    """
+    watcher = _async_watchers.get(lb_id)
+    if watcher is None:
+        watcher = _async_watchers[lb_id] = AsyncStatusWatcher(lb_id, fetch)
+    watcher._waiters += 1
+    if watcher._task is None or watcher._task.done():
+        watcher._task = asyncio.ensure_future(watcher._run())
+    try:
+        return await watcher._wait(token, targets, failures, max_polls)
+    finally:
+        watcher._waiters -= 1
+        if not watcher._waiters:
+            watcher._wake.set()
@@ -14,14 +14,20 @@
 
 import sys
 
-import concurrent.futures
-
 from oslo_config import cfg
 from oslo_log import log as logging
-from taskflow import engines as tf_engines
-from taskflow.listeners import logging as tf_logging
 
-import test_flows
+import churn
+import contention
+import coordinator
+import event_log
+import manifest
+import metrics
+import mixed
+import open_loop
+import ramp
+import results_store
+import runner
 
 CONF = cfg.CONF
 
@@ -39,10 +45,26 @@ keystone_opts = [
 ]
 cfg.CONF.register_opts(keystone_opts, group='keystone_authtoken')
 
+token_cache_opts = [
+    cfg.StrOpt('cache_file',
+               help='File to cache tokens in between runs. Runs reuse a '
+                    'cached token for the same credentials, project and '
+                    'auth_url instead of asking Keystone.'),
+    cfg.IntOpt('refresh_margin', default=300, min=0,
+               help='Seconds before a token expires to get a new one in '
+                    'the background. Zero disables refreshing.'),
+    cfg.ListOpt('projects', default=[],
+                help='Projects, in project_domain_name, to create the load '
+                     'balancers in round-robin. Defaults to '
+                     '[keystone_authtoken] project_name.'),
+]
+cfg.CONF.register_opts(token_cache_opts, group='token_cache')
+
 task_flow_opts = [
     cfg.StrOpt('engine',
                default='serial',
-               help='TaskFlow engine to use'),
+               help='TaskFlow engine to use, or asyncio to run the flow on '
+                    'a single event loop with non-blocking HTTP'),
     cfg.IntOpt('max_workers',
                default=5,
                help='The maximum number of workers'),
@@ -50,13 +72,29 @@ task_flow_opts = [
                 help='If True, disables the controller worker taskflow '
                      'flows from reverting.  This will leave resources in '
                      'an inconsistent state and should only be used for '
-                     'debugging purposes.')
+                     'debugging purposes.'),
+    cfg.StrOpt('persistence',
+               help='Directory, or TaskFlow persistence URL like '
+                    'sqlite:////var/tmp/runs.db, to checkpoint the flow '
+                    'to. Running again with the same run_id resumes the '
+                    'flow. Not supported by the asyncio engine.'),
+    cfg.StrOpt('run_id',
+               help='Name of the run to checkpoint or resume.'),
 ]
 cfg.CONF.register_opts(task_flow_opts, group='task_flow')
 
 test_params_opts = [
     cfg.StrOpt('api_endpoint', required=True,
                help='URL for the API endpoint to test.'),
+    cfg.StrOpt('mode',
+               default='flow',
+               choices=['flow', 'open_loop', 'mixed', 'churn', 'ramp'],
+               help='flow builds and runs test_flow. open_loop issues '
+                    'operations from [workload] at the [open_loop] rate. '
+                    'mixed runs the [mixed] readers and writers. churn '
+                    'updates and re-creates the resources of an earlier '
+                    'run, see [churn]. ramp steps the [workload] load up '
+                    'until it saturates, see [ramp].'),
     cfg.StrOpt('test_flow', required=True,
                help='Name of test flow to run.'),
     cfg.StrOpt('vip_subnet_id', required=True,
@@ -66,6 +104,10 @@ test_params_opts = [
     cfg.IntOpt('load_balancers',
                default=1, min=1,
                help='Number of load balancers to create.'),
+    cfg.IntOpt('first_load_balancer',
+               default=0, min=0,
+               help='Index of the first load balancer. Used to keep names '
+                    'unique when a run is sharded.'),
     cfg.IntOpt('listeners',
                default=1,
                help='Number of listeners to create.'),
@@ -78,12 +120,318 @@ test_params_opts = [
     cfg.IntOpt('members',
                default=1, min=1, max=65535,
                help='Number of members to create.'),
+    cfg.IntOpt('member_batch_size',
+               default=10, min=1,
+               help='Number of members added per batch update request by '
+                    'batch_members_flow.'),
+    cfg.IntOpt('member_concurrency',
+               default=10, min=1,
+               help='Number of members of a pool compact_members_flow '
+                    'creates at the same time.'),
     cfg.IntOpt('retries_check_active',
                default=5000,
                help='Number retries to check LB for ACTIVE.'),
+    cfg.StrOpt('manifest_file',
+               help='File the IDs of created resources are appended to, '
+                    'one JSON object per line. teardown_flow deletes the '
+                    'load balancers listed in it.'),
+    cfg.StrOpt('profile_file',
+               help='JSON or YAML workload profile giving the shape of the '
+                    'trees profile_flow builds, see tree_profile.'),
 ]
 cfg.CONF.register_opts(test_params_opts, group='test_params')
 
+http_pool_opts = [
+    cfg.IntOpt('pool_size',
+               default=0, min=0,
+               help='Maximum number of pooled connections per host. '
+                    'Zero sizes the pool from [task_flow] max_workers.'),
+    cfg.BoolOpt('keep_alive', default=True,
+                help='Reuse connections between requests. Disabling this '
+                     'opens a new connection for every request.'),
+    cfg.FloatOpt('connect_timeout',
+                 default=10.0,
+                 help='Seconds to wait for a connection to the API.'),
+    cfg.FloatOpt('read_timeout',
+                 default=60.0,
+                 help='Seconds to wait for the API to send a response.'),
+]
+cfg.CONF.register_opts(http_pool_opts, group='http_pool')
+
+status_poller_opts = [
+    cfg.BoolOpt('coalesce', default=True,
+                help='Share one status poller per load balancer between '
+                     'all tasks waiting on it. If False, every wait task '
+                     'polls the API on its own without sleeping.'),
+    cfg.FloatOpt('poll_interval',
+                 default=0.5, min=0,
+                 help='Seconds between status GETs while the load balancer '
+                      'status is changing or new waiters arrive.'),
+    cfg.FloatOpt('max_poll_interval',
+                 default=5.0, min=0,
+                 help='Upper bound for the backed off poll interval.'),
+    cfg.FloatOpt('backoff_factor',
+                 default=1.5, min=1,
+                 help='Multiplier applied to the poll interval each time '
+                      'the status is unchanged.'),
+]
+cfg.CONF.register_opts(status_poller_opts, group='status_poller')
+
+retry_opts = [
+    cfg.StrOpt('policy',
+               default='immediate',
+               choices=['immediate', 'fixed', 'exponential', 'decorrelated'],
+               help='How to space out retries of 409 and 503 responses. '
+                    'immediate retries with no delay, fixed sleeps '
+                    'base_delay, exponential uses full jitter and '
+                    'decorrelated uses decorrelated jitter.'),
+    cfg.FloatOpt('base_delay',
+                 default=0.1, min=0,
+                 help='Base delay in seconds for the retry policy.'),
+    cfg.FloatOpt('max_delay',
+                 default=10.0, min=0,
+                 help='Maximum delay in seconds for the jittered policies.'),
+    cfg.BoolOpt('honor_retry_after', default=False,
+                help='Use the Retry-After response header, when present, '
+                     'instead of the policy delay.'),
+    cfg.IntOpt('max_retries_per_request',
+               default=0, min=0,
+               help='Maximum retries for a single request. Zero is '
+                    'unlimited.'),
+    cfg.IntOpt('global_retry_budget',
+               default=0, min=0,
+               help='Maximum retries across the whole run. Zero is '
+                    'unlimited.'),
+]
+cfg.CONF.register_opts(retry_opts, group='retry')
+
+metrics_opts = [
+    cfg.StrOpt('report_file',
+               help='File to write the JSON metrics report to. If not set '
+                    'the JSON report is printed after the summary table.'),
+]
+cfg.CONF.register_opts(metrics_opts, group='metrics')
+
+event_log_opts = [
+    cfg.StrOpt('file',
+               help='File to write one JSON record per API request to. '
+                    'Sharded runs add the index of the first load balancer '
+                    'of the shard to the name. Disabled when not set.'),
+    cfg.IntOpt('queue_size', default=100000, min=1,
+               help='Records waiting to be written. Records are dropped '
+                    'when the writer falls this far behind.'),
+    cfg.FloatOpt('flush_interval', default=1.0, min=0.01,
+                 help='Seconds between flushes of the file.'),
+]
+cfg.CONF.register_opts(event_log_opts, group='event_log')
+
+contention_opts = [
+    cfg.BoolOpt('enabled', default=True,
+                help='Track 409 and 503 responses per load balancer and '
+                     'print a lock contention report after the run.'),
+    cfg.FloatOpt('interval', default=1.0, min=0.001,
+                 help='Seconds per bucket of the contention timeline.'),
+    cfg.StrOpt('csv_file',
+               help='File to write the contention timeline to as CSV, one '
+                    'row per bucket, load balancer and operation, with '
+                    'Unix timestamps.'),
+]
+cfg.CONF.register_opts(contention_opts, group='contention')
+
+results_opts = [
+    cfg.StrOpt('store_dir', default='~/.stressoctaviaapi/results',
+               help='Directory every run saves its settings and metrics '
+                    'to, compare them with results_store.py. Not saved '
+                    'when empty.'),
+    cfg.StrOpt('label',
+               help='Tag for the saved run. Runs with the same label are '
+                    'compared as repeats of one configuration.'),
+    cfg.IntOpt('min_requests', default=20, min=0,
+               help='Operations with fewer requests in a run are left out '
+                    'of comparisons.'),
+    cfg.FloatOpt('alpha', default=0.05, min=0, max=1,
+                 help='Significance level of the Welch t-test when both '
+                      'sides of a comparison have several runs.'),
+    cfg.FloatOpt('max_latency_increase', default=0.2, min=0,
+                 help='Relative p50, p90 or p99 increase that counts as a '
+                      'regression. 0 disables the check.'),
+    cfg.FloatOpt('max_throughput_drop', default=0.2, min=0, max=1,
+                 help='Relative requests per second drop that counts as a '
+                      'regression. 0 disables the check.'),
+    cfg.FloatOpt('max_conflict_rate_increase', default=0.05, min=0, max=1,
+                 help='Increase of the share of 409 responses that counts '
+                      'as a regression. 0 disables the check.'),
+]
+cfg.CONF.register_opts(results_opts, group='results')
+
+coordinator_opts = [
+    cfg.IntOpt('workers',
+               default=0, min=0,
+               help='Number of local worker processes to shard the load '
+                    'balancers over. Zero or one runs in this process '
+                    'unless agents are configured.'),
+    cfg.ListOpt('agents',
+                default=[],
+                help='URLs of remote agents, e.g. http://10.0.0.5:9800, to '
+                     'shard the load balancers over.'),
+    cfg.FloatOpt('agent_timeout',
+                 default=86400.0,
+                 help='Seconds to wait for a remote agent to finish its '
+                      'shard.'),
+    cfg.BoolOpt('serve_agent', default=False,
+                help='Run as a remote agent waiting for shards from a '
+                     'coordinator instead of running a test.'),
+    cfg.StrOpt('agent_bind_host', default='127.0.0.1',
+               help='Address the agent listens on.'),
+    cfg.PortOpt('agent_port', default=9800,
+                help='Port the agent listens on.'),
+    cfg.StrOpt('agent_secret', secret=True,
+               help='Shared secret the coordinator must present to '
+                    'agents.'),
+]
+cfg.CONF.register_opts(coordinator_opts, group='coordinator')
+
+workload_opts = [
+    cfg.StrOpt('lb_id',
+               help='Existing load balancer to run operations against. A '
+                    'new load balancer, listener and pool are created if '
+                    'lb_id or pool_id is not set.'),
+    cfg.StrOpt('pool_id',
+               help='Existing pool to create members on.'),
+    cfg.StrOpt('name_prefix', default='stress-',
+               help='Prefix for the names of resources the workload '
+                    'creates.'),
+    cfg.StrOpt('member_address_base', default='172.21.0.1',
+               help='First address used for members the workload creates. '
+                    'Every member gets a unique address and port.'),
+    cfg.DictOpt('operations',
+                default={'create_member': '1', 'show_loadbalancer': '4'},
+                help='Operations to issue and their relative weights, one '
+                     'of create_loadbalancer, create_member, '
+                     'update_member, list_loadbalancers, list_members, '
+                     'show_loadbalancer, show_member and show_pool.'),
+    cfg.IntOpt('page_size', default=100, min=1,
+               help='limit used by the list operations. Lists follow the '
+                    'next links to the last page.'),
+]
+cfg.CONF.register_opts(workload_opts, group='workload')
+
+open_loop_opts = [
+    cfg.FloatOpt('rate', default=10.0, min=0.001,
+                 help='Target operations per second.'),
+    cfg.FloatOpt('duration', default=60.0, min=0,
+                 help='Seconds to issue operations for.'),
+    cfg.StrOpt('arrival', default='poisson',
+               choices=['poisson', 'fixed'],
+               help='Inter-arrival times, exponentially distributed '
+                    '(poisson) or constant (fixed).'),
+    cfg.IntOpt('max_outstanding', default=500, min=1,
+               help='Maximum operations in flight. Operations beyond this '
+                    'queue in the client, and the queueing time is '
+                    'included in their latency.'),
+    cfg.IntOpt('seed',
+               help='Random seed for reproducible schedules.'),
+]
+cfg.CONF.register_opts(open_loop_opts, group='open_loop')
+
+mixed_opts = [
+    cfg.IntOpt('concurrency', default=20, min=1,
+               help='Number of reader and writer threads together. Must be '
+                    'at least 2 unless read_ratio is 0 or 1.'),
+    cfg.FloatOpt('read_ratio', default=0.8, min=0, max=1,
+                 help='Share of the threads that read.'),
+    cfg.FloatOpt('duration', default=60.0, min=0,
+                 help='Seconds to run for.'),
+    cfg.DictOpt('read_operations',
+                default={'list_loadbalancers': '1', 'list_members': '2',
+                         'show_loadbalancer': '4', 'show_member': '2',
+                         'show_pool': '1'},
+                help='Read operations and their relative weights, from '
+                     'list_loadbalancers, list_members, show_loadbalancer, '
+                     'show_member and show_pool.'),
+    cfg.DictOpt('write_operations',
+                default={'create_member': '1', 'update_member': '2'},
+                help='Write operations and their relative weights, from '
+                     'create_loadbalancer, create_member and '
+                     'update_member.'),
+    cfg.IntOpt('seed',
+               help='Random seed for reproducible operation choices.'),
+]
+cfg.CONF.register_opts(mixed_opts, group='mixed')
+
+churn_opts = [
+    cfg.StrOpt('name_prefix',
+               help='Churn the load balancers whose name starts with this '
+                    'prefix when [test_params] manifest_file is not set or '
+                    'does not exist.'),
+    cfg.FloatOpt('duration', default=60.0, min=0,
+                 help='Seconds to run for.'),
+    cfg.IntOpt('concurrency_per_lb', default=2, min=1,
+               help='Threads changing each load balancer at the same '
+                    'time.'),
+    cfg.DictOpt('operations',
+                default={'update_member': '4', 'update_pool': '1',
+                         'update_healthmonitor': '1',
+                         'recreate_member': '2'},
+                help='Operations and their relative weights, from '
+                     'update_member, update_pool, update_healthmonitor and '
+                     'recreate_member.'),
+    cfg.FloatOpt('interval', default=5.0, min=0.1,
+                 help='Seconds between throughput and 409 ratio samples.'),
+    cfg.StrOpt('timeline_file',
+               help='File to write the sampled timeline to as JSON.'),
+    cfg.IntOpt('seed',
+               help='Random seed for reproducible operation choices.'),
+]
+cfg.CONF.register_opts(churn_opts, group='churn')
+
+ramp_opts = [
+    cfg.StrOpt('kind', default='concurrency',
+               choices=['concurrency', 'rate'],
+               help='Ramp the number of threads issuing operations back to '
+                    'back, or the [open_loop] target rate.'),
+    cfg.FloatOpt('start', default=1.0, min=0.001,
+                 help='Level of the first step.'),
+    cfg.FloatOpt('step', default=1.0, min=0.001,
+                 help='Increase of the level at each step.'),
+    cfg.FloatOpt('maximum', default=20.0, min=0.001,
+                 help='Highest level to ramp to.'),
+    cfg.FloatOpt('hold', default=30.0, min=0.1,
+                 help='Seconds to hold each step.'),
+    cfg.FloatOpt('max_p99_ms', default=0,
+                 help='Stop after a step with a p99 latency above this. '
+                      '0 disables the check.'),
+    cfg.FloatOpt('max_error_rate', default=0.01, min=0, max=1,
+                 help='Stop after a step with a larger share of failed '
+                      'operations.'),
+    cfg.FloatOpt('linearity', default=0.8, min=0, max=1,
+                 help='Throughput per unit of load, relative to the first '
+                      'step, that still counts as near linear for the '
+                      'knee.'),
+    cfg.StrOpt('report_file',
+               help='File to write the steps and the knee to as JSON.'),
+    cfg.IntOpt('seed',
+               help='Random seed for reproducible operation choices.'),
+]
+cfg.CONF.register_opts(ramp_opts, group='ramp')
+
+teardown_opts = [
+    cfg.StrOpt('name_prefix',
+               help='teardown_flow deletes every load balancer whose name '
+                    'starts with this prefix when [test_params] '
+                    'manifest_file is not set or does not exist.'),
+    cfg.BoolOpt('cascade', default=True,
+                help='Delete each load balancer with a single cascade '
+                     'delete. When False the L7 policies, members, health '
+                     'monitors, pools and listeners are deleted one by one '
+                     'first.'),
+    cfg.IntOpt('concurrency',
+               default=10, min=1,
+               help='Children of a load balancer read or deleted at the same '
+                    'time when cascade is False.'),
+]
+cfg.CONF.register_opts(teardown_opts, group='teardown')
+
 
 def main():
     logging.register_options(cfg.CONF)
@@ -96,23 +444,42 @@ def main():
 
     LOG.debug('***********************Started')
 
-    executor = concurrent.futures.ThreadPoolExecutor(
-        max_workers=CONF.task_flow.max_workers)
-
-    test_flows_cls = test_flows.TestFlows()
-    flow = getattr(test_flows_cls, CONF.test_params.test_flow)()
-
-    eng = tf_engines.load(
-            flow,
-            engine=CONF.task_flow.engine,
-            executor=executor,
-            never_resolve=CONF.task_flow.disable_revert)
-    eng.compile()
-    eng.prepare()
-
-    with tf_logging.DynamicLoggingListener(eng, log=LOG):
+    if CONF.coordinator.serve_agent:
+        coordinator.serve_agent()
+        return
 
-            eng.run()
+    registry = metrics.get_registry()
+    event_log.start()
+    status = 'interrupted'
+    try:
+        try:
+            if CONF.test_params.mode == 'open_loop':
+                open_loop.run()
+            elif CONF.test_params.mode == 'mixed':
+                mixed.run()
+            elif CONF.test_params.mode == 'churn':
+                churn.run()
+            elif CONF.test_params.mode == 'ramp':
+                registry = ramp.run()
+            elif CONF.coordinator.workers > 1 or CONF.coordinator.agents:
+                registry = coordinator.run()
+            else:
+                runner.run_flow(runner.build_flow())
+        except Exception as e:
+            status = 'failed'
+            metrics.record_error(e)
+            raise
+        # Failed shards are errors of the merged registry. churn records
+        # the operations that failed and carries on.
+        if registry.errors and CONF.test_params.mode == 'flow':
+            status = 'failed'
+        else:
+            status = 'completed'
+    finally:
+        event_log.stop()
+        manifest.close()
+        report = metrics.emit_report(registry)
+        results_store.save(report, contention.emit_report(), status)
 
 if __name__ == "__main__":
     main()
@@ -15,14 +15,27 @@
 import keystone_tasks
 import octavia_tasks
 from oslo_config import cfg
+from oslo_log import log as logging
 from taskflow.patterns import linear_flow
 from taskflow.patterns import unordered_flow
+import token_cache
+import tree_profile
+import workload
 
 CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
 
 
 class TestFlows(object):
 
+    def __init__(self):
+        # When set, pools get their members through the batch update API
+        # in batches of this size instead of one create per member.
+        self.member_batch_size = None
+        # When set, each pool gets one CreateMembers task creating this
+        # many members at a time instead of two atoms per member.
+        self.member_concurrency = None
+
     def multiple_members_flow(self):
         """Creates a flow to build an LB with multiple members.
 
@@ -34,19 +47,105 @@ class TestFlows(object):
 
         create_lbs_flow = unordered_flow.Flow('create_lbs_flow')
 
-        for i in range(CONF.test_params.load_balancers):
+        projects = token_cache.projects()
+        first = CONF.test_params.first_load_balancer
+        for i in range(first, first + CONF.test_params.load_balancers):
+            lb_name = 'lb{}'.format(i)
+            project_name = None
+            if len(projects) > 1:
+                project_name = projects[i % len(projects)]
+            create_lbs_flow.add(self._create_lb_subflow(lb_name,
+                                                        project_name))
+
+        base_flow.add(create_lbs_flow)
+
+        return base_flow
+
+    def batch_members_flow(self):
+        """Creates a flow to build an LB with members added in batches.
+
+        Members are created with the pool members batch update API,
+        [test_params] member_batch_size at a time.
+
+        :returns: The flow for creating the lb
+        """
+        self.member_batch_size = CONF.test_params.member_batch_size
+        return self.multiple_members_flow()
+
+    def compact_members_flow(self):
+        """Creates a flow to build an LB with multiple members compactly.
+
+        Sends the same requests as multiple_members_flow, but the members
+        of each pool are created by a single task, up to [test_params]
+        member_concurrency at a time, which keeps very large trees cheap
+        to build and compile.
+
+        :returns: The flow for creating the lb
+        """
+        self.member_concurrency = CONF.test_params.member_concurrency
+        return self.multiple_members_flow()
+
+    def profile_flow(self):
+        """Creates a flow to build LBs shaped by a workload profile.
+
+        The listeners, pools, members, health monitors, L7 policies and
+        rules of every load balancer come from [test_params] profile_file,
+        see tree_profile.  The members are created as by
+        multiple_members_flow, or as by batch_members_flow or
+        compact_members_flow when the profile sets member_creation to
+        batch or compact.
+
+        :returns: The flow for creating the lbs
+        """
+        profile = tree_profile.load()
+        creation = profile.spec.get('member_creation', 'single')
+        if creation == 'batch':
+            self.member_batch_size = CONF.test_params.member_batch_size
+        elif creation == 'compact':
+            self.member_concurrency = CONF.test_params.member_concurrency
+        elif creation != 'single':
+            raise Exception('Unknown member_creation {}, expected single, '
+                            'batch or compact.'.format(creation))
+
+        base_flow = linear_flow.Flow('base_flow')
+
+        base_flow.add(keystone_tasks.GetToken(provides='token'))
+
+        create_lbs_flow = unordered_flow.Flow('create_lbs_flow')
+
+        projects = token_cache.projects()
+        first = CONF.test_params.first_load_balancer
+        shapes = []
+        for i in range(first, first + CONF.test_params.load_balancers):
             lb_name = 'lb{}'.format(i)
-            create_lbs_flow.add(self._create_lb_subflow(lb_name))
+            project_name = None
+            if len(projects) > 1:
+                project_name = projects[i % len(projects)]
+            shapes.append(profile.shape(i))
+            create_lbs_flow.add(self._create_lb_subflow(lb_name,
+                                                        project_name,
+                                                        shapes[-1]))
+
+        LOG.info('Profile trees: {}'.format(', '.join(
+            '{0} {1}'.format(v, k)
+            for k, v in sorted(tree_profile.summarize(shapes).items()))))
 
         base_flow.add(create_lbs_flow)
 
         return base_flow
 
-    def _create_lb_subflow(self, lb_name):
+    def _create_lb_subflow(self, lb_name, project_name=None, shape=None):
 
         create_lb_subflow = linear_flow.Flow(
             'create-{}-subflow'.format(lb_name))
 
+        if project_name:
+            # Shadows the base flow token for the rest of this subflow.
+            create_lb_subflow.add(
+                keystone_tasks.GetToken(name='get-{}-token'.format(lb_name),
+                                        inject={'project_name': project_name},
+                                        provides='token'))
+
         create_lb_subflow.add(
             octavia_tasks.CreateLoadBalancer(name='create-{}'.format(lb_name),
                                              requires='token',
@@ -59,16 +158,22 @@ class TestFlows(object):
         create_listeners_flow = unordered_flow.Flow(
             '{}-create-listeners-flow'.format(lb_name))
 
-        for i in range(CONF.test_params.listeners):
+        if shape is None:
+            listeners = [None] * CONF.test_params.listeners
+        else:
+            listeners = shape['listeners']
+        for i, listener in enumerate(listeners):
             list_name = 'listener{}'.format(i)
             create_listeners_flow.add(
-                self._create_listener_subflow(lb_name, list_name, i+1))
+                self._create_listener_subflow(lb_name, list_name, i+1,
+                                              listener))
 
         create_lb_subflow.add(create_listeners_flow)
 
         return create_lb_subflow
 
-    def _create_listener_subflow(self, lb_name, list_name, list_number):
+    def _create_listener_subflow(self, lb_name, list_name, list_number,
+                                 shape=None):
 
         create_listener_subflow = linear_flow.Flow(
             'create-{0}-{1}-subflow'.format(lb_name, list_name))
@@ -83,21 +188,48 @@ class TestFlows(object):
         create_listener_subflow.add(
             octavia_tasks.WaitForActive(
                 name='wait-{0}-{1}-create'.format(lb_name, list_name),
+                resource_type='listener',
                 requires=('token', 'lb_id')))
 
         create_pools_flow = unordered_flow.Flow(
             '{0}-{1}-create-pools-flow'.format(lb_name, list_name))
 
-        for i in range(CONF.test_params.pools):
+        if shape is None:
+            pools = [None] * CONF.test_params.pools
+        else:
+            pools = shape['pools']
+            for policy in shape['l7policies']:
+                create_pools_flow.add(self._create_l7policy_subflow(
+                    lb_name, list_name, policy))
+        for i, pool in enumerate(pools):
             pool_name = 'pool{}'.format(i)
             create_pools_flow.add(
-                self._create_pool_subflow(lb_name, list_name, pool_name))
+                self._create_pool_subflow(lb_name, list_name, pool_name,
+                                          pool))
 
         create_listener_subflow.add(create_pools_flow)
 
         return create_listener_subflow
 
-    def _create_pool_subflow(self, lb_name, list_name, pool_name):
+    def _create_pool_subflow(self, lb_name, list_name, pool_name,
+                             shape=None):
+        """Creates a pool and its children.
+
+        :param shape: Pool shape of a workload profile, see
+                      tree_profile.Profile.shape.  The pool has
+                      [test_params] members and health_monitors otherwise.
+        """
+        if shape is None:
+            members = CONF.test_params.members
+            health_monitor = CONF.test_params.health_monitors
+            address = '172.21.1.11'
+            policies = []
+        else:
+            members = shape['members']
+            health_monitor = shape['health_monitor']
+            address = shape['address']
+            policies = shape['l7policies']
+        unique = shape is not None
 
         create_pool_subflow = linear_flow.Flow(
             'create-{0}-{1}-{2}-subflow'.format(lb_name, list_name, pool_name))
@@ -115,13 +247,14 @@ class TestFlows(object):
             octavia_tasks.WaitForActive(
                 name='wait-{0}-{1}-{2}-create'.format(
                     lb_name, list_name, pool_name),
+                resource_type='pool',
                 requires=('token', 'lb_id')))
 
         create_pool_children_flow = unordered_flow.Flow(
             '{0}-{1}-{2}-create-children-flow'.format(
                 lb_name, list_name, pool_name))
 
-        if CONF.test_params.health_monitors:
+        if health_monitor:
             create_pool_children_flow.add(octavia_tasks.CreateHealthMonitor(
                 name='create-{0}-{1}-{2}-hm'.format(
                     lb_name, list_name, pool_name),
@@ -131,20 +264,41 @@ class TestFlows(object):
             create_pool_children_flow.add(octavia_tasks.WaitForActive(
                 name='wait-{0}-{1}-{2}-hm-create'.format(
                     lb_name, list_name, pool_name),
+                resource_type='healthmonitor',
                 requires=('token', 'lb_id')))
 
-        for i in range(CONF.test_params.members):
-            member_name = 'member{}'.format(i)
+        if self.member_batch_size:
             create_pool_children_flow.add(
-                self._create_member_subflow(lb_name, list_name,
-                                            pool_name, member_name, i+1))
+                self._create_member_batches_subflow(lb_name, list_name,
+                                                    pool_name, members,
+                                                    address, unique))
+        elif self.member_concurrency:
+            create_pool_children_flow.add(octavia_tasks.CreateMembers(
+                name='create-{0}-{1}-{2}-members'.format(
+                    lb_name, list_name, pool_name),
+                concurrency=self.member_concurrency,
+                unique_addresses=unique,
+                requires=('token', 'lb_id', 'pool_id'),
+                inject={'count': members, 'address': address}))
+        else:
+            for i in range(members):
+                member_name = 'member{}'.format(i)
+                create_pool_children_flow.add(
+                    self._create_member_subflow(
+                        lb_name, list_name, pool_name, member_name, i+1,
+                        octavia_tasks.member_address(address, i, unique)))
+
+        for policy in policies:
+            create_pool_children_flow.add(self._create_l7policy_subflow(
+                lb_name, list_name, policy, pool_name))
 
         create_pool_subflow.add(create_pool_children_flow)
 
         return create_pool_subflow
 
     def _create_member_subflow(self, lb_name, list_name,
-                               pool_name, member_name, member_number):
+                               pool_name, member_name, member_number,
+                               address='172.21.1.11'):
 
         create_member_subflow = linear_flow.Flow(
             'create-{0}-{1}-{2}-{3}-subflow'.format(lb_name, list_name,
@@ -154,13 +308,160 @@ class TestFlows(object):
             name='create-{0}-{1}-{2}-{3}'.format(lb_name, list_name,
                                                  pool_name, member_name),
             requires=('token', 'pool_id'),
-            inject={'name': member_name, 'address': '172.21.1.11',
+            inject={'name': member_name, 'address': address,
                     'port': member_number},
             provides='member_id'))
 
         create_member_subflow.add(octavia_tasks.WaitForActive(
             name='wait-{0}-{1}-{2}-{3}-create'.format(lb_name, list_name,
                                                       pool_name, member_name),
+            resource_type='member',
             requires=('token', 'lb_id')))
 
         return create_member_subflow
+
+    def _create_member_batches_subflow(self, lb_name, list_name, pool_name,
+                                       members, address, unique=False):
+
+        create_batches_subflow = linear_flow.Flow(
+            'create-{0}-{1}-{2}-member-batches-subflow'.format(
+                lb_name, list_name, pool_name))
+
+        for count in range(self.member_batch_size, members +
+                           self.member_batch_size, self.member_batch_size):
+            count = min(count, members)
+            create_batches_subflow.add(octavia_tasks.BatchUpdateMembers(
+                name='create-{0}-{1}-{2}-members-{3}'.format(
+                    lb_name, list_name, pool_name, count),
+                unique_addresses=unique,
+                requires=('token', 'pool_id'),
+                inject={'count': count, 'address': address}))
+
+            create_batches_subflow.add(octavia_tasks.WaitForActive(
+                name='wait-{0}-{1}-{2}-members-{3}-create'.format(
+                    lb_name, list_name, pool_name, count),
+                resource_type='member_batch',
+                requires=('token', 'lb_id')))
+
+        return create_batches_subflow
+
+    def _create_l7policy_subflow(self, lb_name, list_name, policy,
+                                 pool_name=None):
+        """Creates an L7 policy and its rules.
+
+        :param policy: L7 policy shape of a workload profile.
+        :param pool_name: Pool a REDIRECT_TO_POOL policy redirects to, the
+                          subflow must be added below that pool's subflow
+                          so pool_id is its ID.
+        """
+        prefix = '{0}-{1}-{2}'.format(lb_name, list_name, policy['name'])
+        if pool_name:
+            prefix = '{0}-{1}-{2}-{3}'.format(lb_name, list_name, pool_name,
+                                              policy['name'])
+
+        create_l7policy_subflow = linear_flow.Flow(
+            'create-{}-subflow'.format(prefix))
+
+        inject = {'name': policy['name'], 'action': policy['action'],
+                  'redirect_url': policy.get('redirect_url')}
+        create_l7policy_subflow.add(octavia_tasks.CreateL7Policy(
+            name='create-{}'.format(prefix),
+            requires=('token', 'listener_id'),
+            rebind={'redirect_pool_id': 'pool_id'} if pool_name else None,
+            inject=inject,
+            provides='l7policy_id'))
+
+        create_l7policy_subflow.add(octavia_tasks.WaitForActive(
+            name='wait-{}-create'.format(prefix),
+            resource_type='l7policy',
+            requires=('token', 'lb_id')))
+
+        create_rules_flow = unordered_flow.Flow(
+            '{}-create-rules-flow'.format(prefix))
+
+        for i in range(policy['rules']):
+            rule_name = '{0}-rule{1}'.format(prefix, i)
+            create_rule_subflow = linear_flow.Flow(
+                'create-{}-subflow'.format(rule_name))
+            create_rule_subflow.add(octavia_tasks.CreateL7Rule(
+                name='create-{}'.format(rule_name),
+                requires=('token', 'l7policy_id'),
+                inject={'rule_type': policy['rule_type'],
+                        'compare_type': policy['compare_type'],
+                        'value': tree_profile.rule_value(policy, i)},
+                provides='l7rule_id'))
+            create_rule_subflow.add(octavia_tasks.WaitForActive(
+                name='wait-{}-create'.format(rule_name),
+                resource_type='l7rule',
+                requires=('token', 'lb_id')))
+            create_rules_flow.add(create_rule_subflow)
+
+        create_l7policy_subflow.add(create_rules_flow)
+
+        return create_l7policy_subflow
+
+    def teardown_flow(self):
+        """Creates a flow to delete the load balancers of earlier runs.
+
+        The load balancers are read from [test_params] manifest_file when
+        it exists, otherwise every load balancer whose name starts with
+        [teardown] name_prefix is deleted.
+
+        :returns: The flow for deleting the lbs
+        """
+        # Only the load balancers are looked up while building, each tree
+        # is read by the first task deleting it.
+        token = keystone_tasks.GetToken(name='get-discovery-token').execute()
+        lb_ids = workload.find_load_balancers(token,
+                                              CONF.teardown.name_prefix)
+
+        base_flow = linear_flow.Flow('base_flow')
+
+        base_flow.add(keystone_tasks.GetToken(provides='token'))
+
+        delete_lbs_flow = unordered_flow.Flow('delete_lbs_flow')
+
+        for lb_id in lb_ids:
+            if CONF.teardown.cascade:
+                delete_lbs_flow.add(self._delete_lb_subflow(lb_id))
+            else:
+                delete_lbs_flow.add(self._delete_lb_tree_subflow(lb_id))
+
+        base_flow.add(delete_lbs_flow)
+
+        return base_flow
+
+    def _delete_lb_subflow(self, lb_id, cascade=True):
+
+        delete_lb_subflow = linear_flow.Flow(
+            'delete-{}-subflow'.format(lb_id))
+
+        delete_lb_subflow.add(octavia_tasks.DeleteLoadBalancer(
+            name='delete-{}'.format(lb_id),
+            requires='token',
+            inject={'lb_id': lb_id, 'cascade': cascade}))
+        delete_lb_subflow.add(octavia_tasks.WaitForDeleted(
+            name='wait-{}-delete'.format(lb_id),
+            requires='token',
+            inject={'lb_id': lb_id}))
+
+        return delete_lb_subflow
+
+    def _delete_lb_tree_subflow(self, lb_id):
+        """Deletes the children of a load balancer, then the load balancer.
+
+        The tree is read by the first task, so nothing is sent to the API
+        while the flow is built.
+        """
+        delete_tree_subflow = linear_flow.Flow(
+            'delete-{}-tree-subflow'.format(lb_id))
+
+        delete_tree_subflow.add(octavia_tasks.DeleteLoadBalancerChildren(
+            name='delete-{}-children'.format(lb_id),
+            concurrency=CONF.teardown.concurrency,
+            requires='token',
+            inject={'lb_id': lb_id}))
+        delete_tree_subflow.add(self._delete_lb_subflow(lb_id,
+                                                        cascade=False))
+
+        return delete_tree_subflow
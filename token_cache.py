@@ -0,0 +1,235 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Keystone token cache.
+
+Tokens are cached per credentials, project and auth_url.  With
+[token_cache] cache_file set they are also kept on disk, so a new run
+skips Keystone while the cached token is still valid.  A background
+thread authenticates again [token_cache] refresh_margin seconds before a
+token expires.  Tasks keep passing around the token they were given and
+the Octavia tasks send current(token) instead, so a refresh never stalls
+a task that is already running.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+# Seconds to wait before trying again when a refresh fails.
+RETRY_INTERVAL = 30
+
+
+class _Entry(object):
+
+    def __init__(self, project, token, expires_at, fetch=None):
+        self.project = project
+        self.token = token
+        self.expires_at = expires_at
+        self.fetch = fetch
+        self.issued_at = time.time()
+
+    def refresh_at(self):
+        # Short lived tokens are refreshed half way through their life
+        # instead of continuously.
+        margin = min(CONF.token_cache.refresh_margin,
+                     max(self.expires_at - self.issued_at, 0) / 2)
+        return self.expires_at - margin
+
+
+_entries = {}
+_issued = {}
+_lock = threading.RLock()
+_key_locks = {}
+_loaded = False
+_wakeup = threading.Event()
+_refresher = None
+
+
+def parse_expires(value):
+    """Returns the expires_at of a Keystone token as a Unix timestamp."""
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def projects():
+    """Returns the projects load balancers are spread over."""
+    return (CONF.token_cache.projects or
+            [CONF.keystone_authtoken.project_name])
+
+
+def _key(project):
+    auth = CONF.keystone_authtoken
+    return hashlib.sha256(json.dumps(
+        [auth.auth_url, auth.username, auth.password,
+         auth.project_domain_name, project]).encode('utf-8')).hexdigest()
+
+
+def _load():
+    global _loaded
+    _loaded = True
+    path = CONF.token_cache.cache_file
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.warning('Ignoring token cache {0}: {1}'.format(path, e))
+        return
+    for key, value in cached.items():
+        entry = _Entry(value['project'], value['token'], value['expires_at'])
+        _entries[key] = entry
+        _issued[entry.token] = entry
+
+
+def _save():
+    path = CONF.token_cache.cache_file
+    if not path:
+        return
+    cached = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            pass
+    now = time.time()
+    cached = dict((k, v) for k, v in cached.items() if v['expires_at'] > now)
+    for key, entry in _entries.items():
+        cached[key] = {'project': entry.project, 'token': entry.token,
+                       'expires_at': entry.expires_at}
+    tmp = '{0}.{1}'.format(path, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cached, f)
+    os.replace(tmp, path)
+
+
+def cached(project, fetch=None):
+    """Returns a cached token that is not due for refresh, or None.
+
+    :param fetch: See store, adopted by tokens read from the cache file.
+    """
+    with _lock:
+        if not _loaded:
+            _load()
+        entry = _entries.get(_key(project))
+        if entry is None or entry.refresh_at() <= time.time():
+            return None
+        if entry.fetch is None and fetch is not None:
+            entry.fetch = fetch
+            _ensure_refresher()
+        return entry.token
+
+
+def store(project, token, expires_at, fetch=None):
+    """Caches a new token and keeps it refreshed.
+
+    :param expires_at: The Keystone expires_at string of the token.
+    :param fetch: Callable taking a project name and returning a new
+                  (token, expires_at), used for background refreshes.
+    :returns: The token.
+    """
+    with _lock:
+        key = _key(project)
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _entries[key] = _Entry(project, token, 0)
+        entry.token = token
+        entry.expires_at = parse_expires(expires_at)
+        entry.issued_at = time.time()
+        entry.fetch = fetch or entry.fetch
+        _issued[token] = entry
+        _save()
+    _ensure_refresher()
+    return token
+
+
+def get(project, fetch):
+    """Returns a valid token for a project, authenticating if needed.
+
+    Concurrent callers for the same project share one authentication.
+    """
+    token = cached(project, fetch)
+    if token is not None:
+        return token
+    with _lock:
+        key_lock = _key_locks.setdefault(_key(project), threading.Lock())
+    with key_lock:
+        token = cached(project)
+        if token is None:
+            token = store(project, *fetch(project), fetch=fetch)
+        return token
+
+
+def current(token):
+    """Returns the latest token for a token handed out earlier."""
+    entry = _issued.get(token)
+    if entry is None:
+        return token
+    return entry.token
+
+
+def _refresh(entry):
+    try:
+        token, expires_at = entry.fetch(entry.project)
+    except Exception as e:
+        LOG.warning('Refreshing the token for project {0} failed: '
+                    '{1}'.format(entry.project, e))
+        return time.time() + RETRY_INTERVAL
+    store(entry.project, token, expires_at)
+    LOG.info('Refreshed the token for project {}'.format(entry.project))
+    return None
+
+
+def _refresh_loop():
+    retry_at = {}
+    while True:
+        _wakeup.clear()
+        with _lock:
+            due = [e for e in _entries.values() if e.fetch is not None]
+        now = time.time()
+        wait = None
+        for entry in due:
+            at = max(entry.refresh_at(), retry_at.get(entry.project, 0))
+            if at <= now:
+                retry_at[entry.project] = _refresh(entry) or 0
+                at = max(entry.refresh_at(), retry_at[entry.project])
+            wait = at - now if wait is None else min(wait, at - now)
+        _wakeup.wait(max(wait, 1) if wait is not None else None)
+
+
+def _ensure_refresher():
+    global _refresher
+    if CONF.token_cache.refresh_margin <= 0:
+        return
+    with _lock:
+        # Forked workers inherit the thread object but not the thread.
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_loop,
+                                          name='token-refresher')
+            _refresher.daemon = True
+            _refresher.start()
+    _wakeup.set()
@@ -0,0 +1,305 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Workload profiles describing uneven load balancer trees.
+
+A profile is a JSON or YAML file giving the shape of the trees profile_flow
+builds.  Every level, load_balancer, listener, pool and l7policy, has a
+template.  Where a level has children the template gives either a count
+or a list of explicit child shapes, which override the template of the
+child level key by key.  A count is a number or a distribution::
+
+    {"seed": 1,
+     "member_cidr": "10.0.0.0/8",
+     "load_balancer": {"listeners": {"distribution": "uniform",
+                                     "min": 1, "max": 3}},
+     "listener": {"pools": 1,
+                  "l7policies": {"distribution": "pareto", "alpha": 1.2,
+                                 "max": 30}},
+     "pool": {"members": {"distribution": "lognormal", "mu": 1,
+                          "sigma": 2, "max": 2000},
+              "health_monitor": 0.5},
+     "l7policy": {"rules": {"distribution": "choice",
+                            "values": [1, 5, 50], "weights": [8, 3, 1]},
+                  "action": {"REJECT": 1, "REDIRECT_TO_POOL": 3}},
+     "load_balancers": [{"listeners": [{"pools": [{"members": 1000}]}]}]}
+
+Distributions are fixed (value), uniform (min, max), choice (values,
+weights), lognormal (mu, sigma) and pareto (alpha, scale), the last two
+rounded down and clamped to min and max.  health_monitor is a boolean or
+the probability of a pool having one, action a name or names with weights.
+An explicit load_balancers list is used round robin instead of the
+load_balancer template.
+
+Load balancer i is sampled from its own generator seeded with seed and
+i, so the trees are the same in every run, shard and resume.  Its members
+get unique addresses from a block of addresses_per_load_balancer
+addresses of member_cidr.
+"""
+
+import ipaddress
+import json
+import random
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'load_balancer': {'listeners': 1},
+    'listener': {'pools': 1, 'l7policies': 0},
+    'pool': {'members': 1, 'health_monitor': True},
+    'l7policy': {'rules': 1, 'action': 'REJECT', 'rule_type': 'PATH',
+                 'compare_type': 'STARTS_WITH'},
+}
+
+ACTIONS = ('REJECT', 'REDIRECT_TO_URL', 'REDIRECT_TO_POOL')
+
+RULE_VALUES = {
+    'PATH': '/{policy}/rule{i}',
+    'HOST_NAME': 'rule{i}.{policy}.example.com',
+}
+
+
+def sample(spec, rng, where='count'):
+    """Returns a count drawn from a count spec.
+
+    :param spec: A number or a dict naming a distribution.
+    :param where: Where the spec is in the profile, for error messages.
+    """
+    if isinstance(spec, bool):
+        raise Exception('{0}: expected a count, got {1}.'.format(where,
+                                                                 spec))
+    if isinstance(spec, (int, float)):
+        return int(spec)
+    if not isinstance(spec, dict):
+        raise Exception('{0}: expected a count or a distribution, got '
+                        '{1!r}.'.format(where, spec))
+    distribution = spec.get('distribution', 'fixed')
+    try:
+        if distribution == 'fixed':
+            value = spec['value']
+        elif distribution == 'uniform':
+            value = rng.randint(spec['min'], spec['max'])
+        elif distribution == 'choice':
+            value = rng.choices(spec['values'],
+                                weights=spec.get('weights'))[0]
+        elif distribution == 'lognormal':
+            value = rng.lognormvariate(spec['mu'], spec['sigma'])
+        elif distribution == 'pareto':
+            value = spec.get('scale', 1) * rng.paretovariate(spec['alpha'])
+        else:
+            raise Exception('{0}: unknown distribution {1}.'.format(
+                where, distribution))
+    except KeyError as e:
+        raise Exception('{0}: the {1} distribution needs {2}.'.format(
+            where, distribution, e))
+    value = max(int(value), spec.get('min', 0))
+    if spec.get('max') is not None:
+        value = min(value, spec['max'])
+    return value
+
+
+def _choose(spec, rng):
+    """Returns a name from a name or a mapping of names to weights."""
+    if isinstance(spec, dict):
+        names = sorted(spec)
+        return rng.choices(names, weights=[spec[n] for n in names])[0]
+    return spec
+
+
+class _Addresses(object):
+    """Hands out the member addresses of one load balancer."""
+
+    def __init__(self, network, first, size):
+        self.network = network
+        self.next = first
+        self.end = first + size
+
+    def take(self, count):
+        if self.next + count > self.end:
+            raise Exception('The members of a load balancer need more than '
+                            'addresses_per_load_balancer addresses.')
+        address = self.network[self.next]
+        self.next += count
+        return str(address)
+
+
+class Profile(object):
+    """A parsed profile that builds the shape of load balancer i."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.seed = spec.get('seed', 0)
+        self.templates = {}
+        for level, defaults in DEFAULTS.items():
+            template = dict(defaults)
+            template.update(spec.get(level) or {})
+            self.templates[level] = template
+        self.load_balancers = spec.get('load_balancers') or []
+        self.network = ipaddress.ip_network(
+            spec.get('member_cidr', '10.0.0.0/8'))
+        self.block = spec.get('addresses_per_load_balancer', 65536)
+        if self.block > self.network.num_addresses:
+            raise Exception('addresses_per_load_balancer is larger than '
+                            'member_cidr.')
+
+    def _template(self, level, explicit):
+        result = dict(self.templates[level])
+        result.update(explicit)
+        return result
+
+    def _children(self, shape, key, level, rng, where):
+        value = shape[key]
+        if isinstance(value, list):
+            return [self._template(level, child) for child in value]
+        count = sample(value, rng, '{0}.{1}'.format(where, key))
+        return [dict(self.templates[level]) for _ in range(count)]
+
+    def shape(self, index):
+        """Returns the tree of load balancer index as plain dicts.
+
+        A load balancer has listeners, a listener has pools and the L7
+        policies that don't redirect to a pool, a pool has a member count,
+        the address of its first member, health_monitor and the L7
+        policies redirecting to it.  REDIRECT_TO_POOL policies of
+        listeners without pools become REJECT policies.
+        """
+        rng = random.Random('{0}/{1}'.format(self.seed, index))
+        blocks = self.network.num_addresses // self.block
+        # Skips the network address of the block.
+        addresses = _Addresses(self.network,
+                               (index % blocks) * self.block + 1,
+                               self.block - 2)
+        if self.load_balancers:
+            lb = self._template(
+                'load_balancer',
+                self.load_balancers[index % len(self.load_balancers)])
+        else:
+            lb = dict(self.templates['load_balancer'])
+        where = 'load_balancer'
+        listeners = []
+        for listener in self._children(lb, 'listeners', 'listener', rng,
+                                       where):
+            listeners.append(self._listener(listener, rng, addresses,
+                                            where + '.listener'))
+        return {'listeners': listeners}
+
+    def _listener(self, listener, rng, addresses, where):
+        pools = []
+        for pool in self._children(listener, 'pools', 'pool', rng, where):
+            members = sample(pool['members'], rng, where + '.pool.members')
+            health_monitor = pool['health_monitor']
+            if not isinstance(health_monitor, bool):
+                health_monitor = rng.random() < health_monitor
+            pools.append({'members': members,
+                          'address': addresses.take(members),
+                          'health_monitor': health_monitor,
+                          'l7policies': []})
+        policies = []
+        for i, policy in enumerate(self._children(
+                listener, 'l7policies', 'l7policy', rng, where)):
+            policy = self._l7policy(policy, 'l7policy{}'.format(i), rng,
+                                    len(pools), where + '.l7policy')
+            if policy['action'] == 'REDIRECT_TO_POOL':
+                pools[policy.pop('redirect_pool')]['l7policies'].append(
+                    policy)
+            else:
+                policies.append(policy)
+        return {'pools': pools, 'l7policies': policies}
+
+    def _l7policy(self, policy, name, rng, pools, where):
+        action = _choose(policy['action'], rng)
+        if action not in ACTIONS:
+            raise Exception('{0}.action: unknown action {1}.'.format(
+                where, action))
+        if policy['rule_type'] not in RULE_VALUES:
+            raise Exception('{0}.rule_type must be one of {1}.'.format(
+                where, ', '.join(sorted(RULE_VALUES))))
+        result = {'name': name, 'action': action,
+                  'rules': sample(policy['rules'], rng, where + '.rules'),
+                  'rule_type': policy['rule_type'],
+                  'compare_type': policy['compare_type']}
+        if action == 'REDIRECT_TO_POOL':
+            if pools:
+                result['redirect_pool'] = policy.get(
+                    'redirect_pool', rng.randrange(pools)) % pools
+            else:
+                result['action'] = 'REJECT'
+        elif action == 'REDIRECT_TO_URL':
+            result['redirect_url'] = policy.get(
+                'redirect_url', 'http://www.example.com/{}'.format(name))
+        return result
+
+
+def rule_value(policy, i):
+    """Returns the value matched by rule i of an L7 policy shape."""
+    return RULE_VALUES[policy['rule_type']].format(policy=policy['name'],
+                                                   i=i)
+
+
+def summarize(shapes):
+    """Returns object counts of a list of load balancer shapes."""
+    result = {'load_balancers': len(shapes), 'listeners': 0, 'pools': 0,
+              'members': 0, 'health_monitors': 0, 'l7policies': 0,
+              'l7rules': 0, 'largest_pool': 0, 'largest_load_balancer': 0}
+    for lb in shapes:
+        objects = 0
+        for listener in lb['listeners']:
+            policies = list(listener['l7policies'])
+            for pool in listener['pools']:
+                policies.extend(pool['l7policies'])
+                result['members'] += pool['members']
+                result['health_monitors'] += pool['health_monitor']
+                result['largest_pool'] = max(result['largest_pool'],
+                                             pool['members'])
+                objects += 1 + pool['members'] + pool['health_monitor']
+            result['listeners'] += 1
+            result['pools'] += len(listener['pools'])
+            result['l7policies'] += len(policies)
+            rules = sum(p['rules'] for p in policies)
+            result['l7rules'] += rules
+            objects += 1 + len(policies) + rules
+        result['largest_load_balancer'] = max(
+            result['largest_load_balancer'], objects)
+    return result
+
+
+def load(path=None):
+    """Reads a profile file, [test_params] profile_file by default.
+
+    Files ending in .yaml or .yml need PyYAML, anything else is JSON.
+    """
+    path = path or CONF.test_params.profile_file
+    if not path:
+        raise Exception('profile_flow needs [test_params] profile_file.')
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise Exception('Reading {} needs PyYAML, install it or use '
+                                'a JSON profile.'.format(path))
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    if not isinstance(spec, dict):
+        raise Exception('Profile {} is not a mapping.'.format(path))
+    LOG.info('Loaded workload profile {}'.format(path))
+    return Profile(spec)
@@ -0,0 +1,242 @@
+# Copyright 2017 Rackspace, US Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Individual API operations for the load generating modes.
+
+The flow based runs build one tree and stop.  The open loop, ramp and
+similar modes instead issue single operations against an existing load
+balancer, listener and pool, which is either configured in [workload] or
+created once before the load starts.
+"""
+
+import bisect
+import ipaddress
+import itertools
+import os
+import random
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+import keystone_tasks
+import manifest
+import octavia_tasks
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+class Target(object):
+    """The resources operations are issued against."""
+
+    def __init__(self, token, lb_id, pool_id):
+        self.token = token
+        self.lb_id = lb_id
+        self.pool_id = pool_id
+        self.member_ids = []
+        # Random choices of the operations, seeded by the mode.
+        self.rng = random.Random()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def next_number(self):
+        with self._lock:
+            return next(self._counter)
+
+    def add_member(self, member_id):
+        with self._lock:
+            self.member_ids.append(member_id)
+
+    def random_member(self):
+        """Returns the ID of a member created by the workload, or None."""
+        with self._lock:
+            if not self.member_ids:
+                return None
+            return self.rng.choice(self.member_ids)
+
+    def member_address(self, number):
+        """Returns a unique member address and port for a number."""
+        base = ipaddress.ip_address(CONF.workload.member_address_base)
+        return str(base + number // 65535), number % 65535 + 1
+
+
+def prepare_target(token=None):
+    """Returns the Target from [workload] or creates a new one.
+
+    :param token: Token to use, one is requested if not given.
+    """
+    if token is None:
+        token = keystone_tasks.GetToken(name='get-token').execute()
+    if CONF.workload.lb_id and CONF.workload.pool_id:
+        return Target(token, CONF.workload.lb_id, CONF.workload.pool_id)
+
+    prefix = CONF.workload.name_prefix
+    LOG.info('Creating the load balancer, listener and pool to run the '
+             'workload against')
+    wait = octavia_tasks.WaitForActive(name='wait-setup')
+    lb_id = octavia_tasks.CreateLoadBalancer(
+        name='create-setup-lb').execute(token, '{}lb'.format(prefix))
+    wait.execute(token, lb_id)
+    listener_id = octavia_tasks.CreateListener(
+        name='create-setup-listener').execute(
+            token, '{}listener'.format(prefix), lb_id, 80)
+    wait.execute(token, lb_id)
+    pool_id = octavia_tasks.CreatePool(name='create-setup-pool').execute(
+        token, '{}pool'.format(prefix), listener_id)
+    wait.execute(token, lb_id)
+    LOG.info('Workload target is load balancer {0}, pool {1}'.format(
+        lb_id, pool_id))
+    return Target(token, lb_id, pool_id)
+
+
+def find_load_balancers(token, name_prefix=None):
+    """Returns the IDs of the load balancers of earlier runs.
+
+    They are read from [test_params] manifest_file when it exists,
+    otherwise every load balancer whose name starts with name_prefix is
+    returned.
+    """
+    manifest_file = CONF.test_params.manifest_file
+    if manifest_file and os.path.exists(manifest_file):
+        lb_ids = []
+        for record in manifest.load(manifest_file):
+            if record['kind'] == 'loadbalancer' and record['id'] not in lb_ids:
+                lb_ids.append(record['id'])
+        LOG.info('Found {0} load balancers in {1}'.format(
+            len(lb_ids), manifest_file))
+        return lb_ids
+    if not name_prefix:
+        raise Exception('Set [test_params] manifest_file or a name prefix '
+                        'to select the load balancers of earlier runs.')
+    lbs = octavia_tasks.ListResources(name='list-lbs').execute(
+        token, 'loadbalancers')
+    lb_ids = [lb['id'] for lb in lbs
+              if lb['name'].startswith(name_prefix) and
+              lb['provisioning_status'] not in ('PENDING_DELETE', 'DELETED')]
+    LOG.info('Found {0} load balancers named {1}*'.format(len(lb_ids),
+                                                          name_prefix))
+    return lb_ids
+
+
+def create_loadbalancer(target):
+    task = octavia_tasks.CreateLoadBalancer(name='create-workload-lb')
+    return task.execute(target.token, '{0}lb{1}'.format(
+        CONF.workload.name_prefix, target.next_number()))
+
+
+def create_member(target):
+    number = target.next_number()
+    address, port = target.member_address(number)
+    task = octavia_tasks.CreateMember(name='create-workload-member')
+    member_id = task.execute(target.token, 'member{}'.format(number),
+                             target.pool_id, address, port)
+    target.add_member(member_id)
+    return member_id
+
+
+def update_member(target):
+    member_id = target.random_member()
+    if member_id is None:
+        return create_member(target)
+    task = octavia_tasks.UpdateResource(name='update-workload-member')
+    return task.execute(target.token,
+                        'pools/{}/members'.format(target.pool_id), member_id,
+                        {'weight': target.rng.randint(1, 256)})
+
+
+def show_loadbalancer(target):
+    task = octavia_tasks.GetLoadBalancerStatus(name='show-workload-lb')
+    return task.execute(target.token, target.lb_id)
+
+
+def show_pool(target):
+    task = octavia_tasks.ShowResource(name='show-workload-pool')
+    return task.execute(target.token, 'pools', target.pool_id)
+
+
+def show_member(target):
+    member_id = target.random_member()
+    if member_id is None:
+        return show_pool(target)
+    task = octavia_tasks.ShowResource(name='show-workload-member')
+    return task.execute(target.token,
+                        'pools/{}/members'.format(target.pool_id), member_id)
+
+
+def list_loadbalancers(target):
+    task = octavia_tasks.ListResources(name='list-workload-lbs')
+    return task.execute(target.token, 'loadbalancers',
+                        {'limit': CONF.workload.page_size})
+
+
+def list_members(target):
+    task = octavia_tasks.ListResources(name='list-workload-members')
+    return task.execute(target.token,
+                        'pools/{}/members'.format(target.pool_id),
+                        {'limit': CONF.workload.page_size,
+                         'operating_status': 'ONLINE',
+                         'fields': ['id', 'name', 'address',
+                                    'protocol_port']})
+
+
+READ_OPERATIONS = {
+    'list_loadbalancers': list_loadbalancers,
+    'list_members': list_members,
+    'show_loadbalancer': show_loadbalancer,
+    'show_member': show_member,
+    'show_pool': show_pool,
+}
+
+WRITE_OPERATIONS = {
+    'create_loadbalancer': create_loadbalancer,
+    'create_member': create_member,
+    'update_member': update_member,
+}
+
+OPERATIONS = dict(READ_OPERATIONS, **WRITE_OPERATIONS)
+
+
+class OperationMix(object):
+    """Picks operations at random according to configured weights.
+
+    :param weights: dict of operation name to weight.
+    """
+
+    def __init__(self, weights, operations=None):
+        operations = operations or OPERATIONS
+        self.names = []
+        self._cumulative = []
+        total = 0.0
+        for name, weight in sorted(weights.items()):
+            if name not in operations:
+                raise Exception('Unknown operation {0}, valid operations '
+                                'are {1}'.format(
+                                    name, ', '.join(sorted(operations))))
+            weight = float(weight)
+            if weight <= 0:
+                continue
+            total += weight
+            self.names.append(name)
+            self._cumulative.append(total)
+        if not self.names:
+            raise Exception('The operation mix has no operations.')
+        self._total = total
+        self._operations = operations
+
+    def choose(self, rng=random):
+        """Returns (name, callable) of a randomly chosen operation."""
+        i = bisect.bisect_right(self._cumulative, rng.random() * self._total)
+        name = self.names[min(i, len(self.names) - 1)]
+        return name, self._operations[name]